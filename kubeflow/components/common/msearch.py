@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+from typing import Any, Dict, List, Optional
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+
+
+"""
+Helper for sending queries through Elasticsearch multisearch API shared by the
+components that build the training dataset and that validate models.
+"""
+
+
+class AdaptiveBatcher:
+    """
+    Decides how many queries to aggregate in each multisearch request and sends them.
+
+    If `target_latency` is set then the batch size is adapted after each response so
+    requests take around that many seconds. Requests that time out or are rejected by
+    Elasticsearch with status 429 are split in halves and retried with exponential
+    backoff; when only some of the searches of a request are rejected, just those are
+    sent again. Failed requests are counted over all the retries and splits of a call
+    to `msearch`, which gives up once there are more than `max_retries` of them.
+
+    Args
+    ----
+      batch_size: int
+          How many queries to aggregate in each request. It's the initial value when
+          `target_latency` is set.
+      min_batch_size: int
+      max_batch_size: int
+      target_latency: Optional[float]
+          Seconds each request should take to be answered.
+      max_payload: Optional[int]
+          Maximum size in bytes of the body of each request, see `fits`. A single
+          search larger than it is still sent on its own.
+      max_retries: int
+          How many failed requests each call to `msearch` retries before giving up.
+      backoff: float
+          Seconds to wait before the first retry. It doubles on each failed request.
+      request_timeout: int
+          Seconds to wait for each response.
+    """
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        min_batch_size: int = 1,
+        max_batch_size: int = 10000,
+        target_latency: Optional[float] = None,
+        max_payload: Optional[int] = None,
+        max_retries: int = 10,
+        backoff: float = 1.0,
+        request_timeout: int = 60
+    ):
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_latency = target_latency
+        self.max_payload = max_payload
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.request_timeout = request_timeout
+        # Requests may be sent concurrently from several threads.
+        self._lock = threading.Lock()
+
+    def is_full(self, queries: int, payload: int = 0) -> bool:
+        """
+        Returns whether a batch with `queries` searches summing `payload` bytes should
+        be sent already.
+        """
+        if queries >= self.batch_size:
+            return True
+        return self.max_payload is not None and payload >= self.max_payload
+
+    def fits(self, payload: int, size: int) -> bool:
+        """
+        Returns whether a search of `size` bytes can be added to a batch summing
+        `payload` bytes without going over `max_payload`.
+        """
+        return self.max_payload is None or payload + size <= self.max_payload
+
+    def msearch(self, es_client: Elasticsearch, search_arr: List[str]) -> Dict[str, Any]:
+        """
+        Sends queries against Elasticsearch.
+
+        Args
+        ----
+          es_client: Elasticsearch
+              Python Elasticsearch client
+          search_arr: List[str]
+              Header and body of each search, as expected by the multisearch API.
+
+        Returns
+        -------
+          response: Dict[str, Any]
+              Multisearch response with one item in `responses` for each search.
+        """
+        return {'responses': self._send(es_client, search_arr, [0])}
+
+    def _send(
+        self,
+        es_client: Elasticsearch,
+        search_arr: List[str],
+        failures: List[int]
+    ) -> List[Dict[str, Any]]:
+        """
+        `failures` holds how many requests failed so far. It's shared by every request
+        of the same call to `msearch` so a batch that keeps failing can't be split and
+        retried indefinitely.
+        """
+        queries = len(search_arr) // 2
+        start = time.perf_counter()
+        try:
+            response = es_client.msearch(body=os.linesep.join(search_arr),
+                                         request_timeout=self.request_timeout)
+        except (ConnectionTimeout, TransportError) as error:
+            if not self._should_retry(error) or failures[0] >= self.max_retries:
+                raise
+            self._resize(self.batch_size // 2)
+            # Splitting is enough for a request too large to answer in time but
+            # rejections mean the cluster is overloaded, so it's given time to recover.
+            if queries == 1 or not isinstance(error, ConnectionTimeout):
+                time.sleep(self.backoff * 2 ** failures[0])
+            failures[0] += 1
+            if queries > 1:
+                half = (queries // 2) * 2
+                return (self._send(es_client, search_arr[:half], failures) +
+                        self._send(es_client, search_arr[half:], failures))
+            return self._send(es_client, search_arr, failures)
+
+        self._observe(queries, time.perf_counter() - start)
+        responses = response['responses']
+        rejected = [idx for idx, resp in enumerate(responses)
+                    if resp.get('status') == 429]
+        if rejected:
+            if failures[0] >= self.max_retries:
+                raise TransportError(429, 'Searches rejected by Elasticsearch',
+                                     responses[rejected[0]])
+            self._resize(self.batch_size // 2)
+            time.sleep(self.backoff * 2 ** failures[0])
+            failures[0] += 1
+            retried = self._send(
+                es_client,
+                [line for idx in rejected for line in search_arr[2 * idx:2 * idx + 2]],
+                failures
+            )
+            for idx, resp in zip(rejected, retried):
+                responses[idx] = resp
+        return responses
+
+    @staticmethod
+    def _should_retry(error: TransportError) -> bool:
+        return isinstance(error, ConnectionTimeout) or error.status_code == 429
+
+    def _observe(self, queries: int, latency: float) -> None:
+        if self.target_latency is None or not queries or latency <= 0:
+            return
+        ideal = self.target_latency * queries / latency
+        # Smooths out the noise of single responses and avoids growing too fast.
+        self._resize(int((self.batch_size + min(ideal, 2 * self.batch_size)) / 2))
+
+    def _resize(self, batch_size: int) -> None:
+        if self.target_latency is None:
+            return
+        with self._lock:
+            self.batch_size = max(self.min_batch_size,
+                                  min(self.max_batch_size, batch_size))
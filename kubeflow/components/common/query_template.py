@@ -0,0 +1,68 @@
+import re
+import json
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+"""
+Compiled Elasticsearch query templates. A query is parsed and serialized only once;
+rendering it just splices the serialized parameters in between the invariant parts of
+the template.
+"""
+
+
+# Structural braces of serialized JSON are always followed by a quote or by another
+# brace so only placeholders and literal braces in strings match.
+PLACEHOLDER = re.compile(r'"\{(\w+)\}"|\{(\w+)\}')
+
+
+class QueryTemplate:
+    """
+    Template of a query in which placeholders are replaced by parameters. Two kinds of
+    placeholders are supported:
+
+        {"params": "{search_keys}"}: the whole string is replaced by the parameter
+            serialized as JSON, so it can be any JSON value.
+        {"query": "shoes for {query}"}: the placeholder is replaced by the parameter as
+            text, escaped so quotes and backslashes don't break the JSON.
+
+    Only the placeholders in `names` are replaced, so braces in other strings of the
+    query, such as in a script source, are kept as they are.
+
+    Args
+    ----
+      query: Dict[str, Any]
+          Parsed query with placeholders.
+      names: Iterable[str]
+          Names of the placeholders.
+    """
+    def __init__(self, query: Dict[str, Any], names: Iterable[str]):
+        names = set(names)
+        serialized = json.dumps(query)
+        self._literals: List[str] = []
+        self._placeholders: List[Tuple[str, bool]] = []
+        start = 0
+        for match in PLACEHOLDER.finditer(serialized):
+            name = match.group(1) or match.group(2)
+            if name not in names:
+                continue
+            self._literals.append(serialized[start:match.start()])
+            self._placeholders.append((name, match.group(1) is not None))
+            start = match.end()
+        self._literals.append(serialized[start:])
+        self.names = {name for name, _ in self._placeholders}
+
+    @classmethod
+    def from_file(cls, path: str, names: Iterable[str]) -> 'QueryTemplate':
+        return cls(json.loads(open(path).read()), names)
+
+    def render(self, **params: Any) -> str:
+        """
+        Returns the serialized query with each placeholder replaced by its value in
+        `params`.
+        """
+        parts = [self._literals[0]]
+        for (name, whole), literal in zip(self._placeholders, self._literals[1:]):
+            value = json.dumps(params[name] if whole else str(params[name]))
+            parts.append(value if whole else value[1:-1])
+            parts.append(literal)
+        return ''.join(parts)
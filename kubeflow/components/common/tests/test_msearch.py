@@ -0,0 +1,126 @@
+import mock
+import pytest
+from elasticsearch.exceptions import ConnectionTimeout, TransportError
+
+from msearch import AdaptiveBatcher
+
+
+def build_search_arr(queries):
+    return [line for idx in range(queries) for line in ('{}', f'{{"q": {idx}}}')]
+
+
+def build_response(body):
+    return {'responses': [{'q': line} for line in body.split('\n')[1::2]]}
+
+
+def test_msearch_fixed_size():
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = lambda body, request_timeout: build_response(body)
+    batcher = AdaptiveBatcher(batch_size=2)
+
+    assert not batcher.is_full(1)
+    assert batcher.is_full(2)
+    response = batcher.msearch(es_client, build_search_arr(2))
+    assert response == {'responses': [{'q': '{"q": 0}'}, {'q': '{"q": 1}'}]}
+    es_client.msearch.assert_called_with(body='{}\n{"q": 0}\n{}\n{"q": 1}',
+                                         request_timeout=60)
+    assert batcher.batch_size == 2
+
+
+def test_is_full_payload():
+    batcher = AdaptiveBatcher(batch_size=10, max_payload=100)
+    assert not batcher.is_full(1, 99)
+    assert batcher.is_full(1, 100)
+
+
+def test_fits():
+    batcher = AdaptiveBatcher(batch_size=10, max_payload=100)
+    assert batcher.fits(60, 40)
+    assert not batcher.fits(60, 41)
+    assert AdaptiveBatcher().fits(10 ** 9, 1)
+
+
+def test_msearch_adapts_batch_size(monkeypatch):
+    clock = iter([0, 1, 10, 12])
+    monkeypatch.setattr('msearch.time.perf_counter', lambda: next(clock))
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = lambda body, request_timeout: build_response(body)
+    batcher = AdaptiveBatcher(batch_size=10, target_latency=4)
+
+    # Request was 4 times faster than target but size can at most double.
+    batcher.msearch(es_client, build_search_arr(10))
+    assert batcher.batch_size == 15
+    # 15 queries in 2 seconds, ideally 30 would fit in the target.
+    batcher.msearch(es_client, build_search_arr(15))
+    assert batcher.batch_size == 22
+
+
+def test_msearch_splits_on_timeout(monkeypatch):
+    monkeypatch.setattr('msearch.time.sleep', mock.Mock())
+
+    def msearch(body, request_timeout):
+        if body.count('\n') > 2:
+            raise ConnectionTimeout('TIMEOUT', 'timed out', None)
+        return build_response(body)
+
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = msearch
+    batcher = AdaptiveBatcher(batch_size=4, target_latency=10)
+
+    response = batcher.msearch(es_client, build_search_arr(3))
+    assert [resp['q'] for resp in response['responses']] == [
+        '{"q": 0}', '{"q": 1}', '{"q": 2}'
+    ]
+    assert batcher.batch_size < 4
+
+
+def test_msearch_retries_rejected_searches(monkeypatch):
+    sleep_mock = mock.Mock()
+    monkeypatch.setattr('msearch.time.sleep', sleep_mock)
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = [
+        {'responses': [{'q': 0}, {'status': 429}, {'q': 2}]},
+        TransportError(429, 'es_rejected_execution_exception', {}),
+        {'responses': [{'q': 1}]}
+    ]
+    batcher = AdaptiveBatcher(backoff=0.5)
+
+    response = batcher.msearch(es_client, build_search_arr(3))
+    assert response == {'responses': [{'q': 0}, {'q': 1}, {'q': 2}]}
+    es_client.msearch.assert_called_with(body='{}\n{"q": 1}', request_timeout=60)
+    assert sleep_mock.call_args_list == [mock.call(0.5), mock.call(1.0)]
+
+
+def test_msearch_gives_up():
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = TransportError(400, 'bad request', {})
+    with pytest.raises(TransportError):
+        AdaptiveBatcher().msearch(es_client, build_search_arr(2))
+
+    es_client.msearch.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+    with pytest.raises(ConnectionTimeout):
+        AdaptiveBatcher(max_retries=0).msearch(es_client, build_search_arr(1))
+
+
+def test_msearch_retry_budget(monkeypatch):
+    sleep_mock = mock.Mock()
+    monkeypatch.setattr('msearch.time.sleep', sleep_mock)
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = TransportError(429, 'es_rejected_execution', {})
+
+    # Failures of the halves count towards the same budget as the whole request.
+    with pytest.raises(TransportError):
+        AdaptiveBatcher(max_retries=3, backoff=0.5).msearch(es_client,
+                                                            build_search_arr(8))
+    assert es_client.msearch.call_count == 4
+    # Requests rejected as a whole back off before being split.
+    assert sleep_mock.call_args_list == [mock.call(0.5), mock.call(1.0), mock.call(2.0)]
+
+    sleep_mock.reset_mock()
+    es_client.reset_mock()
+    es_client.msearch.side_effect = ConnectionTimeout('TIMEOUT', 'timed out', None)
+    with pytest.raises(ConnectionTimeout):
+        AdaptiveBatcher(max_retries=2).msearch(es_client, build_search_arr(4))
+    assert es_client.msearch.call_count == 3
+    # Timed out requests are split right away.
+    sleep_mock.assert_not_called()
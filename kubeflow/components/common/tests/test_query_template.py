@@ -0,0 +1,53 @@
+import json
+
+from query_template import QueryTemplate
+
+
+def test_render():
+    query = {
+        'query': {'match': {'name': '{query}', 'description': 'shoes for {query}'}},
+        'size': '{size}',
+        'params': '{search_keys}',
+        'boost': 2
+    }
+    template = QueryTemplate(query, ['query', 'size', 'search_keys'])
+
+    assert template.names == {'query', 'size', 'search_keys'}
+    search_keys = {'search_term': 'keyword', 'channel_group': 'organic'}
+    rendered = template.render(query='keyword', size=10, search_keys=search_keys)
+    assert rendered == json.dumps({
+        'query': {'match': {'name': 'keyword', 'description': 'shoes for keyword'}},
+        'size': 10,
+        'params': search_keys,
+        'boost': 2
+    })
+
+
+def test_render_escapes_text():
+    template = QueryTemplate({'query': {'match': {'name': '{query}'}}}, ['query'])
+
+    search_term = 'tv 42" \\ {size}'
+    rendered = template.render(query=search_term)
+    assert json.loads(rendered) == {'query': {'match': {'name': search_term}}}
+
+
+def test_render_without_placeholders():
+    query = {'query': {'match_all': {}}, 'size': 1}
+    assert QueryTemplate(query, []).render() == json.dumps(query)
+
+
+def test_render_keeps_literal_braces():
+    query = {
+        'query': {'match': {'name': '{query}'}},
+        'script': {'source': 'params.{field} + {query}', 'lang': '{painless}'},
+        'phrase': 'tv {42"}'
+    }
+    template = QueryTemplate(query, ['query'])
+
+    assert template.names == {'query'}
+    rendered = json.loads(template.render(query='shoes'))
+    assert rendered == {
+        'query': {'match': {'name': 'shoes'}},
+        'script': {'source': 'params.{field} + shoes', 'lang': '{painless}'},
+        'phrase': 'tv {42"}'
+    }
@@ -0,0 +1,101 @@
+import os
+import threading
+import contextlib
+
+import pytest
+
+from transfer import download_blobs
+
+
+class FakeBlob:
+    def __init__(self, name, content, client):
+        self.name = name
+        self.content = content
+        self.client = client
+
+    def download_to_filename(self, path):
+        if self.content is None:
+            raise IOError(f'Failed to download {self.name}')
+        with open(path, 'w') as f:
+            f.write(self.content)
+        self.client.downloaded.append(self.name)
+
+    def delete(self):
+        assert self.client.batches[-1] is not None, 'deletes should be batched'
+        self.client.batches[-1].append(self.name)
+        self.client.blobs.pop(self.name)
+
+
+class FakeBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def list_blobs(self, prefix):
+        return [blob for name, blob in sorted(self.client.blobs.items())
+                if name.startswith(prefix)]
+
+
+class FakeStorageClient:
+    def __init__(self, contents):
+        self.blobs = {name: FakeBlob(name, content, self)
+                      for name, content in contents.items()}
+        self.downloaded = []
+        self.batches = [None]
+
+    def bucket(self, name):
+        return FakeBucket(self)
+
+    @contextlib.contextmanager
+    def batch(self):
+        self.batches.append([])
+        yield
+        self.batches.append(None)
+
+
+def test_download_blobs(tmpdir_factory):
+    tmp_dir = str(tmpdir_factory.mktemp('unittest'))
+    contents = {f'train/00{idx}.gz': f'content {idx}' for idx in range(5)}
+    contents['other/000.gz'] = 'other'
+    client = FakeStorageClient(contents)
+    landed = []
+    lock = threading.Lock()
+
+    def on_download(path):
+        with lock:
+            landed.append(path)
+
+    paths = download_blobs(client, 'bucket', 'train', tmp_dir,
+                           filename=lambda name: f"judgments_{name.split('/')[-1]}",
+                           max_workers=3, delete_batch_size=2, on_download=on_download)
+
+    assert paths == [f'{tmp_dir}/judgments_00{idx}.gz' for idx in range(5)]
+    assert sorted(landed) == paths
+    for idx, path in enumerate(paths):
+        assert open(path).read() == f'content {idx}'
+    batches = [batch for batch in client.batches if batch is not None]
+    assert batches == [['train/000.gz', 'train/001.gz'],
+                       ['train/002.gz', 'train/003.gz'],
+                       ['train/004.gz']]
+    assert list(client.blobs) == ['other/000.gz']
+
+
+def test_download_blobs_keeps_blobs_on_failure(tmpdir_factory):
+    tmp_dir = str(tmpdir_factory.mktemp('unittest'))
+    client = FakeStorageClient({'validation000.gz': 'content',
+                                'validation001.gz': None})
+
+    with pytest.raises(IOError):
+        download_blobs(client, 'bucket', 'validation', tmp_dir)
+
+    assert sorted(client.blobs) == ['validation000.gz', 'validation001.gz']
+    assert os.path.isfile(f'{tmp_dir}/validation000.gz')
+
+
+def test_download_blobs_no_delete(tmpdir_factory):
+    tmp_dir = str(tmpdir_factory.mktemp('unittest'))
+    client = FakeStorageClient({'validation000.gz': 'content'})
+
+    paths = download_blobs(client, 'bucket', 'validation', tmp_dir, delete=False)
+
+    assert paths == [f'{tmp_dir}/validation000.gz']
+    assert list(client.blobs) == ['validation000.gz']
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional
+
+from google.cloud import storage
+
+
+"""
+Helper for moving files exported to Google Cloud Storage into the local disk of the
+components that read them.
+"""
+
+
+def download_blobs(
+    storage_client: storage.Client,
+    bucket: str,
+    prefix: str,
+    destination: str,
+    filename: Optional[Callable[[str], str]] = None,
+    max_workers: int = 8,
+    delete: bool = True,
+    delete_batch_size: int = 100,
+    on_download: Optional[Callable[[str], Any]] = None
+) -> List[str]:
+    """
+    Downloads concurrently every blob found in `bucket` under `prefix` and then deletes
+    them from GCS.
+
+    Args
+    ----
+      storage_client: storage.Client
+          Client used to reach GCS. Only `bucket`, `list_blobs`, `download_to_filename`,
+          `delete` and `batch` are used so a local fake can be used in its place.
+      bucket: str
+          Name of bucket where blobs are located.
+      prefix: str
+          Only blobs whose names start with this value are downloaded.
+      destination: str
+          Folder where to save files.
+      filename: Optional[Callable[[str], str]]
+          Receives the name of the blob and returns the name of the local file.
+          Defaults to the last part of the blob name.
+      max_workers: int
+          How many files are downloaded at the same time.
+      delete: bool
+          If `True` then blobs are deleted once all of them are downloaded.
+      delete_batch_size: int
+          How many deletions to send in each batch request. GCS accepts up to 1000.
+      on_download: Optional[Callable[[str], Any]]
+          Called with the path of each file as soon as it lands, so processing it can
+          start while other files are still being downloaded. Files are reported in
+          the order they finish downloading.
+
+    Returns
+    -------
+      paths: List[str]
+          Path of each downloaded file, in the order blobs were listed.
+    """
+    filename = filename or _get_basename
+    os.makedirs(destination, exist_ok=True)
+    blobs = list(storage_client.bucket(bucket).list_blobs(prefix=prefix))
+    paths = [f'{destination}/{filename(blob.name)}' for blob in blobs]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(blob.download_to_filename, path): path
+            for blob, path in zip(blobs, paths)
+        }
+        for future in as_completed(futures):
+            future.result()
+            if on_download:
+                on_download(futures[future])
+
+    # While a batch is open every request of the client is deferred to it, so blobs are
+    # only deleted after downloads are finished.
+    if delete:
+        for start in range(0, len(blobs), delete_batch_size):
+            with storage_client.batch():
+                for blob in blobs[start:start + delete_batch_size]:
+                    blob.delete()
+    return paths
+
+
+def _get_basename(name: str) -> str:
+    return name.split('/')[-1]
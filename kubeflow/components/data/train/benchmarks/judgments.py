@@ -0,0 +1,78 @@
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from run import grade_judgments, process_judgment
+
+
+"""
+Compares grading judgments row by row with `process_judgment` against the batched
+`grade_judgments`. Run it from the component folder with:
+
+    python -m benchmarks.judgments --queries=200000
+"""
+
+
+def grade_by_row(judgments_rows):
+    grades = []
+    for row in judgments_rows:
+        if all(x == row[0] for x in row):
+            grades.append(None)
+            continue
+        percentiles = np.percentile(row, [20, 40, 60, 80, 100])
+        grades.append([process_judgment(percentiles, judgment) for judgment in row])
+    return grades
+
+
+def main(queries: int, max_docs: int, seed: int) -> None:
+    rng = np.random.RandomState(seed)
+    judgments_rows = [
+        rng.rand(rng.randint(2, max_docs + 1)).round(3).tolist() for _ in range(queries)
+    ]
+
+    start = time.perf_counter()
+    expected = grade_by_row(judgments_rows)
+    by_row_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grades = grade_judgments(judgments_rows)
+    batched_time = time.perf_counter() - start
+
+    for row_grades, row_expected in zip(grades, expected):
+        if row_expected is None:
+            assert row_grades is None
+        else:
+            assert row_grades.tolist() == row_expected
+
+    print(f'queries: {queries}, docs: {sum(len(row) for row in judgments_rows)}')
+    print(f'process_judgment: {by_row_time:.3f}s')
+    print(f'grade_judgments: {batched_time:.3f}s')
+    print(f'speedup: {by_row_time / batched_time:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--queries',
+        dest='queries',
+        type=int,
+        default=100000,
+        help='How many query rows to grade.'
+    )
+    parser.add_argument(
+        '--max_docs',
+        dest='max_docs',
+        type=int,
+        default=50,
+        help='Maximum number of documents for each query.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    main(args.queries, args.max_docs, args.seed)
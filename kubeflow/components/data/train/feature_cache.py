@@ -0,0 +1,228 @@
+import json
+import hashlib
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from elasticsearch import Elasticsearch
+
+
+"""
+Cache of logged feature values. A feature value only depends on the document and on the
+params the feature declares in the featureset, so values are keyed by:
+
+    (featureset, index, feature, document, values of the feature params)
+
+Features that don't use the `search_term`, such as the channel CTR, are then shared by
+every query the document appears in and a repeated run doesn't need Elasticsearch at
+all. Values are kept in memory with LRU eviction and optionally persisted to a SQLite
+file.
+"""
+
+
+class FeatureCache:
+    """
+    Args
+    ----
+      featureset: str
+          Name of the featureset as stored in Elasticsearch.
+      features: List[Dict[str, Any]]
+          Definition of each feature, in the order of the featureset. Each one contains
+          its `name`, `params` and `template`.
+      index: str
+          Identifies the documents the features are logged from. Values saved on disk
+          are only read back for the same index.
+      max_size: int
+          How many feature values to keep in memory.
+      path: Optional[str]
+          If set then values are also persisted in a SQLite database at this path.
+    """
+    def __init__(
+        self,
+        featureset: str,
+        features: List[Dict[str, Any]],
+        index: str,
+        max_size: int = 1000000,
+        path: Optional[str] = None
+    ):
+        self.featureset = featureset
+        self.index = index
+        self.names = [feature['name'] for feature in features]
+        self.params = [feature.get('params') or [] for feature in features]
+        # Changing the template of a feature invalidates its values saved on disk.
+        self._ids = [
+            f"{feature['name']}:" + hashlib.sha1(
+                json.dumps(feature.get('template'), sort_keys=True).encode()
+            ).hexdigest()[:12]
+            for feature in features
+        ]
+        self.max_size = max_size
+        self._memory = OrderedDict()
+        self._pending = []
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, value TEXT)'
+            )
+
+    @classmethod
+    def from_elasticsearch(
+        cls,
+        es_client: Elasticsearch,
+        featureset: str,
+        index: str,
+        **kwargs
+    ) -> 'FeatureCache':
+        """
+        Reads the features definition of `featureset` from Elasticsearch. Cached values
+        are tied to the UUID of each index behind `index`, so they aren't reused once
+        it's recreated by a reindex or the alias points somewhere else.
+        """
+        response = es_client.transport.perform_request(
+            'GET', f'/_ltr/_featureset/{featureset}'
+        )
+        features = response['_source']['featureset']['features']
+        settings = es_client.indices.get_settings(index=index, name='index.uuid')
+        generation = ','.join(sorted(
+            f"{name}:{setting['settings']['index']['uuid']}"
+            for name, setting in settings.items()
+        ))
+        return cls(featureset, features, generation, **kwargs)
+
+    def _key(self, idx: int, doc: str, search_keys: Dict[str, Any]) -> Tuple:
+        return (idx, doc, tuple(search_keys.get(param) for param in self.params[idx]))
+
+    def _disk_key(self, key: Tuple) -> str:
+        idx, doc, params = key
+        return json.dumps([self.featureset, self.index, self._ids[idx], doc, params])
+
+    def _put(self, key: Tuple, value: Any) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, keys: List[Tuple]) -> Dict[Tuple, Any]:
+        values = {}
+        disk_keys = {self._disk_key(key): key for key in keys}
+        items = list(disk_keys)
+        # SQLite limits how many variables a statement can have.
+        for start in range(0, len(items), 500):
+            chunk = items[start:start + 500]
+            rows = self._db.execute(
+                f'SELECT key, value FROM features WHERE key IN '
+                f'({",".join("?" * len(chunk))})',
+                chunk
+            )
+            for disk_key, value in rows:
+                values[disk_keys[disk_key]] = json.loads(value)
+        return values
+
+    def lookup(
+        self,
+        docs: List[str],
+        search_keys: Dict[str, Any]
+    ) -> Tuple[Dict[str, List[Any]], List[str], Optional[List[str]]]:
+        """
+        Finds the cached features of each document for the given search context.
+
+        Args
+        ----
+          docs: List[str]
+              Documents whose features should be logged.
+          search_keys: Dict[str, Any]
+              Search query and the context where it happened, used as feature params.
+
+        Returns
+        -------
+          values: Dict[str, List[Any]]
+              Features of each document. Values not available in cache are `None`.
+          missing_docs: List[str]
+              Documents that have at least one feature not available in cache.
+          missing_features: Optional[List[str]]
+              Names of the features that should be logged from Elasticsearch, `None`
+              if all of them are required.
+        """
+        values, disk_keys = {}, []
+        for doc in docs:
+            doc_values = []
+            for idx in range(len(self.names)):
+                key = self._key(idx, doc, search_keys)
+                value = self._memory.get(key)
+                if value is None:
+                    disk_keys.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                doc_values.append(value)
+            values[doc] = doc_values
+
+        if disk_keys and self._db is not None:
+            for key, value in self._read_disk(disk_keys).items():
+                idx, doc, _ = key
+                values[doc][idx] = value
+                self._put(key, value)
+
+        missing_docs, missing_features = [], set()
+        for doc, doc_values in values.items():
+            missing = [idx for idx, value in enumerate(doc_values) if value is None]
+            if missing:
+                missing_docs.append(doc)
+                missing_features.update(missing)
+        if len(missing_features) == len(self.names):
+            return values, missing_docs, None
+        return values, missing_docs, [self.names[idx] for idx in
+                                      sorted(missing_features)]
+
+    def update(
+        self,
+        doc: str,
+        search_keys: Dict[str, Any],
+        values: List[Any],
+        logs: List[Dict[str, Any]]
+    ) -> List[Any]:
+        """
+        Completes the missing `values` of `doc` with the features logged by
+        Elasticsearch and saves them in cache.
+
+        Args
+        ----
+          doc: str
+          search_keys: Dict[str, Any]
+          values: List[Any]
+              Features of `doc` as returned by `lookup`.
+          logs: List[Dict[str, Any]]
+              Features logged by Elasticsearch for `doc`.
+
+        Returns
+        -------
+          values: List[Any]
+              All features of `doc`.
+        """
+        values = list(values)
+        for idx, value in enumerate(values):
+            if value is None:
+                value = logs[idx].get('value', 0)
+                values[idx] = value
+                key = self._key(idx, doc, search_keys)
+                self._put(key, value)
+                if self._db is not None:
+                    self._pending.append((self._disk_key(key), json.dumps(value)))
+        return values
+
+    def commit(self) -> None:
+        """
+        Persists values added since last commit.
+        """
+        if self._db is not None and self._pending:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO features (key, value) VALUES (?, ?)',
+                self._pending
+            )
+            self._db.commit()
+        self._pending = []
+
+    def close(self) -> None:
+        self.commit()
+        if self._db is not None:
+            self._db.close()
@@ -0,0 +1,126 @@
+import os
+import json
+from array import array
+from typing import Any, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+
+"""
+Columnar store for graded judgments, an alternative to gzipped JSON rows. A store is a
+folder containing:
+
+    doc_ids.json: interned documents ids, each one saved only once.
+    docs.npy: int32 index in `doc_ids` of each judged document.
+    grades.npy: int8 judgment of each document.
+    offsets.npy: int64 position in `docs` where each query starts; the last value is
+        the total of documents.
+    keys.npy: int32 index in `search_keys.jsonl` of each query.
+    search_keys.jsonl: unique search keys, one JSON per line.
+
+Arrays are read with `np.memmap` so reading judgments back doesn't require parsing
+JSON for every document.
+"""
+
+
+class JudgmentStoreWriter:
+    """
+    Accumulates judgments in compact arrays and saves them as a store in `path` when
+    closed.
+
+    Args
+    ----
+      path: str
+          Folder where to save the store.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._doc_ids: Dict[str, int] = {}
+        self._search_keys: Dict[str, int] = {}
+        self._docs = array('i')
+        self._grades = array('b')
+        self._offsets = array('q', [0])
+        self._keys = array('i')
+
+    def write(self, search_keys: Dict[str, Any], docs: List[str],
+              judgments: List[int]) -> None:
+        """
+        Adds the judgments of one query to the store.
+
+        Args
+        ----
+          search_keys: Dict[str, Any]
+              Search query and the context where it happened.
+          docs: List[str]
+              Documents judged for the query.
+          judgments: List[int]
+              Judgment, from 0 to 4, of each document.
+        """
+        keys = json.dumps(search_keys)
+        self._keys.append(self._search_keys.setdefault(keys, len(self._search_keys)))
+        self._docs.extend(self._doc_ids.setdefault(doc, len(self._doc_ids))
+                          for doc in docs)
+        self._grades.extend(judgments)
+        self._offsets.append(len(self._docs))
+
+    def close(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        np.save(f'{self.path}/docs.npy', np.frombuffer(self._docs, dtype=np.int32))
+        np.save(f'{self.path}/grades.npy', np.frombuffer(self._grades, dtype=np.int8))
+        np.save(f'{self.path}/offsets.npy',
+                np.frombuffer(self._offsets, dtype=np.int64))
+        np.save(f'{self.path}/keys.npy', np.frombuffer(self._keys, dtype=np.int32))
+        with open(f'{self.path}/doc_ids.json', 'w') as f:
+            json.dump(list(self._doc_ids), f)
+        with open(f'{self.path}/search_keys.jsonl', 'w') as f:
+            for keys in self._search_keys:
+                f.write(keys + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_judgment_store(
+    path: str,
+    chunk_size: int = 10000
+) -> Iterator[Tuple[Dict[str, Any], List[str], List[int]]]:
+    """
+    Reads judgments from a store saved by `JudgmentStoreWriter`.
+
+    Args
+    ----
+      path: str
+          Folder where the store is located.
+      chunk_size: int
+          How many queries to load from the memory-mapped arrays at once.
+
+    Returns
+    -------
+      judgments: Iterator[Tuple[Dict[str, Any], List[str], List[int]]]
+          Search keys, documents and their judgments for each query.
+    """
+    docs = np.load(f'{path}/docs.npy', mmap_mode='r')
+    grades = np.load(f'{path}/grades.npy', mmap_mode='r')
+    offsets = np.load(f'{path}/offsets.npy', mmap_mode='r')
+    keys = np.load(f'{path}/keys.npy', mmap_mode='r')
+    doc_ids = json.load(open(f'{path}/doc_ids.json'))
+    search_keys = [json.loads(line) for line in open(f'{path}/search_keys.jsonl')]
+
+    for chunk_start in range(0, len(keys), chunk_size):
+        chunk_offsets = offsets[chunk_start:chunk_start + chunk_size + 1].tolist()
+        first, last = chunk_offsets[0], chunk_offsets[-1]
+        chunk_docs = docs[first:last].tolist()
+        chunk_grades = grades[first:last].tolist()
+        chunk_keys = keys[chunk_start:chunk_start + chunk_size].tolist()
+
+        for idx, keys_idx in enumerate(chunk_keys):
+            start = chunk_offsets[idx] - first
+            end = chunk_offsets[idx + 1] - first
+            yield (
+                search_keys[keys_idx],
+                [doc_ids[doc] for doc in chunk_docs[start:end]],
+                chunk_grades[start:end]
+            )
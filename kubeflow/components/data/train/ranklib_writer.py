@@ -0,0 +1,141 @@
+import io
+import os
+import gzip
+from typing import Any, Dict, Optional, Sequence
+
+
+"""
+Streams the rows of the RankLib training file to disk. The writer is owned by the
+whole `build_train_file` run so one buffered handle is kept open instead of reopening
+the file for each multisearch batch.
+"""
+
+
+EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst'
+}
+
+
+def get_train_file_path(destination: str, compression: Optional[str] = None) -> str:
+    """
+    Returns the path of the training file for the given `compression`. RankLib reads
+    files ending in `.gz` directly.
+    """
+    if compression not in EXTENSIONS:
+        raise ValueError(f'Invalid value for compression: "{compression}"')
+    return f'{destination}/train_dataset.txt{EXTENSIONS[compression]}'
+
+
+class RankLibWriter:
+    """
+    Writes rows such as:
+
+        4    qid:1    1:0.56    2:1.3
+
+    Each row is formatted with one `str.format` call over a template built once for
+    each number of features, so no intermediate strings are created per feature.
+
+    Args
+    ----
+      path: str
+          File path where to write rows to.
+      compression: Optional[str]
+          Either `None`, "gzip" or "zstd". The latter requires the `zstandard` package.
+      buffer_size: int
+          Size in bytes of the write buffer.
+      offset: Optional[int]
+          If set then the file is truncated at this offset, as returned by
+          `checkpoint`, and rows are appended from there.
+    """
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str] = None,
+        buffer_size: int = 1 << 20,
+        offset: Optional[int] = None
+    ):
+        if compression not in EXTENSIONS:
+            raise ValueError(f'Invalid value for compression: "{compression}"')
+        self.path = path
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self._templates: Dict[int, str] = {}
+        if offset is None:
+            self._raw = open(path, 'wb', buffering=buffer_size)
+        else:
+            self._raw = open(path, 'r+b', buffering=buffer_size)
+            self._raw.truncate(offset)
+            self._raw.seek(offset)
+        self._file = self._open_stream()
+
+    def _open_stream(self) -> io.TextIOBase:
+        if self.compression is None:
+            return io.TextIOWrapper(self._raw)
+        if self.compression == 'gzip':
+            stream = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        else:
+            import zstandard
+
+            stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        return io.TextIOWrapper(io.BufferedWriter(stream, self.buffer_size))
+
+    def checkpoint(self) -> int:
+        """
+        Makes every row written so far durable on disk.
+
+        Compressed streams are finished and a new one is started after them. Both gzip
+        and zstd readers accept concatenated streams so the file remains valid if it's
+        later truncated at the returned offset.
+
+        Returns
+        -------
+          offset: int
+              Size of the file with all the rows written so far.
+        """
+        self._file.flush()
+        if self.compression is not None:
+            self._file.detach().detach().close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        offset = self._raw.tell()
+        if self.compression is not None:
+            self._file = self._open_stream()
+        return offset
+
+    def _get_template(self, n_features: int) -> str:
+        template = self._templates.get(n_features)
+        if template is None:
+            template = '{}\tqid:{}\t' + '\t'.join(
+                f'{idx + 1}:{{}}' for idx in range(n_features)
+            ) + '\n'
+            self._templates[n_features] = template
+        return template
+
+    def write(self, judgment: Any, qid: int, features: Sequence[Any]) -> None:
+        """
+        Writes one row of the training file.
+
+        Args
+        ----
+          judgment: Any
+              Graded relevance of the document for the query.
+          qid: int
+              Identifier of the query the document belongs to.
+          features: Sequence[Any]
+              Value of each feature, in the order they are defined in the featureset.
+        """
+        self._file.write(
+            self._get_template(len(features)).format(judgment, qid, *features)
+        )
+
+    def close(self) -> None:
+        self._file.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -6,14 +6,24 @@ import gzip
 import sys
 import pathlib
 import uuid
+from multiprocessing import Pool, cpu_count
+from collections import deque, defaultdict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from shutil import rmtree
-from typing import List, NamedTuple, Dict, Any, Iterator, Tuple
+from typing import List, NamedTuple, Dict, Any, Iterator, Tuple, Optional
 
 import numpy as np
 from elasticsearch import Elasticsearch
 from google.cloud import storage, bigquery
 from pyClickModels import DBN
 
+from feature_cache import FeatureCache
+from msearch import AdaptiveBatcher
+from transfer import download_blobs
+from judgment_store import JudgmentStoreWriter, read_judgment_store
+from ranklib_writer import RankLibWriter, get_train_file_path
+
 
 """
 Module responsible for creating the final RankLib text file used as input for its
@@ -27,9 +37,30 @@ training process. For information is available at:
 PATH = pathlib.Path(__file__).parent
 
 
-def build_judgment_files(model_name: str) -> None:
+def build_judgment_files(
+    model_name: str,
+    shards: int = 1,
+    judgment_format: str = 'json',
+    judgments_path: Optional[str] = None
+) -> None:
     """
     Uses DBN Models and the clickstream data to come up with the Judgmnets inferences.
+
+    Args
+    ----
+      model_name: str
+          Name to identify model being trained.
+      shards: int
+          If greater than 1 then the output of the DBN model is split in this many
+          files which are graded in parallel, each one resulting in a file
+          `judgments_{shard}.gz`. Judgments are read in the same order regardless
+          of the number of shards.
+      judgment_format: str
+          Either "json" or "binary". The latter saves judgments as columnar stores,
+          which are folders named just as the JSON files but without extension.
+      judgments_path: Optional[str]
+          Folder where to write judgments to. Defaults to
+          `/tmp/pysearchml/{model_name}/judgments`.
     """
     model = DBN.DBNModel()
 
@@ -46,42 +77,103 @@ def build_judgment_files(model_name: str) -> None:
     os.makedirs(os.path.dirname(model_path))
 
     # finally judgment files is where the final judgments are written.
-    judgment_files_path = f'/tmp/pysearchml/{model_name}/judgments/judgments.gz'
+    judgments_path = judgments_path or f'/tmp/pysearchml/{model_name}/judgments'
+    judgment_files_path = f'{judgments_path}/judgments.gz'
+    extension = '.gz' if judgment_format == 'json' else ''
     rmtree(os.path.dirname(judgment_files_path), ignore_errors=True)
     os.makedirs(os.path.dirname(judgment_files_path))
 
     model.fit(clickstream_files_path, iters=10)
     model.export_judgments(model_path)
 
-    with gzip.GzipFile(judgment_files_path, 'wb') as f:
-        for row in gzip.GzipFile(model_path):
-            row = json.loads(row)
-            result = []
+    if shards <= 1:
+        write_judgment_file(model_path, judgment_files_path[:-len('.gz')] + extension,
+                            judgment_format)
+        return
+
+    model_shards_paths = split_gzip_file(model_path, shards)
+    judgment_shards_paths = [
+        f'{os.path.dirname(judgment_files_path)}/judgments_{shard}{extension}'
+        for shard in get_shard_names(shards)
+    ]
+    with Pool(min(shards, cpu_count())) as pool:
+        pool.starmap(write_judgment_file, zip(model_shards_paths, judgment_shards_paths,
+                                              [judgment_format] * shards))
+
+
+def get_shard_names(shards: int) -> List[str]:
+    """
+    Zero-padded index of each shard so files sort in the same order as their index.
+    """
+    width = len(str(shards - 1))
+    return [str(shard).zfill(width) for shard in range(shards)]
+
+
+def split_gzip_file(path: str, shards: int) -> List[str]:
+    """
+    Splits the rows of a gzipped file in `shards` files of contiguous rows. Files are
+    saved next to `path` as `{name}_{shard}.gz`, where `shard` is zero-padded so that
+    reading the files in sorted order yields the rows in their original order.
 
-            # search_keys is something like:
-            # {"search_term:query|brand:brand_name|context:value}
-            # Notice that only the `search_term` is always available. Other keys depends
-            # on the chosen context when training the model, i.e., one can choose to
-            # add the brand information or not and so on.
-            search_keys = list(row.keys())[0]
-            docs_judgments = row[search_keys]
-            search_keys = dict(e.split(':') for e in search_keys.split('|'))
+    Args
+    ----
+      path: str
+          Path to the gzipped file to split.
+      shards: int
+          Number of files to split rows into.
 
-            judgments_list = [judge for doc, judge in docs_judgments.items()]
+    Returns
+    -------
+      shards_paths: List[str]
+          Path of each resulting file, in the order of their rows.
+    """
+    rows = sum(1 for _ in gzip.GzipFile(path))
+    rows_per_shard = max(1, -(-rows // shards))
+    root = path[:-len('.gz')] if path.endswith('.gz') else path
+    shards_paths = [f'{root}_{shard}.gz' for shard in get_shard_names(shards)]
+    # Shards are temporary so it's not worth spending CPU compressing them further.
+    files = [gzip.GzipFile(shard_path, 'wb', compresslevel=1)
+             for shard_path in shards_paths]
+    try:
+        for idx, row in enumerate(gzip.GzipFile(path)):
+            files[idx // rows_per_shard].write(row)
+    finally:
+        for file_ in files:
+            file_.close()
+    return shards_paths
+
+
+def write_judgment_file(model_path: str, judgment_path: str,
+                        judgment_format: str = 'json') -> None:
+    """
+    Reads judgments exported by pyClickModels and writes them graded from 0 to 4.
 
-            # It means all judgments expectations are equal which is not desirable
-            if all(x == judgments_list[0] for x in judgments_list):
-                continue
+    Args
+    ----
+      model_path: str
+          Path to the gzipped output of pyClickModels.
+      judgment_path: str
+          Path where to write the graded judgments to.
+      judgment_format: str
+          Either "json", which writes gzipped JSON rows, or "binary", which writes a
+          columnar store as defined in `judgment_store`.
+    """
+    graded_judgments = iter_graded_judgments(model_path)
 
-            # We devire judgments based on percentiles from 20% up to 100%
-            percentiles = np.percentile(judgments_list, [20, 40, 60, 80, 100])
+    if judgment_format == 'binary':
+        with JudgmentStoreWriter(judgment_path) as writer:
+            for search_keys, docs, judgments in graded_judgments:
+                writer.write(search_keys, docs, judgments)
+        return
 
+    with gzip.GzipFile(judgment_path, 'wb') as f:
+        for search_keys, docs, judgments in graded_judgments:
             judgment_keys = [
                 {
                     'doc': doc,
-                    'judgment': process_judgment(percentiles, judgment)
+                    'judgment': judgment
                 }
-                for doc, judgment in docs_judgments.items()
+                for doc, judgment in zip(docs, judgments)
             ]
 
             result = {
@@ -91,6 +183,90 @@ def build_judgment_files(model_name: str) -> None:
             f.write(json.dumps(result).encode() + '\n'.encode())
 
 
+def iter_graded_judgments(
+    model_path: str,
+    batch_size: int = 10000
+) -> Iterator[Tuple[Dict[str, Any], List[str], List[int]]]:
+    """
+    Reads rows exported by pyClickModels and grades them in batches of `batch_size`
+    with `grade_judgments`.
+
+    Returns
+    -------
+      judgments: Iterator[Tuple[Dict[str, Any], List[str], List[int]]]
+          Search keys, documents and their graded judgments for each query.
+    """
+    batch = []
+    for row in gzip.GzipFile(model_path):
+        batch.append(json.loads(row))
+        if len(batch) == batch_size:
+            yield from grade_rows(batch)
+            batch = []
+    if batch:
+        yield from grade_rows(batch)
+
+
+def grade_rows(
+    rows: List[Dict[str, Dict[str, float]]]
+) -> Iterator[Tuple[Dict[str, Any], List[str], List[int]]]:
+    """
+    Grades a batch of rows exported by pyClickModels.
+    """
+    # search_keys is something like:
+    # {"search_term:query|brand:brand_name|context:value}
+    # Notice that only the `search_term` is always available. Other keys depends
+    # on the chosen context when training the model, i.e., one can choose to
+    # add the brand information or not and so on.
+    rows = [list(row.items())[0] for row in rows]
+    grades = grade_judgments([list(docs_judgments.values()) for _, docs_judgments
+                              in rows])
+
+    for (search_keys, docs_judgments), row_grades in zip(rows, grades):
+        # It means all judgments expectations are equal which is not desirable
+        if row_grades is None:
+            continue
+
+        search_keys = dict(e.split(':') for e in search_keys.split('|'))
+        yield search_keys, list(docs_judgments), row_grades.tolist()
+
+
+def grade_judgments(judgments_rows: List[List[float]]) -> List[Optional[np.ndarray]]:
+    """
+    Grades several rows of judgments at once. The result for each row is the same as
+    computing its percentiles and calling `process_judgment` for each value but rows
+    of same length are stacked so all of them are processed by a few NumPy calls.
+
+    Args
+    ----
+      judgments_rows: List[List[float]]
+          Each row contains the judgments computed for the documents of a given query.
+
+    Returns
+    -------
+      grades: List[Optional[np.ndarray]]
+          Integers between 0 and 4, inclusive, for each row. It's `None` for rows whose
+          judgments are all equal as they can't be graded.
+    """
+    grades = [None] * len(judgments_rows)
+    rows_by_length = defaultdict(list)
+    for idx, row in enumerate(judgments_rows):
+        if row:
+            rows_by_length[len(row)].append(idx)
+
+    for idxs in rows_by_length.values():
+        values = np.array([judgments_rows[idx] for idx in idxs], dtype=float)
+        # We devire judgments based on percentiles from 20% up to 100%
+        percentiles = np.percentile(values, [20, 40, 60, 80, 100], axis=1).T
+        # Counting how many percentiles are smaller than the judgment results in the
+        # index of the first percentile that is greater or equal to it.
+        rows_grades = (values[:, :, None] > percentiles[:, None, :]).sum(axis=2)
+        constant = (values == values[:, :1]).all(axis=1)
+        for idx, row_grades, is_constant in zip(idxs, rows_grades, constant):
+            if not is_constant:
+                grades[idx] = row_grades
+    return grades
+
+
 def process_judgment(percentiles: list, judgment: float) -> int:
     """
     Returns which quantile the current value of `judgment` belongs to. The result is
@@ -126,7 +302,13 @@ def build_train_file(
     es_batch: int,
     es_client: Elasticsearch,
     destination: str,
-    index: str
+    index: str,
+    es_concurrency: int = 1,
+    compression: Optional[str] = None,
+    feature_cache: Optional[FeatureCache] = None,
+    judgments_path: Optional[str] = None,
+    resume: bool = False,
+    batcher: Optional[AdaptiveBatcher] = None
 ) -> None:
     """
     After the input file has been updated with judgment data, logs features from
@@ -142,87 +324,228 @@ def build_train_file(
           Python Elasticsearch client
       destination: str
           Path where to write results to.
+      index: str
+          Name of index to use from in Elasticsearch.
+      es_concurrency: int
+          How many multisearch requests can be in-flight at the same time. Responses
+          are still consumed in the order requests were sent so the final file is the
+          same regardless of this value.
+      compression: Optional[str]
+          If "gzip" or "zstd" then the training file is compressed accordingly.
+      feature_cache: Optional[FeatureCache]
+          If available, only features not found in cache are logged from
+          Elasticsearch.
+      judgments_path: Optional[str]
+          Folder where judgments are read from.
+      resume: bool
+          If `True` then continues from the last checkpoint saved in `destination`.
+          After each batch is written, a checkpoint stores how many judgments were
+          read and the size of the training file up to that point. No checkpoint is
+          saved otherwise, so only runs started with `resume` can be resumed.
+      batcher: Optional[AdaptiveBatcher]
+          Decides when each multisearch request is sent and retries rejected ones. If
+          not set then requests are sent every `es_batch` queries.
     """
-    counter = 1
+    if batcher is None:
+        batcher = AdaptiveBatcher(es_batch)
+    payload = 0
     # works as a pointer
     queries_counter = [0]
-    search_arr, judge_list = [], []
+    search_arr, queries = [], []
     os.makedirs(destination, exist_ok=True)
-    if os.path.isfile(f'{destination}/train_dataset.txt'):
-        os.remove(f'{destination}/train_dataset.txt')
+    train_file_path = get_train_file_path(destination, compression)
+    judgment_rows = read_judgment_files(model_name, judgments_path)
+
+    checkpoint = load_checkpoint(destination) if resume else None
+    if checkpoint:
+        if checkpoint['compression'] != compression:
+            raise ValueError('Compression differs from the one used in checkpoint: '
+                             f'"{checkpoint["compression"]}"')
+        queries_read = checkpoint['queries_read']
+        queries_counter[0] = checkpoint['queries_counter']
+        judgment_rows = islice(judgment_rows, queries_read, None)
+        writer = RankLibWriter(train_file_path, compression,
+                               offset=checkpoint['offset'])
+    else:
+        if os.path.isfile(get_checkpoint_path(destination)):
+            os.remove(get_checkpoint_path(destination))
+        queries_read = 0
+        writer = RankLibWriter(train_file_path, compression)
+
+    logging_query = LoggingQueryTemplate(model_name, index)
+    # Each item is a tuple of (future msearch response, queries of the batch, how many
+    # judgments were read up to the batch).
+    pending = deque()
+
+    def consume_oldest() -> None:
+        features_log, batch_queries, batch_queries_read = pending.popleft()
+        write_features(features_log.result(), batch_queries, queries_counter, writer,
+                       feature_cache)
+        # Checkpoints finish the compressed stream and sync the file, which is only
+        # worth paying for when the run can be resumed.
+        if not resume:
+            return
+        save_checkpoint(destination, {
+            'queries_read': batch_queries_read,
+            'queries_counter': queries_counter[0],
+            'offset': writer.checkpoint(),
+            'compression': compression
+        })
+
+    def submit(batch_queries_read: int) -> None:
+        nonlocal search_arr, queries, payload
+        pending.append((executor.submit(log_features, search_arr, es_client, batcher),
+                        queries, batch_queries_read))
+        search_arr, queries, payload = [], [], 0
+        if len(pending) >= es_concurrency:
+            consume_oldest()
+
+    with writer, ThreadPoolExecutor(max_workers=es_concurrency) as executor:
+        for search_keys, docs, judgments in judgment_rows:
+            queries_read += 1
+            cached, missing_docs, missing_features = None, docs, None
+            if feature_cache:
+                cached, missing_docs, missing_features = feature_cache.lookup(
+                    docs, search_keys
+                )
+
+            if missing_docs:
+                lines = [
+                    logging_query.header,
+                    logging_query.render(missing_docs, search_keys, missing_features)
+                ]
+                # Counts the separators joining lines in the body of the request.
+                size = sum(len(line) + len(os.linesep) for line in lines)
+                # The batch is sent before it would go over the payload limit.
+                if search_arr and not batcher.fits(payload, size):
+                    submit(queries_read - 1)
+                search_arr.extend(lines)
+                payload += size
+            queries.append((search_keys, docs, judgments, cached, bool(missing_docs)))
 
-    for search_keys, docs, judgments in read_judgment_files(model_name):
-        judge_list.append(judgments)
+            if batcher.is_full(len(queries), payload):
+                submit(queries_read)
 
-        search_arr.append(json.dumps({'index': f'{index}'}))
-        search_arr.append(json.dumps(get_logging_query(model_name, docs, search_keys)))
+        if queries:
+            submit(queries_read)
+        while pending:
+            consume_oldest()
 
-        if counter % es_batch == 0:
-            write_features(search_arr, judge_list, queries_counter, es_client,
-                           destination)
-            search_arr, judge_list = [], []
 
-        counter += 1
+def get_checkpoint_path(destination: str) -> str:
+    return f'{destination}/train_dataset.checkpoint.json'
 
-    if search_arr:
-        write_features(search_arr, judge_list, queries_counter, es_client, destination)
 
+def load_checkpoint(destination: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns the last checkpoint saved by `build_train_file` in `destination`, if any.
+    """
+    path = get_checkpoint_path(destination)
+    if not os.path.isfile(path):
+        return None
+    return json.loads(open(path).read())
 
-def write_features(
+
+def save_checkpoint(destination: str, checkpoint: Dict[str, Any]) -> None:
+    """
+    Saves `checkpoint` atomically so a crash never leaves a partial file behind.
+    """
+    path = get_checkpoint_path(destination)
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(json.dumps(checkpoint))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def log_features(
     search_arr: List[str],
-    judge_list: List[List[str]],
-    queries_counter: List[int],
     es_client: Elasticsearch,
-    destination: str
-) -> None:
+    batcher: Optional[AdaptiveBatcher] = None
+) -> Dict[str, Any]:
     """
-    Sends the query to Elasticsearch and uses the result to write final RankLib training
-    file.
+    Sends the logging queries against Elasticsearch using the multisearch API.
 
     Args
     ----
       search_arr: List[str]
           Array containing multiple queries to send against Elasticsearch
-      judge_list: List[List[str]]
-          Each index contains list of judgments associated to a respective search
-      file_: io.TextIO
-      queries_counter: List[int]
-          Counter of how many queries were processed so far. It's used to build the
-          RankLib file with appropriate values. It's a list so it works as a C pointer.
-      es: Elasticsearch
+      es_client: Elasticsearch
           Python client for interacting with Elasticsearch
-      destination: str
-          Path where to save results to.
+      batcher: Optional[AdaptiveBatcher]
+          Sends the request, splitting and retrying it if Elasticsearch rejects it.
+
+    Returns
+    -------
+      features_log: Dict[str, Any]
+          Multisearch response where each hit contains its logged features.
     """
+    # All features may be already available in cache.
     if not search_arr:
-        return
+        return {'responses': []}
+    if batcher is None:
+        batcher = AdaptiveBatcher()
+    return batcher.msearch(es_client, search_arr)
 
-    multi_request = os.linesep.join(search_arr)
-    features_log = es_client.msearch(body=multi_request, request_timeout=60)
 
-    rows = []
-    for i in range(len(judge_list)):
-        es_result = features_log['responses'][i].get('hits', {}).get('hits')
+def write_features(
+    features_log: Dict[str, Any],
+    queries: List[Tuple[Dict[str, Any], List[str], List[int], Any, bool]],
+    queries_counter: List[int],
+    writer: RankLibWriter,
+    feature_cache: Optional[FeatureCache] = None
+) -> None:
+    """
+    Uses the features logged by Elasticsearch to write final RankLib training file.
 
-        if not es_result or len(es_result) == 1:
+    Args
+    ----
+      features_log: Dict[str, Any]
+          Multisearch response as returned by `log_features`.
+      queries: List[Tuple[Dict[str, Any], List[str], List[int], Any, bool]]
+          Each index contains the search keys, documents and judgments of a search,
+          the features found in cache and whether it was sent to Elasticsearch.
+      queries_counter: List[int]
+          Counter of how many queries were processed so far. It's used to build the
+          RankLib file with appropriate values. It's a list so it works as a C pointer.
+      writer: RankLibWriter
+          Streams rows to the final training file.
+      feature_cache: Optional[FeatureCache]
+          Receives the features logged by Elasticsearch.
+    """
+    responses = iter(features_log['responses'])
+    for search_keys, docs, judgments, cached, requested in queries:
+        logged = {}
+        if requested:
+            es_result = next(responses).get('hits', {}).get('hits') or []
+            logged = {hit['_id']: hit['fields']['_ltrlog'][0]['main']
+                      for hit in es_result}
+
+        rows = []
+        for doc, judgment in zip(docs, judgments):
+            logs = logged.get(doc)
+            if feature_cache is None:
+                if logs is None:
+                    continue
+                features = [log.get('value', 0) for log in logs]
+            else:
+                features = cached[doc]
+                if None in features:
+                    # Document is not available in Elasticsearch.
+                    if logs is None:
+                        continue
+                    features = feature_cache.update(doc, search_keys, features, logs)
+            rows.append((judgment, features))
+
+        if len(rows) < 2:
             continue
 
-        for j in range(len(es_result)):
-            logs = es_result[j]['fields']['_ltrlog'][0]['main']
-            features = [
-                f'{idx+1}:{logs[idx].get("value", 0)}' for idx in range(len(logs))
-            ]
-            features = '\t'.join(features)
-            ranklib_entry = f'{judge_list[i][j]}\tqid:{queries_counter[0]}\t{features}'
-            rows.append(ranklib_entry)
+        for judgment, features in rows:
+            writer.write(judgment, queries_counter[0], features)
         queries_counter[0] += 1
 
-    if rows:
-        print(rows[0])
-        path = f'{destination}/train_dataset.txt'
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, 'a') as f:
-            f.write(os.linesep.join(rows) + os.linesep)
+    if feature_cache:
+        feature_cache.commit()
 
 
 def get_logging_query(
@@ -290,14 +613,77 @@ def get_logging_query(
     return log_query
 
 
+class LoggingQueryTemplate:
+    """
+    Serializes the logging query returned by `get_logging_query` and the multisearch
+    header just once. Only the list of documents and the search keys are serialized
+    for each query and spliced in between the invariant parts, resulting in the same
+    string as `json.dumps(get_logging_query(model_name, docs, search_keys))`.
+
+    Args
+    ----
+      model_name: str
+          Name of feature set store on Elasticsearch.
+      index: str
+          Name of index to use from in Elasticsearch.
+    """
+    _docs = '__docs__'
+    _search_keys = '__search_keys__'
+    _active_features = '__active_features__'
+
+    def __init__(self, model_name: str, index: str):
+        self.header = json.dumps({'index': f'{index}'})
+        query = get_logging_query(model_name, self._docs, self._search_keys)
+        self._parts = self._split(json.dumps(query))
+
+        # When only some features should be logged, the sltr query receives the
+        # `active_features` param.
+        query['query']['bool']['should'][0]['sltr']['active_features'] = (
+            self._active_features
+        )
+        self._active_parts = self._split(json.dumps(query))
+
+    def _split(self, query: str) -> List[str]:
+        prefix, query = query.split(json.dumps(self._docs))
+        middle, query = query.split(json.dumps(self._search_keys))
+        return [prefix, middle] + query.split(json.dumps(self._active_features))
+
+    def render(
+        self,
+        docs: List[str],
+        search_keys: Dict[str, Any],
+        active_features: Optional[List[str]] = None
+    ) -> str:
+        """
+        Returns the serialized logging query for `docs` and `search_keys`. If
+        `active_features` is set then only those features are logged.
+        """
+        if active_features is None:
+            prefix, middle, suffix = self._parts
+            return (f'{prefix}{json.dumps(docs)}{middle}{json.dumps(search_keys)}'
+                    f'{suffix}')
+        prefix, middle, active, suffix = self._active_parts
+        return (f'{prefix}{json.dumps(docs)}{middle}{json.dumps(search_keys)}'
+                f'{active}{json.dumps(active_features)}{suffix}')
+
+
 def read_judgment_files(
-    model_name: str
+    model_name: str,
+    judgments_path: Optional[str] = None
 ) -> Iterator[Tuple[Dict[str, Any], List[str], List[str]]]:
     """
-    Reads resulting files of the judgments updating process.
+    Reads resulting files of the judgments updating process. Folders are read as
+    columnar judgment stores. Files are sorted so judgments are always read in the
+    same order.
     """
-    files = glob.glob(f'/tmp/pysearchml/{model_name}/judgments/*.gz')
+    judgments_path = judgments_path or f'/tmp/pysearchml/{model_name}/judgments'
+    files = sorted(glob.glob(f'{judgments_path}/*'))
     for file_ in files:
+        if os.path.isdir(file_):
+            yield from read_judgment_store(file_)
+            continue
+        if not file_.endswith('.gz'):
+            continue
         for row in gzip.GzipFile(file_):
             row = json.loads(row)
             search_keys = row['search_keys']
@@ -321,6 +707,8 @@ def download_data(args: NamedTuple):
         train_end_date: str
         model_name: str
             Name to identify model being trained.
+        download_workers: int
+            How many files exported to GCS are downloaded concurrently.
     """
     path_to_download = f'/tmp/pysearchml/{args.model_name}/clickstream'
     rmtree(path_to_download, ignore_errors=True)
@@ -356,13 +744,14 @@ def download_data(args: NamedTuple):
     job.result()
 
     # Download data
-    bucket_obj = storage_client.bucket(args.bucket)
-    blobs = bucket_obj.list_blobs(prefix='train')
-    for blob in blobs:
-        blob.download_to_filename(
-            f"{path_to_download}/judgments_{blob.name.split('/')[-1]}"
-        )
-        blob.delete()
+    download_blobs(
+        storage_client,
+        args.bucket,
+        'train',
+        path_to_download,
+        filename=lambda name: f"judgments_{name.split('/')[-1]}",
+        max_workers=args.download_workers
+    )
 
     # Delete BQ Table
     bq_client.delete_table(table_ref)
@@ -391,10 +780,33 @@ def main(args: NamedTuple, es_client: Elasticsearch) -> None:
       es_client: Elasticsearch
           Python Elasticsearch client
     """
-    download_data(args)
-    build_judgment_files(args.model_name)
+    # When resuming, judgments are kept next to the training file as the local disk of
+    # the pod doesn't survive it being preempted.
+    judgments_path = f'{args.destination}/judgments' if args.resume else None
+    if not (args.resume and load_checkpoint(args.destination)):
+        download_data(args)
+        build_judgment_files(args.model_name, args.judgment_shards,
+                             args.judgment_format, judgments_path)
+
+    feature_cache = None
+    if args.feature_cache:
+        feature_cache = FeatureCache.from_elasticsearch(
+            es_client,
+            args.model_name,
+            args.index,
+            max_size=args.feature_cache_size,
+            path=args.feature_cache_path
+        )
+    batcher = AdaptiveBatcher(
+        args.es_batch,
+        target_latency=args.es_target_latency,
+        max_payload=args.es_max_payload
+    )
     build_train_file(args.model_name, args.es_batch, es_client, args.destination,
-                     args.index)
+                     args.index, args.es_concurrency, args.compression, feature_cache,
+                     judgments_path, args.resume, batcher)
+    if feature_cache:
+        feature_cache.close()
 
 
 if __name__ == '__main__':
@@ -420,6 +832,13 @@ if __name__ == '__main__':
         default='pysearchml',
         help='Google Cloud Storage Bucket where all data will be stored.'
     )
+    parser.add_argument(
+        '--download_workers',
+        dest='download_workers',
+        type=int,
+        default=8,
+        help='How many files exported to GCS are downloaded concurrently.'
+    )
     parser.add_argument(
         '--es_host',
         dest='es_host',
@@ -434,6 +853,83 @@ if __name__ == '__main__':
         help=('Determines how many items to send at once to Elasticsearch when using '
               'multisearch API.')
     )
+    parser.add_argument(
+        '--es_concurrency',
+        dest='es_concurrency',
+        type=int,
+        default=1,
+        help='How many multisearch requests can be sent concurrently to Elasticsearch.'
+    )
+    parser.add_argument(
+        '--es_target_latency',
+        dest='es_target_latency',
+        type=float,
+        default=None,
+        help=('If set then `es_batch` is only the initial batch size, which is adapted '
+              'so each multisearch request takes around this many seconds.')
+    )
+    parser.add_argument(
+        '--es_max_payload',
+        dest='es_max_payload',
+        type=int,
+        default=None,
+        help='Maximum size in bytes of the body of each multisearch request.'
+    )
+    parser.add_argument(
+        '--judgment_shards',
+        dest='judgment_shards',
+        type=int,
+        default=1,
+        help='In how many files to split judgments so they are processed in parallel.'
+    )
+    parser.add_argument(
+        '--judgment_format',
+        dest='judgment_format',
+        type=str,
+        default='json',
+        choices=['json', 'binary'],
+        help=('Format in which judgments are saved. "binary" uses a columnar store '
+              'which is smaller and faster to read.')
+    )
+    parser.add_argument(
+        '--compression',
+        dest='compression',
+        type=str,
+        default=None,
+        choices=['gzip', 'zstd'],
+        help='Compresses the RankLib training file with the chosen algorithm.'
+    )
+    parser.add_argument(
+        '--feature_cache',
+        dest='feature_cache',
+        type=lambda arg: arg.lower() == 'true',
+        default=False,
+        help='If "true" then features already logged are not requested again.'
+    )
+    parser.add_argument(
+        '--feature_cache_size',
+        dest='feature_cache_size',
+        type=int,
+        default=1000000,
+        help='How many feature values the cache keeps in memory.'
+    )
+    parser.add_argument(
+        '--feature_cache_path',
+        dest='feature_cache_path',
+        type=str,
+        default=None,
+        help='Path of SQLite file where cached features are persisted across runs.'
+    )
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        type=lambda arg: arg.lower() == 'true',
+        default=False,
+        help=('If "true" then continues building the training file from its last '
+              'checkpoint, if any. Checkpoints and judgments are only kept in '
+              'destination when this is set, so a run can only be resumed if it was '
+              'also started with it.')
+    )
     parser.add_argument(
         '--destination',
         dest='destination',
@@ -1,6 +1,14 @@
+import sys
+import pathlib
+
 import pytest
 
 
+# Modules shared by components are copied next to each one when building their Docker
+# images.
+sys.path.append(str(pathlib.Path(__file__).parents[3] / 'common'))
+
+
 @pytest.fixture
 def es_log_features():
     return [
@@ -0,0 +1,107 @@
+import mock
+
+from feature_cache import FeatureCache
+
+
+FEATURES = [
+    {'name': 'name', 'params': ['search_term'], 'template': {'match': 'name'}},
+    {'name': 'channel', 'params': ['channel_group'], 'template': {'match': 'ch'}}
+]
+
+
+def build_logs(*values):
+    return [{'name': feature['name'], 'value': value} for feature, value in
+            zip(FEATURES, values)]
+
+
+def test_lookup_and_update():
+    cache = FeatureCache('unittest', FEATURES, 'index_test')
+    search_keys = {'search_term': 'keyword0', 'channel_group': 'direct'}
+
+    values, missing_docs, missing_features = cache.lookup(['doc0', 'doc1'],
+                                                          search_keys)
+    assert values == {'doc0': [None, None], 'doc1': [None, None]}
+    assert missing_docs == ['doc0', 'doc1']
+    assert missing_features is None
+
+    assert cache.update('doc0', search_keys, values['doc0'],
+                        build_logs(0.1, 0.2)) == [0.1, 0.2]
+    assert cache.update('doc1', search_keys, values['doc1'],
+                        [{'name': 'name'}, {'name': 'channel', 'value': 0.4}]) == [0, 0.4]
+
+    # Only the feature depending on the search term must be logged again.
+    search_keys = {'search_term': 'keyword1', 'channel_group': 'direct'}
+    values, missing_docs, missing_features = cache.lookup(['doc0', 'doc1'],
+                                                          search_keys)
+    assert values == {'doc0': [None, 0.2], 'doc1': [None, 0.4]}
+    assert missing_docs == ['doc0', 'doc1']
+    assert missing_features == ['name']
+
+    search_keys = {'search_term': 'keyword0', 'channel_group': 'direct'}
+    values, missing_docs, missing_features = cache.lookup(['doc0'], search_keys)
+    assert values == {'doc0': [0.1, 0.2]}
+    assert missing_docs == []
+    assert missing_features == []
+
+
+def test_lru_eviction():
+    cache = FeatureCache('unittest', FEATURES, 'index_test', max_size=2)
+    search_keys = {'search_term': 'keyword0', 'channel_group': 'direct'}
+    cache.update('doc0', search_keys, [None, None], build_logs(0.1, 0.2))
+    values, _, _ = cache.lookup(['doc0'], search_keys)
+    assert values == {'doc0': [0.1, 0.2]}
+
+    cache.update('doc1', search_keys, [None, None], build_logs(0.3, 0.4))
+    values, _, _ = cache.lookup(['doc0', 'doc1'], search_keys)
+    assert values == {'doc0': [None, None], 'doc1': [0.3, 0.4]}
+
+
+def test_disk_persistence(tmpdir):
+    path = f'{tmpdir}/cache.db'
+    search_keys = {'search_term': 'keyword0', 'channel_group': 'direct'}
+    cache = FeatureCache('unittest', FEATURES, 'index_test', path=path)
+    cache.update('doc0', search_keys, [None, None], build_logs(0.1, 2))
+    cache.close()
+
+    cache = FeatureCache('unittest', FEATURES, 'index_test', path=path)
+    values, missing_docs, _ = cache.lookup(['doc0'], search_keys)
+    assert values == {'doc0': [0.1, 2]}
+    assert missing_docs == []
+    cache.close()
+
+    # Changing the definition of a feature invalidates its values
+    features = [FEATURES[0], dict(FEATURES[1], template={'match': 'other'})]
+    cache = FeatureCache('unittest', features, 'index_test', path=path)
+    values, _, missing_features = cache.lookup(['doc0'], search_keys)
+    assert values == {'doc0': [0.1, None]}
+    assert missing_features == ['channel']
+    cache.close()
+
+    # Values logged from another index aren't reused.
+    cache = FeatureCache('unittest', FEATURES, 'index_other', path=path)
+    values, missing_docs, _ = cache.lookup(['doc0'], search_keys)
+    assert values == {'doc0': [None, None]}
+    assert missing_docs == ['doc0']
+    cache.close()
+
+
+def test_from_elasticsearch():
+    es_client = mock.Mock()
+    es_client.transport.perform_request.return_value = {
+        '_source': {'featureset': {'features': FEATURES}}
+    }
+    es_client.indices.get_settings.return_value = {
+        'index_v2': {'settings': {'index': {'uuid': 'uuid2'}}},
+        'index_v1': {'settings': {'index': {'uuid': 'uuid1'}}}
+    }
+    cache = FeatureCache.from_elasticsearch(es_client, 'unittest', 'index_test',
+                                            max_size=10)
+    es_client.transport.perform_request.assert_called_with(
+        'GET', '/_ltr/_featureset/unittest'
+    )
+    es_client.indices.get_settings.assert_called_with(index='index_test',
+                                                      name='index.uuid')
+    assert cache.index == 'index_v1:uuid1,index_v2:uuid2'
+    assert cache.names == ['name', 'channel']
+    assert cache.params == [['search_term'], ['channel_group']]
+    assert cache.max_size == 10
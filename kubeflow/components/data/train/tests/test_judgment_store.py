@@ -0,0 +1,18 @@
+from judgment_store import JudgmentStoreWriter, read_judgment_store
+
+
+def test_judgment_store(tmpdir):
+    judgments = [
+        ({'search_term': 'keyword0', 'var1': 'val1'}, ['doc0', 'doc1', 'doc2'],
+         [0, 4, 2]),
+        ({'search_term': 'keyword1', 'var1': 'val1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword0', 'var1': 'val1'}, ['doc3'], [3])
+    ]
+    path = f'{tmpdir}/judgments'
+    with JudgmentStoreWriter(path) as writer:
+        for search_keys, docs, grades in judgments:
+            writer.write(search_keys, docs, grades)
+
+    assert list(read_judgment_store(path)) == judgments
+    assert list(read_judgment_store(path, chunk_size=2)) == judgments
+    assert open(f'{path}/doc_ids.json').read() == '["doc0", "doc1", "doc2", "doc3"]'
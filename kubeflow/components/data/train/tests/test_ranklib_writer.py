@@ -0,0 +1,31 @@
+import gzip
+
+import pytest
+
+from ranklib_writer import RankLibWriter, get_train_file_path
+
+
+def test_get_train_file_path():
+    assert get_train_file_path('/dest') == '/dest/train_dataset.txt'
+    assert get_train_file_path('/dest', 'gzip') == '/dest/train_dataset.txt.gz'
+    assert get_train_file_path('/dest', 'zstd') == '/dest/train_dataset.txt.zst'
+    with pytest.raises(ValueError):
+        get_train_file_path('/dest', 'bz2')
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_ranklib_writer(tmpdir, compression):
+    path = get_train_file_path(str(tmpdir), compression)
+    with RankLibWriter(path, compression) as writer:
+        writer.write(4, 0, [0.01, 0.02])
+        writer.write(0, 0, [0.03, 0])
+        writer.write(2, 1, [1, 2, 3])
+
+    opener = gzip.open if compression else open
+    data = opener(path, 'rt').read()
+    expected = (
+        '4\tqid:0\t1:0.01\t2:0.02\n'
+        '0\tqid:0\t1:0.03\t2:0\n'
+        '2\tqid:1\t1:1\t2:2\t3:3\n'
+    )
+    assert data == expected
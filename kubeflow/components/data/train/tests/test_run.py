@@ -6,7 +6,15 @@ import subprocess
 import shutil
 from collections import namedtuple
 
-from run import main
+import numpy as np
+import pytest
+
+from feature_cache import FeatureCache
+from msearch import AdaptiveBatcher
+from run import (main, build_train_file, build_judgment_files, grade_judgments,
+                 process_judgment, read_judgment_files, get_logging_query,
+                 LoggingQueryTemplate, load_checkpoint, split_gzip_file)
+from ranklib_writer import get_train_file_path
 
 
 def test_main(monkeypatch, es_log_features, tmpdir_factory):
@@ -23,6 +31,14 @@ def test_main(monkeypatch, es_log_features, tmpdir_factory):
             'bucket',
             'es_host',
             'es_batch',
+            'es_concurrency',
+            'es_target_latency',
+            'es_max_payload',
+            'judgment_shards',
+            'judgment_format',
+            'compression',
+            'feature_cache',
+            'resume',
             'destination',
             'model_name',
             'index'
@@ -35,6 +51,14 @@ def test_main(monkeypatch, es_log_features, tmpdir_factory):
     args.es_host = 'es_host_test'
     args.model_name = 'unittest'
     args.es_batch = 2
+    args.es_concurrency = 1
+    args.es_target_latency = None
+    args.es_max_payload = None
+    args.judgment_shards = 1
+    args.judgment_format = 'json'
+    args.compression = None
+    args.feature_cache = False
+    args.resume = False
     args.destination = str(tmp_dir)
 
     download_mock = mock.Mock()
@@ -124,3 +148,283 @@ def test_main(monkeypatch, es_log_features, tmpdir_factory):
 
     assert rank_data == expected
     shutil.rmtree('/tmp/pysearchml/unittest', ignore_errors=True)
+
+
+def test_build_train_file_concurrent(monkeypatch, es_log_features, tmpdir_factory):
+    tmp_dir = tmpdir_factory.mktemp('unittest')
+    judgments = [
+        ({'search_term': 'keyword0'}, ['doc0', 'doc1', 'doc2'], [0, 4, 2]),
+        ({'search_term': 'keyword1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword2'}, ['doc3', 'doc4'], [0, 4])
+    ]
+    monkeypatch.setattr('run.read_judgment_files', lambda *_: iter(judgments))
+
+    # Responses are matched by request body as the order msearch is called in is not
+    # deterministic when requests are concurrent.
+    def msearch(body, request_timeout):
+        return es_log_features[0] if 'keyword0' in body else es_log_features[1]
+
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = msearch
+
+    build_train_file('unittest', 2, es_client_mock, str(tmp_dir), 'index_test',
+                     es_concurrency=2)
+
+    rank_data = open(f'{str(tmp_dir)}/train_dataset.txt').read()
+    expected = (
+        '0\tqid:0\t1:0.01\t2:0.02\n4\tqid:0\t1:0.03\t2:0.04\n2\tqid:0\t1:0.05\t'
+        '2:0.06\n0\tqid:1\t1:0.03\t2:0.04\n4\tqid:1\t1:0.05\t2:0\n'
+    )
+    assert rank_data == expected
+
+
+def test_build_train_file_max_payload(monkeypatch, tmpdir_factory):
+    tmp_dir = tmpdir_factory.mktemp('unittest')
+    judgments = [
+        ({'search_term': 'keyword0'}, ['doc0', 'doc1'], [0, 4]),
+        ({'search_term': 'keyword1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword2'}, ['doc3', 'doc4'], [0, 4])
+    ]
+    monkeypatch.setattr('run.read_judgment_files', lambda *_: iter(judgments))
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.return_value = {'responses': [{}]}
+
+    # Every query is larger than the payload limit so each one is sent on its own even
+    # though `es_batch` allows 10 queries per request.
+    batcher = AdaptiveBatcher(10, max_payload=1)
+    build_train_file('unittest', 10, es_client_mock, str(tmp_dir), 'index_test',
+                     batcher=batcher)
+
+    assert es_client_mock.msearch.call_count == 3
+    for call, keyword in zip(es_client_mock.msearch.call_args_list,
+                             ['keyword0', 'keyword1', 'keyword2']):
+        assert keyword in call[1]['body']
+
+
+def test_build_train_file_payload_bound(monkeypatch, tmpdir_factory):
+    judgments = [
+        ({'search_term': 'keyword0'}, ['doc0', 'doc1'], [0, 4]),
+        ({'search_term': 'keyword1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword2'}, ['doc3', 'doc4'], [0, 4])
+    ]
+    monkeypatch.setattr('run.read_judgment_files', lambda *_: iter(judgments))
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = lambda body, request_timeout: {
+        'responses': [{}] * (len(body.split(os.linesep)) // 2)
+    }
+
+    build_train_file('unittest', 10, es_client_mock, str(tmpdir_factory.mktemp('all')),
+                     'index_test')
+    lines = es_client_mock.msearch.call_args[1]['body'].split(os.linesep)
+    sizes = [len(header) + len(body) + 2 * len(os.linesep)
+             for header, body in zip(lines[::2], lines[1::2])]
+
+    # Just one search fits in each request.
+    max_payload = sizes[0] + sizes[1] - 1
+    es_client_mock.reset_mock()
+    build_train_file('unittest', 10, es_client_mock, str(tmpdir_factory.mktemp('bound')),
+                     'index_test', batcher=AdaptiveBatcher(10, max_payload=max_payload))
+
+    assert es_client_mock.msearch.call_count == 3
+    for call in es_client_mock.msearch.call_args_list:
+        assert len(call[1]['body']) <= max_payload
+
+
+def test_grade_judgments():
+    np.random.seed(0)
+    rows = [
+        list(np.random.choice([0.1, 0.2, 0.3, 0.5], size=np.random.randint(1, 30)))
+        for _ in range(500)
+    ]
+    rows.append([])
+    rows.append([0.3, 0.3, 0.3])
+
+    grades = grade_judgments(rows)
+
+    for row, row_grades in zip(rows, grades):
+        if not row or all(x == row[0] for x in row):
+            assert row_grades is None
+            continue
+        percentiles = np.percentile(row, [20, 40, 60, 80, 100])
+        expected = [process_judgment(percentiles, judgment) for judgment in row]
+        assert row_grades.tolist() == expected
+
+
+@pytest.mark.parametrize('judgment_format', ['json', 'binary'])
+def test_build_judgment_files_sharded(monkeypatch, judgment_format):
+    shutil.rmtree('/tmp/pysearchml/unittest', ignore_errors=True)
+
+    class MockModel:
+        def fit(self, *args, **kwargs):
+            return self
+
+        def export_judgments(self, model_path: str):
+            shutil.copyfile('tests/fixtures/model.gz', model_path)
+
+    dbn_mock = mock.Mock()
+    dbn_mock.DBNModel.return_value = MockModel()
+    monkeypatch.setattr('run.DBN', dbn_mock)
+
+    build_judgment_files('unittest', shards=2, judgment_format=judgment_format)
+
+    judgments_path = '/tmp/pysearchml/unittest/judgments'
+    extension = '.gz' if judgment_format == 'json' else ''
+    assert sorted(os.listdir(judgments_path)) == [f'judgments_0{extension}',
+                                                  f'judgments_1{extension}']
+    data = list(read_judgment_files('unittest'))
+
+    # Judgments are read in the same order as without shards.
+    build_judgment_files('unittest', shards=1, judgment_format=judgment_format)
+    assert data == list(read_judgment_files('unittest'))
+    assert len(data) == 3
+    shutil.rmtree('/tmp/pysearchml/unittest', ignore_errors=True)
+
+
+def test_split_gzip_file(tmpdir):
+    path = f'{tmpdir}/model.gz'
+    rows = [f'{{"row": {idx}}}\n'.encode() for idx in range(23)]
+    with gzip.GzipFile(path, 'wb') as f:
+        f.writelines(rows)
+
+    shards_paths = split_gzip_file(path, 11)
+
+    assert shards_paths[:3] == [f'{tmpdir}/model_00.gz', f'{tmpdir}/model_01.gz',
+                                f'{tmpdir}/model_02.gz']
+    assert shards_paths[-1] == f'{tmpdir}/model_10.gz'
+    assert sorted(shards_paths) == shards_paths
+    assert [row for shard_path in sorted(shards_paths)
+            for row in gzip.GzipFile(shard_path)] == rows
+    # Rows are split in contiguous chunks.
+    assert list(gzip.GzipFile(shards_paths[0])) == rows[:3]
+
+
+def test_logging_query_template():
+    template = LoggingQueryTemplate('unittest', 'index_test')
+    assert template.header == '{"index": "index_test"}'
+
+    docs = ['doc0', 'doc"1']
+    search_keys = {'search_term': 'key "word"', 'var1': 'val1'}
+    expected = json.dumps(get_logging_query('unittest', docs, search_keys))
+    assert template.render(docs, search_keys) == expected
+
+
+def test_build_train_file_feature_cache(monkeypatch, es_log_features, tmpdir_factory):
+    tmp_dir = tmpdir_factory.mktemp('unittest')
+    judgments = [
+        ({'search_term': 'keyword0'}, ['doc0', 'doc1', 'doc2'], [0, 4, 2]),
+        ({'search_term': 'keyword1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword2'}, ['doc3', 'doc4'], [0, 4])
+    ]
+    monkeypatch.setattr('run.read_judgment_files', lambda *_: iter(judgments))
+    features = [
+        {'name': 'f1', 'params': ['search_term'], 'template': {}},
+        {'name': 'f2', 'params': [], 'template': {}}
+    ]
+    cache_path = f'{tmp_dir}/cache.db'
+    expected = (
+        '0\tqid:0\t1:0.01\t2:0.02\n4\tqid:0\t1:0.03\t2:0.04\n2\tqid:0\t1:0.05\t'
+        '2:0.06\n0\tqid:1\t1:0.03\t2:0.04\n4\tqid:1\t1:0.05\t2:0.06\n'
+    )
+
+    # Feature `f2` doesn't depend on the query so doc2 must have the same value in
+    # both queries.
+    es_log_features[0]['responses'][1]['hits']['hits'][1]['fields']['_ltrlog'][0][
+        'main'][1] = {'value': 0.06}
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = es_log_features
+    feature_cache = FeatureCache('unittest', features, 'index_test',
+                                 path=cache_path)
+    build_train_file('unittest', 2, es_client_mock, str(tmp_dir), 'index_test',
+                     feature_cache=feature_cache)
+    feature_cache.close()
+
+    assert open(f'{str(tmp_dir)}/train_dataset.txt').read() == expected
+
+    # Second run reads everything from the cache on disk except doc4 which was not
+    # found in Elasticsearch.
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.return_value = {'responses': [{}]}
+    feature_cache = FeatureCache('unittest', features, 'index_test',
+                                 path=cache_path)
+    build_train_file('unittest', 2, es_client_mock, str(tmp_dir), 'index_test',
+                     feature_cache=feature_cache)
+    feature_cache.close()
+
+    assert es_client_mock.msearch.call_count == 1
+    assert '"_id": ["doc4"]' in es_client_mock.msearch.call_args[1]['body']
+    assert open(f'{str(tmp_dir)}/train_dataset.txt').read() == expected
+
+    # Only the feature depending on the query is logged for a new search term.
+    judgments[:] = [({'search_term': 'keyword9'}, ['doc0', 'doc1'], [0, 4])]
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.return_value = {
+        'responses': [
+            {
+                'hits': {
+                    'hits': [
+                        {'_id': 'doc1', 'fields': {'_ltrlog': [{'main': [
+                            {'name': 'f1', 'value': 0.7}, {'name': 'f2'}]}]}},
+                        {'_id': 'doc0', 'fields': {'_ltrlog': [{'main': [
+                            {'name': 'f1', 'value': 0.8}, {'name': 'f2'}]}]}}
+                    ]
+                }
+            }
+        ]
+    }
+    feature_cache = FeatureCache('unittest', features, 'index_test',
+                                 path=cache_path)
+    build_train_file('unittest', 2, es_client_mock, str(tmp_dir), 'index_test',
+                     feature_cache=feature_cache)
+    feature_cache.close()
+
+    assert '"active_features": ["f1"]' in es_client_mock.msearch.call_args[1]['body']
+    assert open(f'{str(tmp_dir)}/train_dataset.txt').read() == (
+        '0\tqid:0\t1:0.8\t2:0.02\n4\tqid:0\t1:0.7\t2:0.04\n'
+    )
+
+
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_build_train_file_resume(monkeypatch, es_log_features, tmpdir_factory,
+                                 compression):
+    tmp_dir = str(tmpdir_factory.mktemp('unittest'))
+    judgments = [
+        ({'search_term': 'keyword0'}, ['doc0', 'doc1', 'doc2'], [0, 4, 2]),
+        ({'search_term': 'keyword1'}, ['doc1', 'doc2'], [0, 4]),
+        ({'search_term': 'keyword2'}, ['doc3', 'doc4'], [0, 4])
+    ]
+    monkeypatch.setattr('run.read_judgment_files', lambda *_: iter(judgments))
+
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = [es_log_features[0], Exception('timeout')]
+    with pytest.raises(Exception):
+        build_train_file('unittest', 2, es_client_mock, tmp_dir, 'index_test',
+                         compression=compression, resume=True)
+
+    path = get_train_file_path(tmp_dir, compression)
+    # Simulates data that was written after the last checkpoint.
+    with open(path, 'ab') as f:
+        f.write(b'partial row')
+
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = [es_log_features[1]]
+    build_train_file('unittest', 2, es_client_mock, tmp_dir, 'index_test',
+                     compression=compression, resume=True)
+
+    assert es_client_mock.msearch.call_count == 1
+    assert 'keyword2' in es_client_mock.msearch.call_args[1]['body']
+    opener = gzip.open if compression else open
+    rank_data = opener(path, 'rt').read()
+    expected = (
+        '0\tqid:0\t1:0.01\t2:0.02\n4\tqid:0\t1:0.03\t2:0.04\n2\tqid:0\t1:0.05\t'
+        '2:0.06\n0\tqid:1\t1:0.03\t2:0.04\n4\tqid:1\t1:0.05\t2:0\n'
+    )
+    assert rank_data == expected
+    assert load_checkpoint(tmp_dir)['queries_read'] == 3
+
+    # Runs that can't be resumed don't save checkpoints.
+    es_client_mock = mock.Mock()
+    es_client_mock.msearch.side_effect = es_log_features
+    build_train_file('unittest', 2, es_client_mock, tmp_dir, 'index_test',
+                     compression=compression)
+    assert opener(path, 'rt').read() == expected
+    assert load_checkpoint(tmp_dir) is None
@@ -7,11 +7,14 @@ from shutil import rmtree
 
 from google.cloud import storage, bigquery
 
+from transfer import download_blobs
+
 
 PATH = pathlib.Path(__file__).parent
 
 
-def main(validation_init_date, validation_end_date, bucket, destination):
+def main(validation_init_date, validation_end_date, bucket, destination,
+         download_workers=8):
     # Remove everything and deletes destination folder to receive new files.
     rmtree(destination, ignore_errors=True)
     os.makedirs(destination, exist_ok=True)
@@ -49,11 +52,8 @@ def main(validation_init_date, validation_end_date, bucket, destination):
     job.result()
 
     # Download data
-    bucket_obj = storage_client.bucket(bucket.split('/')[0])
-    blobs = bucket_obj.list_blobs(prefix=bucket.partition('/')[-1])
-    for blob in blobs:
-        blob.download_to_filename(f"{destination}/{blob.name.split('/')[-1]}")
-        blob.delete()
+    download_blobs(storage_client, bucket.split('/')[0], bucket.partition('/')[-1],
+                   destination, max_workers=download_workers)
 
     # delete BQ table
     bq_client.delete_table(table_ref)
@@ -84,11 +84,19 @@ if __name__ == '__main__':
         type=str,
         help='Path where validation dataset gzipped files will be stored.'
     )
+    parser.add_argument(
+        '--download_workers',
+        dest='download_workers',
+        type=int,
+        default=8,
+        help='How many files exported to GCS are downloaded concurrently.'
+    )
 
     args, _ = parser.parse_known_args(sys.argv[1:])
     main(
         args.validation_init_date,
         args.validation_end_date,
         args.bucket,
-        args.destination
+        args.destination,
+        args.download_workers
     )
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Optional
+
+import numpy as np
+
+from lambdamart import LambdaMART, RankingData, load_ranklib_file, normalize_sum
+from ranklib_model import RankLibModel
+from train_matrix import build_train_matrix, load_train_matrix
+
+
+"""
+Compares training LambdaMART with the RankLib jar against the native NumPy trainer on
+the same training file, timing both runs and reporting the ERR@10 each model reaches on
+the training data. If no file is given then a synthetic one is written. Run it from
+the component folder with:
+
+    python -m benchmarks.lambdamart --queries=2000 --trees=100 --leaves=10
+
+The jar is skipped if `java` isn't available.
+"""
+
+
+def write_train_file(path: str, queries: int, docs: int, n_features: int,
+                     seed: int) -> None:
+    rng = np.random.RandomState(seed)
+    weights = rng.randn(n_features)
+    with open(path, 'w') as f:
+        for qid in range(queries):
+            X = rng.rand(rng.randint(2, docs + 1), n_features)
+            y = np.clip((X @ weights + rng.randn(len(X))).round(), 0, 4).astype(int)
+            for label, row in zip(y, X):
+                features = '\t'.join(f'{idx + 1}:{value:.6f}'
+                                     for idx, value in enumerate(row))
+                f.write(f'{label}\tqid:{qid}\t{features}\n')
+
+
+def mean_err(scores: np.ndarray, data: RankingData, k: int = 10) -> float:
+    errs = []
+    for start, end in zip(data.offsets[:-1], data.offsets[1:]):
+        labels = data.y[start:end][np.argsort(-scores[start:end], kind='stable')][:k]
+        R = (2 ** labels - 1) / 2 ** 4
+        reach = np.concatenate([[1], np.cumprod(1 - R)[:-1]])
+        errs.append(np.sum(R * reach / np.arange(1, len(R) + 1)))
+    return float(np.mean(errs))
+
+
+def run_jar(train_file_path: str, trees: int, leaves: int,
+            model_path: str) -> Optional[float]:
+    if shutil.which('java') is None:
+        return None
+    start = time.perf_counter()
+    subprocess.run(['java', '-jar', 'ranklib/RankLib-2.14.jar', '-ranker', '6',
+                    '-train', train_file_path, '-norm', 'sum', '-save', model_path,
+                    '-tree', str(trees), '-leaf', str(leaves), '-metric2t', 'ERR'],
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main(train_file_path: Optional[str], queries: int, docs: int, n_features: int,
+         trees: int, leaves: int, workers: Optional[int], seed: int) -> None:
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if train_file_path is None:
+            train_file_path = os.path.join(tmp_dir, 'train_dataset.txt')
+            write_train_file(train_file_path, queries, docs, n_features, seed)
+
+        start = time.perf_counter()
+        data = load_ranklib_file(train_file_path)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        model = LambdaMART(trees, leaves, workers=workers).fit(data)
+        native_time = time.perf_counter() - start
+        X = normalize_sum(data.X, data.offsets)
+
+        # What trials after the first one pay to load the training data.
+        build_train_matrix(train_file_path)
+        start = time.perf_counter()
+        np.asarray(load_train_matrix(train_file_path, 'sum').X).sum()
+        mmap_time = time.perf_counter() - start
+
+        print(f'{data.offsets.size - 1} queries, {len(data.y)} documents, '
+              f'{data.X.shape[1]} features')
+        print('trainer\tseconds\ttrain ERR@10')
+        print(f'native\t{load_time + native_time:.2f} (load {load_time:.2f})\t'
+              f'{mean_err(model.scores, data):.4f}')
+        print(f'binary matrix load: {mmap_time:.3f}s vs text parse: {load_time:.2f}s')
+
+        jar_model_path = os.path.join(tmp_dir, 'model.txt')
+        jar_time = run_jar(train_file_path, trees, leaves, jar_model_path)
+        if jar_time is None:
+            print('jar\tskipped, java not found')
+        else:
+            jar_scores = RankLibModel.from_file(jar_model_path).predict(X)
+            print(f'jar\t{jar_time:.2f}\t{mean_err(jar_scores, data):.4f}')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--train_file_path',
+        dest='train_file_path',
+        type=str,
+        default=None,
+        help='RankLib training file. A synthetic one is used if not set.'
+    )
+    parser.add_argument(
+        '--queries',
+        dest='queries',
+        type=int,
+        default=2000,
+        help='How many queries the synthetic training file has.'
+    )
+    parser.add_argument(
+        '--docs',
+        dest='docs',
+        type=int,
+        default=50,
+        help='Maximum number of documents of each synthetic query.'
+    )
+    parser.add_argument(
+        '--features',
+        dest='features',
+        type=int,
+        default=10,
+        help='How many features each synthetic document has.'
+    )
+    parser.add_argument(
+        '--trees',
+        dest='trees',
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        '--leaves',
+        dest='leaves',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=None,
+        help='Threads of the native trainer, defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    main(args.train_file_path, args.queries, args.docs, args.features, args.trees,
+         args.leaves, args.workers, args.seed)
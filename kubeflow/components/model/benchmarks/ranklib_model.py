@@ -0,0 +1,127 @@
+import sys
+import time
+import argparse
+from typing import List, Optional
+
+import numpy as np
+
+from ranklib_model import RankLibModel
+
+
+"""
+Measures the cost of scoring documents with RankLib ensembles by number of trees and of
+leaves per tree. The flattened `RankLibModel.predict` is compared against walking each
+tree for each document. Run it from the component folder with:
+
+    python -m benchmarks.ranklib_model --docs=20000 --trees=10,100,500 --leaves=10,30
+"""
+
+
+def build_split(
+    rng: np.random.RandomState,
+    leaves: int,
+    n_features: int,
+    pos: Optional[str] = None
+) -> str:
+    pos = f' pos="{pos}"' if pos else ''
+    if leaves == 1:
+        return f'<split{pos}><output> {rng.randn():.6f} </output></split>'
+    left = rng.randint(1, leaves)
+    return (
+        f'<split{pos}><feature> {rng.randint(1, n_features + 1)} </feature>'
+        f'<threshold> {rng.rand():.6f} </threshold>'
+        f'{build_split(rng, left, n_features, "left")}'
+        f'{build_split(rng, leaves - left, n_features, "right")}</split>'
+    )
+
+
+def build_model(rng: np.random.RandomState, trees: int, leaves: int,
+                n_features: int) -> str:
+    return '## LambdaMART\n<ensemble>' + ''.join(
+        f'<tree id="{idx + 1}" weight="0.1">{build_split(rng, leaves, n_features)}'
+        '</tree>' for idx in range(trees)
+    ) + '</ensemble>'
+
+
+def predict_by_row(model: RankLibModel, X: np.ndarray) -> List[float]:
+    scores = []
+    for row in X.tolist():
+        score = 0.0
+        for node in model.roots.tolist():
+            while model.left[node] != node:
+                if row[model.feature[node]] <= model.threshold[node]:
+                    node = model.left[node]
+                else:
+                    node = model.right[node]
+            score += model.value[node]
+        scores.append(score)
+    return scores
+
+
+def main(docs: int, trees: List[int], leaves: List[int], n_features: int,
+         seed: int) -> None:
+    rng = np.random.RandomState(seed)
+    X = rng.rand(docs, n_features).astype(np.float32)
+    # Walking trees per document is too slow to run over all of them.
+    sample = X[:min(docs, 1000)]
+
+    print('trees\tleaves\tdepth\tpredict docs/s\tby row docs/s\tspeedup')
+    for n_trees in trees:
+        for n_leaves in leaves:
+            model = RankLibModel.from_string(
+                build_model(rng, n_trees, n_leaves, n_features)
+            )
+
+            start = time.perf_counter()
+            scores = model.predict(X)
+            predict_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            expected = predict_by_row(model, sample)
+            by_row_time = time.perf_counter() - start
+
+            np.testing.assert_allclose(scores[:len(sample)], expected)
+            predict_rate = docs / predict_time
+            by_row_rate = len(sample) / by_row_time
+            print(f'{n_trees}\t{n_leaves}\t{model.depth}\t{predict_rate:,.0f}\t'
+                  f'{by_row_rate:,.0f}\t{predict_rate / by_row_rate:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--docs',
+        dest='docs',
+        type=int,
+        default=20000,
+        help='How many documents to score.'
+    )
+    parser.add_argument(
+        '--trees',
+        dest='trees',
+        type=lambda arg: [int(value) for value in arg.split(',')],
+        default=[10, 100, 500],
+        help='Comma separated numbers of trees to benchmark.'
+    )
+    parser.add_argument(
+        '--leaves',
+        dest='leaves',
+        type=lambda arg: [int(value) for value in arg.split(',')],
+        default=[10, 30],
+        help='Comma separated numbers of leaves per tree to benchmark.'
+    )
+    parser.add_argument(
+        '--features',
+        dest='features',
+        type=int,
+        default=20,
+        help='How many features each document has.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    main(args.docs, args.trees, args.leaves, args.features, args.seed)
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.lambdamart import write_train_file
+from ranklib_runner import build_command, run_ranklib
+from ranklib_server import RankLibPool, build_server_command
+
+
+"""
+Compares sweeping RankLib configurations with a new JVM for each one, as Katib trials
+do, against a warm `ranklib_server.RankLibPool` that loads the training data once. Run
+it from the component folder, after compiling the server, with:
+
+    javac -cp ranklib/RankLib-2.14.jar ranklib/RankLibServer.java
+    python -m benchmarks.ranklib_server --configs=20 --queries=500
+
+Nothing is run if `java` isn't available.
+"""
+
+
+def sample_params(configs: int, seed: int) -> List[Dict[str, str]]:
+    rng = np.random.RandomState(seed)
+    return [
+        {
+            'tree': str(rng.randint(5, 50)),
+            'leaf': str(rng.randint(2, 20)),
+            'shrinkage': f'{rng.uniform(0.01, 0.2):.3f}'
+        }
+        for _ in range(configs)
+    ]
+
+
+def main(train_file_path: str, queries: int, configs: int, workers: int,
+         seed: int) -> None:
+    if shutil.which('java') is None:
+        print('java not found')
+        return
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if train_file_path is None:
+            train_file_path = os.path.join(tmp_dir, 'train_dataset.txt')
+            write_train_file(train_file_path, queries, 50, 10, seed)
+        param_sets = sample_params(configs, seed)
+
+        start = time.perf_counter()
+        for index, params in enumerate(param_sets):
+            cmd = build_command('6', train_file_path, f'{tmp_dir}/cold_{index}.txt',
+                                params)
+            run_ranklib(cmd)
+        cold_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with RankLibPool(build_server_command(train_file_path), workers) as pool:
+            load_time = time.perf_counter() - start
+            pool.sweep('6', param_sets, tmp_dir)
+        warm_time = time.perf_counter() - start
+
+        print(f'{configs} configurations')
+        print('runner\tseconds\tper configuration')
+        print(f'cold\t{cold_time:.2f}\t{cold_time / configs:.3f}')
+        print(f'warm\t{warm_time:.2f} (load {load_time:.2f})\t'
+              f'{(warm_time - load_time) / configs:.3f}')
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--train_file_path',
+        dest='train_file_path',
+        type=str,
+        default=None,
+        help='RankLib training file. A synthetic one is used if not set.'
+    )
+    parser.add_argument(
+        '--queries',
+        dest='queries',
+        type=int,
+        default=500,
+        help='How many queries the synthetic training file has.'
+    )
+    parser.add_argument(
+        '--configs',
+        dest='configs',
+        type=int,
+        default=20,
+        help='How many configurations are trained by each runner.'
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='How many servers the warm pool runs.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    main(args.train_file_path, args.queries, args.configs, args.workers, args.seed)
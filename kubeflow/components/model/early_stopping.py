@@ -0,0 +1,99 @@
+from typing import List, Optional
+
+import numpy as np
+
+
+"""
+Early stopping of validation runs whose model can't beat the best rank found so far.
+
+Searches are validated in multisearch batches, so after each batch the rank of the
+searches seen so far is an estimate of the rank of the whole validation set. It's a
+ratio estimator whose standard error is approximated with the delta method:
+
+    se = \\sqrt{\\frac{\\sum_i (num_i - rank * den_i)^2}{n(n-1)}} / \\bar{den}
+
+where `num_i` and `den_i` are the numerator and denominator of the rank equation for
+search `i`. Once `rank - sigmas * se` is above the best rank, the validation stops.
+"""
+
+
+class EarlyStop(Exception):
+    """
+    Raised when validation is stopped early.
+
+    Args
+    ----
+      rank: float
+          Rank of the searches validated so far.
+      bound: float
+          Lower bound of the rank of the whole validation set.
+      searches: int
+          How many searches were validated.
+    """
+    def __init__(self, rank: float, bound: float, searches: int):
+        super().__init__(f'rank={rank:.4f} lower bound={bound:.4f} is above best rank '
+                         f'after {searches} searches')
+        self.rank = rank
+        self.bound = bound
+        self.searches = searches
+
+    def __reduce__(self):
+        # Lets the exception travel back from pool workers.
+        return EarlyStop, (self.rank, self.bound, self.searches)
+
+
+class RankMonitor:
+    """
+    Keeps running sums of the rank equation of each search to bound the final rank.
+
+    Args
+    ----
+      best_rank: float
+          Rank to beat.
+      sigmas: float
+          How many standard errors below the running rank the lower bound is.
+      min_searches: int
+          Validation never stops before this many searches, as the standard error is
+          unreliable for few searches.
+    """
+    def __init__(self, best_rank: float, sigmas: float = 3.0, min_searches: int = 1000):
+        self.best_rank = best_rank
+        self.sigmas = sigmas
+        self.min_searches = min_searches
+        self.searches = 0
+        self._sums = np.zeros(5)
+
+    @property
+    def rank(self) -> float:
+        _, _, rank_num, rank_den, _ = self._sums
+        return rank_num / rank_den if rank_den else 0.5
+
+    @property
+    def bound(self) -> float:
+        """
+        Lower bound of the rank of all searches, `-inf` if it can't be computed yet.
+        """
+        num_sq, den_sq, rank_num, rank_den, num_den = self._sums
+        n = self.searches
+        if n < 2 or not rank_den:
+            return -np.inf
+        rank = rank_num / rank_den
+        residuals = max(num_sq - 2 * rank * num_den + rank ** 2 * den_sq, 0.0)
+        se = np.sqrt(residuals / (n * (n - 1))) / (rank_den / n)
+        return rank - self.sigmas * se
+
+    def update(self, ranks: List[Optional[np.ndarray]]) -> None:
+        """
+        Adds the percentile ranks of a batch of searches, as returned by
+        `RankEvaluator.evaluate`, and raises `EarlyStop` if the best rank can't be
+        beaten anymore.
+        """
+        num = np.array([0.0 if r is None else r.sum() for r in ranks])
+        den = np.array([0 if r is None else r.size for r in ranks], dtype=float)
+        self._sums += [num @ num, den @ den, num.sum(), den.sum(), num @ den]
+        self.searches += len(ranks)
+        bound = self.bound
+        print(f'running rank={self.rank:.4f}, lower bound={bound:.4f} after '
+              f'{self.searches} searches')
+        if self.searches >= self.min_searches and bound > self.best_rank:
+            raise EarlyStop(self.rank, bound, self.searches)
@@ -0,0 +1,198 @@
+import copy
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+from typing import Dict, List, Optional
+
+from early_stopping import RankMonitor
+from sampling import RankEstimate, estimate_rank, load_sample
+from validate import (get_files, init_worker, merge_results, replay_model,
+                      validate_file)
+
+
+"""
+Long-lived service that validates trained models over several validation sets with a
+single pool of workers.
+"""
+
+
+class EvaluationService:
+    """
+    Owns a pool of processes, each one keeping its own Elasticsearch client so HTTP
+    connections are reused by every file and every call to `evaluate`. The pool is
+    created on the first evaluation, sized to how many files there are to validate up
+    to `workers`, and lives until the service is closed.
+
+    Args
+    ----
+      es_host: str
+          Host address to reach Elasticsearch.
+      model_name: str
+          Name of RankLib model saved on Elasticsearch.
+      index: str
+          Name of Index where documents are stored in Elasticsearch.
+      es_batch: int
+          How many searches to send in each multisearch request.
+      es_target_latency: Optional[float]
+          If set then the batch size is adapted so responses take around this many
+          seconds.
+      workers: Optional[int]
+          Maximum number of processes, defaults to the number of CPUs. If 1 then
+          files are validated in the current process.
+    """
+    def __init__(
+        self,
+        es_host: str,
+        model_name: str,
+        index: str = 'pysearchml',
+        es_batch: int = 1000,
+        es_target_latency: Optional[float] = None,
+        workers: Optional[int] = None
+    ):
+        self.es_host = es_host
+        self.model_name = model_name
+        self.index = index
+        self.es_batch = es_batch
+        self.es_target_latency = es_target_latency
+        self.workers = workers or cpu_count()
+        self._pool = None
+        self._local_client = False
+
+    def _get_pool(self, tasks: int) -> Optional[Pool]:
+        if self._pool is None and self.workers > 1 and tasks > 1:
+            self._pool = Pool(min(self.workers, tasks), initializer=init_worker,
+                              initargs=(self.es_host,))
+        return self._pool
+
+    def evaluate(
+        self,
+        *files_paths: str,
+        replay: bool = False,
+        model_path: Optional[str] = None,
+        monitor: Optional[RankMonitor] = None
+    ) -> List[Dict[str, float]]:
+        """
+        Validates the model concurrently over each set of files.
+
+        Args
+        ----
+          files_paths: str
+              Each one is a folder with a validation set.
+          replay: bool
+              If `True` then the model in `model_path` rescores captured searches
+              locally, see `validate.validate_model`.
+          model_path: Optional[str]
+          monitor: Optional[RankMonitor]
+              If set then each file of the first set is stopped with
+              `early_stopping.EarlyStop` as soon as its searches show the model can't
+              beat the best rank. Each file is monitored by its own copy, as files
+              validated in the pool can't share one, so early stopping is the same
+              regardless of `workers`. Not used when replaying.
+
+        Returns
+        -------
+          metrics: List[Dict[str, float]]
+              Metrics of the model for each validation set, see `metrics.py`.
+        """
+        start = time.perf_counter()
+        if replay:
+            tasks = [(files_path, self.model_name, self.index, self.es_batch,
+                      self.es_target_latency, model_path) for files_path in files_paths]
+            return self._run(replay_model, tasks)
+
+        files = [get_files(files_path) for files_path in files_paths]
+        tasks = [(file_, self.model_name, self.index, self.es_batch,
+                  self.es_target_latency, None,
+                  copy.deepcopy(monitor) if idx == 0 else None)
+                 for idx, set_files in enumerate(files) for file_ in set_files]
+        results = self._run(validate_file, tasks)
+        seconds = time.perf_counter() - start
+
+        metrics, offset = [], 0
+        for set_files in files:
+            metrics.append(
+                merge_results(results[offset:offset + len(set_files)], seconds)
+            )
+            offset += len(set_files)
+        return metrics
+
+    def estimate(
+        self,
+        *files_paths: str,
+        rate: float,
+        confidence: float = 0.95,
+        seed: int = 0
+    ) -> List[RankEstimate]:
+        """
+        Validates the model over a stratified sample of the queries of each set of
+        files, see `sampling.py`.
+
+        Args
+        ----
+          files_paths: str
+              Each one is a folder with a validation set.
+          rate: float
+              Fraction of the distinct queries to validate.
+          confidence: float
+              Confidence level of the interval of the estimated rank.
+          seed: int
+              Picks which queries are sampled, the same for every trial.
+
+        Returns
+        -------
+          estimates: List[RankEstimate]
+              Estimated rank of the model for each validation set.
+        """
+        files = [get_files(files_path) for files_path in files_paths]
+        samples = [load_sample(set_files, rate, seed) for set_files in files]
+        tasks = [(file_, self.model_name, self.index, self.es_batch,
+                  self.es_target_latency, sample)
+                 for set_files, sample in zip(files, samples) for file_ in set_files]
+        results = self._run(validate_file, tasks)
+
+        estimates, offset = [], 0
+        for set_files, sample in zip(files, samples):
+            set_results = results[offset:offset + len(set_files)]
+            offset += len(set_files)
+            query_ranks = {}
+            for result in set_results:
+                for key, (rank_num, rank_den) in result.query_ranks.items():
+                    num, den = query_ranks.get(key, (0.0, 0))
+                    query_ranks[key] = (num + rank_num, den + rank_den)
+            rank, low, high = estimate_rank(query_ranks, sample, confidence, seed=seed)
+            searches = sum(result.searches for result in set_results)
+            print(f'estimated rank={rank:.4f} ({confidence:.0%} interval {low:.4f} - '
+                  f'{high:.4f}) from {searches} searches of {len(sample.strata)} '
+                  'queries')
+            estimates.append(RankEstimate(rank, low, high, searches))
+        return estimates
+
+    def _run(self, func, tasks: List[tuple]) -> list:
+        pool = self._get_pool(len(tasks))
+        if pool is None:
+            if not self._local_client:
+                init_worker(self.es_host)
+                self._local_client = True
+            return [func(*task) for task in tasks]
+        return pool.starmap(func, tasks)
+
+    def close(self, terminate: bool = False) -> None:
+        """
+        Waits for the pool to finish its tasks or, if `terminate` is `True`, stops it
+        right away.
+        """
+        if self._pool is not None:
+            if terminate:
+                self._pool.terminate()
+            else:
+                self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Files still being validated are useless if the evaluation failed or stopped
+        # early.
+        self.close(terminate=exc_type is not None)
@@ -0,0 +1,524 @@
+import io
+import gzip
+import heapq
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+"""
+LambdaMART trained natively with NumPy, as an alternative to running the RankLib jar.
+The training file is read just once into dense arrays and trees are grown from
+histograms of gradients over binned features, so each split costs one pass over the
+documents of the node regardless of how many thresholds are tested.
+
+The model is exported in the same format RankLib saves it, which is what Elasticsearch
+LTR and `ranklib_model.RankLibModel` read.
+"""
+
+
+# Bounds how many pairs of documents are scored at once when computing lambdas.
+MAX_PAIRS = 1 << 22
+
+
+class RankingData(NamedTuple):
+    # Features of each document, shape (documents, features).
+    X: np.ndarray
+    # Graded relevance of each document.
+    y: np.ndarray
+    # Documents of query `i` are in rows `offsets[i]` until `offsets[i + 1]`.
+    offsets: np.ndarray
+
+
+class Tree(NamedTuple):
+    # Nodes are in arrays where leaves have -1 as their children.
+    feature: np.ndarray
+    threshold: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    output: np.ndarray
+
+
+class _QueryBatch(NamedTuple):
+    # Documents of queries padded to the same length, shape (queries, length).
+    docs: np.ndarray
+    valid: np.ndarray
+
+
+def open_train_file(path: str) -> io.TextIOBase:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt')
+    if path.endswith('.zst'):
+        import zstandard
+
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb')))
+    return open(path)
+
+
+def load_ranklib_file(path: str) -> RankingData:
+    """
+    Reads a training file in the RankLib format, such as:
+
+        4    qid:1    1:0.56    2:1.3    # optional comment
+
+    Rows of the same query are expected to be consecutive, as RankLib does.
+    """
+    labels = array('f')
+    rows = array('i')
+    cols = array('i')
+    values = array('f')
+    offsets = array('q', [0])
+    last_qid = None
+    n_docs = 0
+    with open_train_file(path) as f:
+        for line in f:
+            tokens = line.split('#', 1)[0].split()
+            if not tokens:
+                continue
+            if tokens[1] != last_qid and n_docs:
+                offsets.append(n_docs)
+            last_qid = tokens[1]
+            labels.append(float(tokens[0]))
+            for token in tokens[2:]:
+                col, value = token.split(':')
+                cols.append(int(col) - 1)
+                values.append(float(value))
+            rows.extend([n_docs] * (len(tokens) - 2))
+            n_docs += 1
+    offsets.append(n_docs)
+
+    cols = np.frombuffer(cols, dtype=np.int32)
+    X = np.zeros((n_docs, int(cols.max(initial=-1)) + 1), dtype=np.float32)
+    X[np.frombuffer(rows, dtype=np.int32), cols] = np.frombuffer(values,
+                                                                 dtype=np.float32)
+    return RankingData(X, np.frombuffer(labels, dtype=np.float32),
+                       np.frombuffer(offsets, dtype=np.int64))
+
+
+def normalize_sum(X: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Divides each feature by the sum of its absolute values over the documents of the
+    same query, as `-norm sum` does in RankLib.
+    """
+    if not len(X):
+        return X
+    sums = np.add.reduceat(np.abs(X), offsets[:-1], axis=0)
+    sums[sums == 0] = 1
+    return (X / np.repeat(sums, np.diff(offsets), axis=0)).astype(np.float32)
+
+
+def get_thresholds(values: np.ndarray, n_thresholds: Optional[int] = 256) -> np.ndarray:
+    """
+    Candidate thresholds of a feature. As in RankLib, every distinct value is a
+    candidate unless there are more than `n_thresholds` of them, in which case the
+    candidates are evenly spaced between the minimum and the maximum.
+    """
+    unique = np.unique(values.astype(np.float32))
+    if n_thresholds is None or len(unique) <= n_thresholds:
+        return unique
+    step = (float(unique[-1]) - float(unique[0])) / n_thresholds
+    grid = float(unique[0]) + step * np.arange(n_thresholds)
+    return np.unique(np.append(grid.astype(np.float32), unique[-1]))
+
+
+class LambdaMART:
+    """
+    Gradient boosted regression trees fitted to the lambdas of pairs of documents of
+    the same query, scaled by how much swapping them changes the target metric.
+
+    Args
+    ----
+      n_trees: int
+      n_leaves: int
+          Number of leaves of each tree.
+      learning_rate: float
+          Weight of each tree in the ensemble.
+      n_thresholds: Optional[int]
+          Maximum number of candidate thresholds per feature, all distinct values if
+          `None`.
+      min_leaf_support: int
+          Minimum number of documents in each leaf.
+      metric: str
+          Either "ERR@k" or "NDCG@k" for any cutoff `k`.
+      norm: Optional[str]
+          Either "sum" or `None` for no normalization of features.
+      workers: Optional[int]
+          Number of threads building histograms and lambdas, defaults to the number
+          of CPUs.
+    """
+    def __init__(
+        self,
+        n_trees: int = 1000,
+        n_leaves: int = 10,
+        learning_rate: float = 0.1,
+        n_thresholds: Optional[int] = 256,
+        min_leaf_support: int = 1,
+        metric: str = 'ERR@10',
+        norm: Optional[str] = 'sum',
+        workers: Optional[int] = None
+    ):
+        name, _, k = metric.upper().partition('@')
+        if name not in ('ERR', 'NDCG'):
+            raise ValueError(f'Invalid value for metric: "{metric}"')
+        if norm not in ('sum', None):
+            raise ValueError(f'Invalid value for norm: "{norm}"')
+        self.n_trees = n_trees
+        self.n_leaves = n_leaves
+        self.learning_rate = learning_rate
+        self.n_thresholds = n_thresholds
+        self.min_leaf_support = min_leaf_support
+        self.metric = metric
+        self.norm = norm
+        self.workers = workers or cpu_count()
+        self._metric_name = name
+        self._k = int(k) if k else None
+        self.trees: List[Tree] = []
+
+    @classmethod
+    def from_ranklib_args(cls, params: Dict[str, str], **kwargs) -> 'LambdaMART':
+        """
+        Builds the trainer from the options RankLib takes for LambdaMART, such as
+        `{'tree': '100', 'leaf': '10'}`.
+        """
+        converters = {
+            'tree': ('n_trees', int),
+            'leaf': ('n_leaves', int),
+            'shrinkage': ('learning_rate', float),
+            # RankLib uses every distinct value as threshold if `tc` isn't positive.
+            'tc': ('n_thresholds', lambda value: int(value) if int(value) > 0 else None),
+            'mls': ('min_leaf_support', int),
+            'metric2t': ('metric', str),
+            'norm': ('norm', str)
+        }
+        for name, value in params.items():
+            if name not in converters:
+                raise ValueError(f'Option not supported by native LambdaMART: "{name}"')
+            arg, convert = converters[name]
+            kwargs[arg] = convert(value)
+        return cls(**kwargs)
+
+    def fit(self, data: RankingData) -> 'LambdaMART':
+        X = normalize_sum(data.X, data.offsets) if self.norm == 'sum' else data.X
+        y = data.y.astype(np.float64)
+        self._thresholds = [get_thresholds(X[:, f], self.n_thresholds)
+                            for f in range(X.shape[1])]
+        self._n_bins = max((len(t) for t in self._thresholds), default=1)
+        # Every distinct value is a threshold if `n_thresholds` is `None`, so bins may
+        # not fit in 16 bits.
+        dtype = np.uint16 if self._n_bins <= np.iinfo(np.uint16).max else np.uint32
+        self._bins = np.empty((X.shape[1], len(X)), dtype=dtype)
+        for f, thresholds in enumerate(self._thresholds):
+            # Bin `b` holds values between thresholds `b - 1` and `b`, so it goes left
+            # of a split at threshold `b`.
+            self._bins[f] = np.searchsorted(thresholds, X[:, f], side='left')
+
+        batches = self._get_query_batches(data.offsets)
+        self.trees = []
+        self.scores = np.zeros(len(X))
+        with ThreadPoolExecutor(self.workers) as executor:
+            for _ in range(self.n_trees):
+                lambdas, weights = self._compute_lambdas(batches, y, executor)
+                tree, leaf_outputs = self._fit_tree(lambdas, weights, executor)
+                self.trees.append(tree)
+                self.scores += self.learning_rate * leaf_outputs
+        return self
+
+    def _get_query_batches(self, offsets: np.ndarray) -> List[_QueryBatch]:
+        """
+        Groups queries by their length rounded up to a power of 2 so lambdas of each
+        group are computed over padded arrays.
+        """
+        lengths = np.diff(offsets)
+        sizes = 1 << np.ceil(np.log2(np.maximum(lengths, 2))).astype(np.int64)
+        batches = []
+        for size in np.unique(sizes):
+            queries = np.flatnonzero((sizes == size) & (lengths >= 2))
+            step = max(1, MAX_PAIRS // (size * size))
+            for start in range(0, len(queries), step):
+                chunk = queries[start:start + step]
+                positions = np.arange(size)
+                valid = positions < lengths[chunk, None]
+                docs = np.where(valid, offsets[chunk, None] + positions, 0)
+                batches.append(_QueryBatch(docs, valid))
+        return batches
+
+    def _compute_lambdas(
+        self,
+        batches: List[_QueryBatch],
+        y: np.ndarray,
+        executor: ThreadPoolExecutor
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        lambdas = np.zeros(len(self.scores))
+        weights = np.zeros(len(self.scores))
+        gmax = float(y.max(initial=0))
+        for docs, batch_lambdas, batch_weights in executor.map(
+            lambda batch: self._batch_lambdas(batch, y, gmax), batches
+        ):
+            lambdas[docs] = batch_lambdas
+            weights[docs] = batch_weights
+        return lambdas, weights
+
+    def _batch_lambdas(
+        self,
+        batch: _QueryBatch,
+        y: np.ndarray,
+        gmax: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        scores = np.where(batch.valid, self.scores[batch.docs], -np.inf)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        docs = np.take_along_axis(batch.docs, order, axis=1)
+        valid = np.take_along_axis(batch.valid, order, axis=1)
+        scores = np.where(valid, self.scores[docs], 0)
+        labels = np.where(valid, y[docs], 0)
+
+        if self._metric_name == 'ERR':
+            delta = err_swap_changes(labels, gmax, self._k)
+        else:
+            delta = ndcg_swap_changes(labels, self._k)
+        pairs = ((labels[:, :, None] > labels[:, None, :]) &
+                 valid[:, :, None] & valid[:, None, :])
+        # Logistic function of score differences, written with `tanh` so it doesn't
+        # overflow.
+        rho = 0.5 * (1 - np.tanh((scores[:, :, None] - scores[:, None, :]) / 2))
+        lambdas = np.where(pairs, rho * delta, 0)
+        weights = np.where(pairs, rho * (1 - rho) * delta, 0)
+        return (docs[valid], (lambdas.sum(axis=2) - lambdas.sum(axis=1))[valid],
+                (weights.sum(axis=2) + weights.sum(axis=1))[valid])
+
+    def _fit_tree(
+        self,
+        response: np.ndarray,
+        weights: np.ndarray,
+        executor: ThreadPoolExecutor
+    ) -> Tuple[Tree, np.ndarray]:
+        """
+        Grows a regression tree on `response` best leaf first, by reduction of squared
+        error, until it has `n_leaves`. Leaves output the Newton step of their
+        documents.
+
+        Returns
+        -------
+          tree: Tree
+          leaf_outputs: np.ndarray
+              Output of the leaf each training document falls in.
+        """
+        feature, threshold, left, right = [0], [np.inf], [-1], [-1]
+        node_docs = {0: np.arange(len(response))}
+        hists = {0: self._histogram(node_docs[0], response, executor)}
+        heap: List[Tuple[float, int, int, int]] = []
+        self._push_split(heap, 0, hists[0])
+        n_leaves = 1
+
+        while heap and n_leaves < self.n_leaves:
+            _, node, f, b = heapq.heappop(heap)
+            docs, (sums, counts) = node_docs.pop(node), hists.pop(node)
+            goes_left = self._bins[f, docs] <= b
+            children = []
+            for child_docs in (docs[goes_left], docs[~goes_left]):
+                children.append(len(left))
+                node_docs[len(left)] = child_docs
+                feature.append(0)
+                threshold.append(np.inf)
+                left.append(-1)
+                right.append(-1)
+            feature[node], threshold[node] = f, self._thresholds[f][b]
+            left[node], right[node] = children
+
+            # Only the smaller child is histogrammed, the other one is what's left
+            # of its parent.
+            small, large = sorted(children, key=lambda child: len(node_docs[child]))
+            hists[small] = self._histogram(node_docs[small], response, executor)
+            hists[large] = (sums - hists[small][0], counts - hists[small][1])
+            for child in children:
+                self._push_split(heap, child, hists[child])
+            n_leaves += 1
+
+        output = np.zeros(len(left))
+        leaf_outputs = np.zeros(len(response))
+        for node, docs in node_docs.items():
+            weight = weights[docs].sum()
+            output[node] = response[docs].sum() / weight if weight else 0.0
+            leaf_outputs[docs] = output[node]
+        tree = Tree(np.array(feature, dtype=np.int32),
+                    np.array(threshold, dtype=np.float32),
+                    np.array(left, dtype=np.int32), np.array(right, dtype=np.int32),
+                    output)
+        return tree, leaf_outputs
+
+    def _histogram(
+        self,
+        docs: np.ndarray,
+        response: np.ndarray,
+        executor: ThreadPoolExecutor
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sum of `response` and count of documents in each bin of each feature.
+        """
+        node_response = response[docs]
+
+        def build(features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+            sums = np.zeros((len(features), self._n_bins))
+            counts = np.zeros((len(features), self._n_bins))
+            for idx, f in enumerate(features):
+                bins = self._bins[f, docs]
+                sums[idx] = np.bincount(bins, weights=node_response,
+                                        minlength=self._n_bins)
+                counts[idx] = np.bincount(bins, minlength=self._n_bins)
+            return sums, counts
+
+        chunks = np.array_split(np.arange(len(self._bins)),
+                                min(self.workers, max(len(self._bins), 1)))
+        results = list(executor.map(build, chunks))
+        return (np.concatenate([sums for sums, _ in results]),
+                np.concatenate([counts for _, counts in results]))
+
+    def _push_split(
+        self,
+        heap: List[Tuple[float, int, int, int]],
+        node: int,
+        hist: Tuple[np.ndarray, np.ndarray]
+    ) -> None:
+        sums, counts = hist
+        if not len(sums):
+            return
+        total_sum, total_count = sums[0].sum(), counts[0].sum()
+        left_sum, left_count = np.cumsum(sums, axis=1), np.cumsum(counts, axis=1)
+        right_sum, right_count = total_sum - left_sum, total_count - left_count
+        valid = ((left_count >= self.min_leaf_support) &
+                 (right_count >= self.min_leaf_support) & (left_count > 0) &
+                 (right_count > 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = left_sum ** 2 / left_count + right_sum ** 2 / right_count
+        gain = np.where(valid, gain, -np.inf)
+        f, b = np.unravel_index(np.argmax(gain), gain.shape)
+        if np.isfinite(gain[f, b]):
+            gain = gain[f, b] - total_sum ** 2 / total_count
+            heapq.heappush(heap, (-gain, node, int(f), int(b)))
+
+    def to_ranklib(self) -> str:
+        """
+        Returns the model as saved by RankLib.
+        """
+        lines = [
+            '## LambdaMART',
+            f'## No. of trees = {self.n_trees}',
+            f'## No. of leaves = {self.n_leaves}',
+            f'## No. of threshold candidates = {self.n_thresholds or -1}',
+            f'## Learning rate = {self.learning_rate}',
+            '',
+            '<ensemble>'
+        ]
+        for idx, tree in enumerate(self.trees):
+            lines.append(f'\t<tree id="{idx + 1}" weight="{self.learning_rate}">')
+            # Each item is a tuple of (node index, depth, position).
+            stack = [(0, 2, None)]
+            while stack:
+                node, depth, pos = stack.pop()
+                indent = '\t' * depth
+                if node is None:
+                    lines.append(f'{indent}</split>')
+                    continue
+                lines.append(f'{indent}<split pos="{pos}">' if pos else
+                             f'{indent}<split>')
+                if tree.left[node] == -1:
+                    output = float(tree.output[node])
+                    lines.append(f'{indent}\t<output> {output!r} </output>')
+                    lines.append(f'{indent}</split>')
+                    continue
+                lines.append(f'{indent}\t<feature> {tree.feature[node] + 1} </feature>')
+                lines.append(f'{indent}\t<threshold> {float(tree.threshold[node])!r} '
+                             '</threshold>')
+                stack.append((None, depth, None))
+                stack.append((tree.right[node], depth + 1, 'right'))
+                stack.append((tree.left[node], depth + 1, 'left'))
+            lines.append('\t</tree>')
+        lines.append('</ensemble>')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            f.write(self.to_ranklib())
+
+
+def ndcg_swap_changes(labels: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """
+    Absolute change of NDCG@k of each query for swapping the documents in each pair of
+    positions.
+
+    Args
+    ----
+      labels: np.ndarray
+          Relevance of documents sorted by score, shape (queries, documents). Padding
+          must be 0.
+
+    Returns
+    -------
+      changes: np.ndarray
+          Shape (queries, documents, documents).
+    """
+    positions = np.arange(labels.shape[1])
+    discounts = 1 / np.log2(positions + 2)
+    if k is not None:
+        discounts[k:] = 0
+    gains = 2 ** labels - 1
+    ideal = (np.sort(gains, axis=1)[:, ::-1] * discounts).sum(axis=1)
+    changes = (np.abs(gains[:, :, None] - gains[:, None, :]) *
+               np.abs(discounts[:, None] - discounts[None, :]))
+    return np.divide(changes, ideal[:, None, None], out=np.zeros_like(changes),
+                     where=ideal[:, None, None] > 0)
+
+
+def err_swap_changes(
+    labels: np.ndarray,
+    gmax: float,
+    k: Optional[int] = None
+) -> np.ndarray:
+    """
+    Absolute change of ERR@k of each query for swapping the documents in each pair of
+    positions, where the probability of a document satisfying the user is
+    `(2^label - 1) / 2^gmax`.
+
+    For positions `a < b`, swapping only changes the terms of positions `a` to `b`:
+    the ones at `a` and `b` get the other probability of relevance and the ones in
+    between get their probability of being reached multiplied by
+    `(1 - R_b) / (1 - R_a)`.
+
+    Args
+    ----
+      labels: np.ndarray
+          Relevance of documents sorted by score, shape (queries, documents). Padding
+          must be 0.
+      gmax: float
+          Maximum relevance.
+
+    Returns
+    -------
+      changes: np.ndarray
+          Shape (queries, documents, documents).
+    """
+    positions = np.arange(labels.shape[1])
+    inv_ranks = 1 / (positions + 1)
+    if k is not None:
+        inv_ranks[k:] = 0
+    R = (2 ** labels - 1) / 2 ** gmax
+    # Probability of reaching each position.
+    reach = np.cumprod(np.concatenate([np.ones((len(R), 1)), 1 - R[:, :-1]], axis=1),
+                       axis=1)
+    terms = R * reach * inv_ranks
+    # Sum of terms before each position.
+    before = np.cumsum(terms, axis=1) - terms
+
+    Ra, Rb = R[:, :, None], R[:, None, :]
+    ratio = (1 - Rb) / (1 - Ra)
+    changes = (
+        (reach * inv_ranks)[:, :, None] * (Rb - Ra) +
+        (ratio - 1) * (before[:, None, :] - before[:, :, None] - terms[:, :, None]) +
+        (reach * inv_ranks)[:, None, :] * (Ra * ratio - Rb)
+    )
+    upper = positions[:, None] < positions[None, :]
+    changes = np.where(upper, changes, np.swapaxes(changes, 1, 2))
+    return np.abs(changes)
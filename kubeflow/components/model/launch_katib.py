@@ -3,9 +3,10 @@ import argparse
 import json
 import uuid
 import pathlib
-from typing import Dict, List, Any
 
 import launch_crd
+from metrics import get_metric_names, is_minimized
+from search_space import get_ranker_parameters
 from kubernetes import client as k8s_client
 from kubernetes import config
 
@@ -16,53 +17,6 @@ from kubernetes import config
 PATH = pathlib.Path(__file__).parent
 
 
-def get_ranker_parameters(ranker: str) -> List[Dict[str, Any]]:
-    return {
-        'lambdamart': [
-            {
-                "name": "--tree",
-                "parameterType": "int",
-                "feasibleSpace": {
-                    "min": "1",
-                    "max": "500"
-                }
-            },
-            {
-                "name": "--leaf",
-                "parameterType": "int",
-                "feasibleSpace": {
-                    "min": "2",
-                    "max": "40"
-                }
-            },
-            {
-                "name": "--shrinkage",
-                "parameterType": "double",
-                "feasibleSpace": {
-                    "min": "0.01",
-                    "max": "0.2"
-                }
-            },
-            {
-                "name": "--tc",
-                "parameterType": "int",
-                "feasibleSpace": {
-                    "min": "-1",
-                    "max": "300"
-                }
-            },
-            {
-                "name": "--mls",
-                "parameterType": "int",
-                "feasibleSpace": {
-                    "min": "1",
-                    "max": "10"
-                }
-            }
-        ]
-    }.get(ranker)
-
-
 class Experiment(launch_crd.K8sCR):
     def __init__(self, client=None):
         super().__init__('kubeflow.org', 'experiments', 'v1alpha3', client)
@@ -127,6 +81,44 @@ def main(argv=None):
         type=str,
         help='RankLib algorith to use.'
     )
+    parser.add_argument(
+        '--trainer',
+        dest='trainer',
+        type=str,
+        default='ranklib',
+        help='Either "ranklib" to train with the jar or "native" for NumPy LambdaMART.'
+    )
+    parser.add_argument(
+        '--objective',
+        dest='objective',
+        type=str,
+        default='rank',
+        choices=get_metric_names(),
+        help='Validation metric Katib optimizes. All others are still collected.'
+    )
+    parser.add_argument(
+        '--validation_sample',
+        dest='validation_sample',
+        type=float,
+        default=0,
+        help=('Fraction of validation queries trials first estimate the rank with. '
+              'If 0 then trials always validate the full sets.')
+    )
+    parser.add_argument(
+        '--validation_early_stop',
+        dest='validation_early_stop',
+        type=float,
+        default=0,
+        help=('How many standard errors below the running rank must still be above '
+              'the best rank for trials to stop validation early. 0 disables it.')
+    )
+    parser.add_argument(
+        '--train_timeout',
+        dest='train_timeout',
+        type=float,
+        default=0,
+        help='Seconds RankLib may train in each trial before being killed. 0 disables it.'
+    )
 
     args = parser.parse_args()
 
@@ -149,9 +141,20 @@ def main(argv=None):
         .replace('{es_host}', args.es_host)\
         .replace('{destination}', args.destination)\
         .replace('{model_name}', args.model_name)\
-        .replace('{ranker}', args.ranker)
+        .replace('{ranker}', args.ranker)\
+        .replace('{trainer}', args.trainer)\
+        .replace('{objective}', args.objective)\
+        .replace('{validation_sample}', str(args.validation_sample))\
+        .replace('{validation_early_stop}', str(args.validation_early_stop))\
+        .replace('{train_timeout}', str(args.train_timeout))
 
     exp_def['spec']['trialTemplate']['goTemplate']['rawTemplate'] = raw_template
+    exp_def['spec']['objective'] = {
+        'type': 'minimize' if is_minimized(args.objective) else 'maximize',
+        'objectiveMetricName': f'Validation-{args.objective}',
+        'additionalMetricNames': [f'Validation-{name}' for name in get_metric_names()
+                                  if name != args.objective]
+    }
 
     config.load_incluster_config()
     api_client = k8s_client.ApiClient()
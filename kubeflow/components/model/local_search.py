@@ -0,0 +1,563 @@
+import os
+import sys
+import math
+import argparse
+from multiprocessing import Pool, cpu_count
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from elasticsearch import Elasticsearch
+
+from lambdamart import LambdaMART, RankingData
+from metrics import get_metric_names, is_minimized
+from msearch import AdaptiveBatcher
+from ranklib_model import RankLibModel
+from replay import get_replay_store, replay_metrics
+from search_space import get_ranker_parameters
+from train import read_best_rank, write_results
+from train_matrix import build_train_matrix, load_train_matrix
+from validate import RESCORE_WINDOW_SIZE
+
+
+"""
+Hyperparameter search running in a single process pool, as an alternative to Katib
+when tuning on one big node. Configurations are sampled either at random or with a
+Tree-structured Parzen Estimator over the same space `launch_katib.py` gives Katib, and
+Hyperband stops the weakest ones early: each bracket trains its configurations with a
+fraction of the training queries, keeps the best `1 / eta` of them and trains those
+again with `eta` times more queries, until the survivors are trained with all of them.
+
+Models are trained with `lambdamart.LambdaMART` on the binary matrix of the training
+file and validated by replaying the captured validation searches (see `replay.py`), so
+trials don't need their models to be posted to Elasticsearch. Models trained with all
+queries are recorded just as Katib trials do, in `results.txt`, `best_model.txt` and
+`best_rank.txt` of the destination folder. It takes the same arguments as `train.py`
+for the data and Elasticsearch, plus those of the search, such as:
+
+    python local_search.py --sampler=tpe --trials=100 --min_budget=0.11 --eta=3 ...
+"""
+
+
+# Set by `init_worker` in each process of the pool.
+_worker: Dict[str, Any] = {}
+
+
+class Trial(NamedTuple):
+    params: Dict[str, str]
+    # Fraction of the training queries the model was trained with.
+    budget: float
+    # Objective metric on validation data, negated if it's maximized.
+    loss: float
+    metrics_val: Dict[str, float]
+    # Only computed for models trained with all queries.
+    metrics_train: Dict[str, float]
+    # Definition of the model, only kept if trained with all queries.
+    model: Optional[str]
+
+
+def get_param_name(param: Dict[str, Any]) -> str:
+    return param['name'].lstrip('-')
+
+
+def from_unit(space: List[Dict[str, Any]], units: np.ndarray) -> Dict[str, str]:
+    """
+    Maps a point of the unit hypercube to values of each parameter of `space`.
+    """
+    params = {}
+    for param, unit in zip(space, units):
+        low = float(param['feasibleSpace']['min'])
+        high = float(param['feasibleSpace']['max'])
+        if param['parameterType'] == 'int':
+            # Each integer gets a bin of the same width.
+            value = min(int(low + math.floor(unit * (high - low + 1))), int(high))
+            params[get_param_name(param)] = str(value)
+        elif param['parameterType'] == 'double':
+            params[get_param_name(param)] = str(round(low + unit * (high - low), 6))
+        else:
+            raise ValueError(f'Invalid parameterType: "{param["parameterType"]}"')
+    return params
+
+
+def to_unit(space: List[Dict[str, Any]], params: Dict[str, str]) -> np.ndarray:
+    """
+    Inverse of `from_unit`.
+    """
+    units = []
+    for param in space:
+        low = float(param['feasibleSpace']['min'])
+        high = float(param['feasibleSpace']['max'])
+        value = float(params[get_param_name(param)])
+        if param['parameterType'] == 'int':
+            units.append((value - low + 0.5) / (high - low + 1))
+        else:
+            units.append((value - low) / (high - low) if high > low else 0.5)
+    return np.array(units)
+
+
+class RandomSampler:
+    """
+    Samples each parameter uniformly from its feasible space.
+    """
+    def __init__(self, space: List[Dict[str, Any]], seed: int = 0):
+        self.space = space
+        self.rng = np.random.RandomState(seed)
+
+    def sample(self, trials: Sequence[Trial]) -> Dict[str, str]:
+        return from_unit(self.space, self.rng.rand(len(self.space)))
+
+
+class TPESampler(RandomSampler):
+    """
+    Tree-structured Parzen Estimator. Trials are split in the `gamma` fraction with
+    lowest loss and the others, a Parzen density is fitted to each group and, out of
+    `n_candidates` drawn from the density of the good group, the one with highest ratio
+    between both densities is sampled. Parameters are modeled independently of each
+    other in the unit hypercube.
+
+    As in BOHB, the densities are fitted to the trials of the largest budget that has
+    at least `min_trials` of them. Until then configurations are sampled at random.
+
+    Args
+    ----
+      space: List[Dict[str, Any]]
+          Parameters as given by `search_space.get_ranker_parameters`.
+      gamma: float
+      n_candidates: int
+      min_trials: int
+      seed: int
+    """
+    def __init__(
+        self,
+        space: List[Dict[str, Any]],
+        gamma: float = 0.25,
+        n_candidates: int = 24,
+        min_trials: int = 10,
+        seed: int = 0
+    ):
+        super().__init__(space, seed)
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.min_trials = max(min_trials, 2)
+
+    def sample(self, trials: Sequence[Trial]) -> Dict[str, str]:
+        budgets = {}
+        for trial in trials:
+            if not math.isnan(trial.loss):
+                budgets.setdefault(trial.budget, []).append(trial)
+        budgets = [budget for budget, group in budgets.items()
+                   if len(group) >= self.min_trials]
+        if not budgets:
+            return super().sample(trials)
+
+        observed = [trial for trial in trials
+                    if trial.budget == max(budgets) and not math.isnan(trial.loss)]
+        units = np.array([to_unit(self.space, trial.params) for trial in observed])
+        order = np.argsort([trial.loss for trial in observed], kind='stable')
+        n_good = max(1, int(math.ceil(self.gamma * len(observed))))
+        good, bad = units[order[:n_good]], units[order[n_good:]]
+
+        candidates = self._sample_parzen(good)
+        scores = self._log_density(candidates, good) - self._log_density(candidates, bad)
+        return from_unit(self.space, candidates[np.argmax(scores)])
+
+    @staticmethod
+    def _bandwidth(points: np.ndarray) -> np.ndarray:
+        return np.clip(points.std(axis=0) * len(points) ** -0.2, 0.1, 1.0)
+
+    def _sample_parzen(self, points: np.ndarray) -> np.ndarray:
+        """
+        Draws candidates from the mixture of a Gaussian around each point and a
+        uniform prior, which keeps exploring values far from the good ones.
+        """
+        shape = (self.n_candidates, points.shape[1])
+        components = self.rng.randint(len(points) + 1, size=shape)
+        prior = components == len(points)
+        centers = points[np.minimum(components, len(points) - 1),
+                         np.arange(points.shape[1])]
+        samples = self.rng.normal(centers, self._bandwidth(points))
+        samples[prior] = self.rng.rand(int(prior.sum()))
+        return np.clip(samples, 0, 1)
+
+    def _log_density(self, x: np.ndarray, points: np.ndarray) -> np.ndarray:
+        if len(points) == 0:
+            return np.zeros(len(x))
+        sigma = self._bandwidth(points)
+        z = (x[:, None, :] - points[None, :, :]) / sigma
+        kernels = np.exp(-0.5 * z ** 2) / (sigma * math.sqrt(2 * math.pi))
+        density = (kernels.sum(axis=1) + 1) / (len(points) + 1)
+        return np.log(density).sum(axis=1)
+
+
+def get_brackets(min_budget: float, eta: int = 3) -> List[List[Tuple[int, float]]]:
+    """
+    Brackets of Hyperband, from the one stopping configurations most aggressively to
+    the one training all of them with the full budget.
+
+    Returns
+    -------
+      brackets: List[List[Tuple[int, float]]]
+          Number of configurations and budget of each rung of successive halving.
+    """
+    s_max = int(math.floor(math.log(1 / min_budget, eta) + 1e-9))
+    brackets = []
+    for s in range(s_max, -1, -1):
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        brackets.append([(n // eta ** i, float(eta) ** (i - s)) for i in range(s + 1)])
+    return brackets
+
+
+def search(
+    run: Callable[[List[Dict[str, str]], float], List[Trial]],
+    sampler: RandomSampler,
+    trials: int,
+    min_budget: float,
+    eta: int = 3
+) -> List[Trial]:
+    """
+    Cycles through the brackets of Hyperband until `trials` configurations were
+    sampled.
+
+    Args
+    ----
+      run: Callable[[List[Dict[str, str]], float], List[Trial]]
+          Trains and validates each configuration with the given budget.
+      sampler: RandomSampler
+          Either `RandomSampler` or `TPESampler`, which sees every trial run so far.
+      trials: int
+          How many configurations to sample.
+      min_budget: float
+          Fraction of the training queries of the first rung of the most aggressive
+          bracket.
+      eta: int
+          Only the best `1 / eta` configurations of each rung are promoted.
+
+    Returns
+    -------
+      history: List[Trial]
+          Every trial run, in order.
+    """
+    history: List[Trial] = []
+    sampled = 0
+    while sampled < trials:
+        previous = sampled
+        for bracket in get_brackets(min_budget, eta):
+            n = min(bracket[0][0], trials - sampled)
+            if n <= 0:
+                break
+            configs = [sampler.sample(history) for _ in range(n)]
+            sampled += n
+            for rung, (_, budget) in enumerate(bracket):
+                results = run(configs, budget)
+                history.extend(results)
+                if rung + 1 < len(bracket):
+                    results = sorted(results, key=lambda trial: trial.loss)
+                    configs = [trial.params
+                               for trial in results[:max(1, len(configs) // eta)]]
+        # No bracket for this budget, such as when `min_budget` is above 1.
+        if sampled == previous:
+            break
+    return history
+
+
+def subset_queries(data: RankingData, queries: np.ndarray) -> RankingData:
+    """
+    Copies the documents of `queries` into a new `RankingData`.
+    """
+    queries = np.sort(queries)
+    starts = data.offsets[queries]
+    counts = data.offsets[queries + 1] - starts
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    rows = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+    return RankingData(np.asarray(data.X[rows]), np.asarray(data.y[rows]), offsets)
+
+
+def init_worker(
+    train_file_path: str,
+    replay_paths: Tuple[str, str],
+    objective: str,
+    threads: Optional[int],
+    seed: int
+) -> None:
+    """
+    Memory-maps the training data in the current process. Queries are trained in the
+    order of a fixed permutation so models trained with larger budgets see the queries
+    of smaller ones.
+    """
+    data = load_train_matrix(train_file_path, 'sum')
+    _worker['data'] = data
+    _worker['order'] = np.random.RandomState(seed).permutation(len(data.offsets) - 1)
+    _worker['replay_paths'] = replay_paths
+    _worker['objective'] = objective
+    _worker['threads'] = threads
+
+
+def run_trial(params: Dict[str, str], budget: float) -> Trial:
+    """
+    Trains LambdaMART with `params` over the `budget` fraction of training queries and
+    validates it with the searches replayed in the process initialized by
+    `init_worker`.
+    """
+    data = _worker['data']
+    if budget < 1:
+        queries = max(1, int(round(budget * (len(data.offsets) - 1))))
+        data = subset_queries(data, _worker['order'][:queries])
+    # Features are already normalized in the matrix.
+    model = LambdaMART.from_ranklib_args(params, norm=None, workers=_worker['threads'])
+    definition = model.fit(data).to_ranklib()
+
+    ranklib_model = RankLibModel.from_string(definition)
+    val_path, train_path = _worker['replay_paths']
+    metrics_val = replay_metrics(val_path, ranklib_model)
+    metrics_train = replay_metrics(train_path, ranklib_model) if budget >= 1 else {}
+    objective = _worker['objective']
+    value = metrics_val[objective]
+    print(f'budget={budget:.3f} {params} {objective}={value:.4f}')
+    return Trial(params, budget, value if is_minimized(objective) else -value,
+                 metrics_val, metrics_train, definition if budget >= 1 else None)
+
+
+def save_trial(trial: Trial, destination: str, model_name: str, objective: str) -> None:
+    """
+    Records a model trained with all queries as `train.write_results` does for trials
+    of Katib.
+    """
+    with open(f'{destination}/model.txt', 'w') as f:
+        f.write(trial.model)
+    X = [f'--{name}={value}' for name, value in trial.params.items()]
+    write_results(X, trial.metrics_train[objective], trial.metrics_val[objective],
+                  destination, model_name, objective)
+
+
+def main(args: NamedTuple) -> List[Trial]:
+    """
+    Args
+    ----
+      args: NamedTuple
+        train_file_path: str
+            Path where RankLib training file is located.
+        validation_files_path: str
+            Path where regular validation files are located.
+        validation_train_files_path: str
+            Path where validation files of training period are located.
+        es_host: str
+            Hostname where Elasticsearch is located, only used to capture the
+            validation searches.
+        es_batch: int
+        es_target_latency: Optional[float]
+        destination: str
+            Folder where results, the best model and its rank are saved.
+        model_name: str
+            RankLib featureset Model Name as saved in Elasticsearch.
+        ranker: str
+            Only "lambdamart" is supported.
+        index: str
+        objective: str
+            Validation metric that is optimized, see `metrics.py`.
+        sampler: str
+            Either "random" or "tpe".
+        trials: int
+            How many configurations to sample.
+        min_budget: float
+            Smallest fraction of training queries configurations are trained with.
+        eta: int
+        workers: Optional[int]
+            Processes training configurations concurrently, defaults to the number of
+            CPUs.
+        seed: int
+
+    Returns
+    -------
+      trials: List[Trial]
+    """
+    space = get_ranker_parameters(args.ranker)
+    if args.ranker != 'lambdamart' or not space:
+        raise ValueError(f'Local search only supports lambdamart, not "{args.ranker}"')
+    if args.objective not in get_metric_names():
+        raise ValueError(f'Invalid value for objective: "{args.objective}"')
+    if args.sampler not in ('random', 'tpe'):
+        raise ValueError(f'Invalid value for sampler: "{args.sampler}"')
+    if not 0 < args.min_budget <= 1:
+        raise ValueError(f'min_budget must be in (0, 1], not {args.min_budget}')
+    if args.eta < 2:
+        raise ValueError(f'eta must be at least 2, not {args.eta}')
+
+    os.makedirs(args.destination, exist_ok=True)
+    for file_ in ['best_rank.txt', 'best_model.txt']:
+        if os.path.isfile(f'{args.destination}/{file_}'):
+            os.remove(f'{args.destination}/{file_}')
+
+    es_client = Elasticsearch(hosts=[args.es_host])
+    replay_paths = tuple(
+        get_replay_store(files_path, es_client, args.model_name, args.index,
+                         args.es_batch, RESCORE_WINDOW_SIZE,
+                         AdaptiveBatcher(args.es_batch,
+                                         target_latency=args.es_target_latency))
+        for files_path in [args.validation_files_path, args.validation_train_files_path]
+    )
+    # Built once here instead of concurrently by each process.
+    build_train_matrix(args.train_file_path)
+
+    if args.sampler == 'tpe':
+        sampler = TPESampler(space, seed=args.seed)
+    else:
+        sampler = RandomSampler(space, args.seed)
+    workers = args.workers or cpu_count()
+    # Each process gets its share of the CPUs to build histograms of trees.
+    initargs = (args.train_file_path, replay_paths, args.objective,
+                max(1, cpu_count() // workers), args.seed)
+    pool = Pool(workers, initializer=init_worker, initargs=initargs) if workers > 1 \
+        else None
+    if pool is None:
+        init_worker(*initargs)
+
+    def run(param_sets: List[Dict[str, str]], budget: float) -> List[Trial]:
+        tasks = [(params, budget) for params in param_sets]
+        if pool is None:
+            trials = [run_trial(*task) for task in tasks]
+        else:
+            trials = pool.starmap(run_trial, tasks)
+        for trial in trials:
+            if trial.model is not None:
+                save_trial(trial, args.destination, args.model_name, args.objective)
+        return trials
+
+    try:
+        trials = search(run, sampler, args.trials, args.min_budget, args.eta)
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    best_rank = read_best_rank(args.destination)
+    if best_rank is None:
+        print(f'{len(trials)} trials, none of them trained with all queries so no '
+              'best model was saved')
+    else:
+        print(f'{len(trials)} trials, best {args.objective}={best_rank}')
+    return trials
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--train_file_path',
+        dest='train_file_path',
+        type=str,
+        help='Path where RankLib training file is located.'
+    )
+    parser.add_argument(
+        '--validation_files_path',
+        dest='validation_files_path',
+        type=str,
+        help='Path where regular validation files are located.'
+    )
+    parser.add_argument(
+        '--validation_train_files_path',
+        dest='validation_train_files_path',
+        type=str,
+        help='Path where validation files of training period are located.'
+    )
+    parser.add_argument(
+        '--es_host',
+        dest='es_host',
+        type=str,
+        help='Host address to reach Elasticsearch.'
+    )
+    parser.add_argument(
+        '--es_batch',
+        dest='es_batch',
+        type=int,
+        default=1000,
+        help=('Determines how many items to send at once to Elasticsearch when '
+              'capturing validation searches.')
+    )
+    parser.add_argument(
+        '--es_target_latency',
+        dest='es_target_latency',
+        type=float,
+        default=None,
+        help=('If set then `es_batch` is only the initial batch size, which is adapted '
+              'so each multisearch request takes around this many seconds.')
+    )
+    parser.add_argument(
+        '--destination',
+        dest='destination',
+        type=str,
+        help='Path where results, the best model and its rank are saved.'
+    )
+    parser.add_argument(
+        '--model_name',
+        dest='model_name',
+        type=str,
+        help='Name of featureset store as saved in Elasticsearch.'
+    )
+    parser.add_argument(
+        '--ranker',
+        dest='ranker',
+        type=str,
+        default='lambdamart',
+        help='Name of ranker algorithm, only lambdamart is supported.'
+    )
+    parser.add_argument(
+        '--index',
+        dest='index',
+        default='pysearchml',
+        type=str,
+        help='ES Index name to use.'
+    )
+    parser.add_argument(
+        '--objective',
+        dest='objective',
+        type=str,
+        default='rank',
+        choices=get_metric_names(),
+        help='Validation metric that is optimized.'
+    )
+    parser.add_argument(
+        '--sampler',
+        dest='sampler',
+        type=str,
+        default='tpe',
+        choices=['random', 'tpe'],
+        help='How configurations are sampled.'
+    )
+    parser.add_argument(
+        '--trials',
+        dest='trials',
+        type=int,
+        default=50,
+        help='How many configurations to sample.'
+    )
+    parser.add_argument(
+        '--min_budget',
+        dest='min_budget',
+        type=float,
+        default=1 / 9,
+        help='Smallest fraction of training queries configurations are trained with.'
+    )
+    parser.add_argument(
+        '--eta',
+        dest='eta',
+        type=int,
+        default=3,
+        help='Only the best 1 / eta configurations of each rung are trained further.'
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=None,
+        help='Processes training configurations concurrently, defaults to the CPUs.'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    main(args)
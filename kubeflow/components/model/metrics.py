@@ -0,0 +1,124 @@
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+
+"""
+Ranking metrics of validation searches, all computed in one vectorized pass over the
+documents retrieved by a multisearch batch. Purchased documents are the relevant ones,
+with binary relevance:
+
+    rank: expected percentile rank of purchased documents, as defined in
+        `validate.validate_model`. Lower is better.
+    ndcg_{k}: Normalized Discounted Cumulative Gain of the top k documents.
+    mrr: Mean Reciprocal Rank of the first purchased document.
+    err_{k}: Expected Reciprocal Rank of the top k documents, where the probability
+        of a purchased document satisfying the customer is 0.5.
+    precision_{k}: ratio of the top k documents that were purchased.
+
+Except for `rank`, metrics are averaged over searches with at least one purchase.
+"""
+
+
+class BatchMetrics(NamedTuple):
+    # Percentile rank of each purchased document retrieved, for each search.
+    ranks: List[Optional[np.ndarray]]
+    rank_num: float
+    rank_den: int
+    # Sum over searches with purchases of each metric but `rank`.
+    sums: Dict[str, float]
+    queries: int
+
+
+def get_metric_names(k: int = 10) -> List[str]:
+    return ['rank', f'ndcg_{k}', 'mrr', f'err_{k}', f'precision_{k}']
+
+
+def is_minimized(metric: str) -> bool:
+    return metric == 'rank'
+
+
+def compute_metrics(
+    docs: np.ndarray,
+    counts: np.ndarray,
+    purchased: np.ndarray,
+    purchased_counts: np.ndarray,
+    k: int = 10
+) -> BatchMetrics:
+    """
+    Args
+    ----
+      docs: np.ndarray
+          Interned ids of documents retrieved by all searches, concatenated in rank
+          order.
+      counts: np.ndarray
+          How many documents each search retrieved.
+      purchased: np.ndarray
+          Interned ids of documents purchased in all searches, concatenated.
+      purchased_counts: np.ndarray
+          How many documents were purchased in each search.
+      k: int
+          Cutoff of NDCG, ERR and precision.
+
+    Returns
+    -------
+      metrics: BatchMetrics
+    """
+    docs = np.asarray(docs, dtype=np.int64)
+    purchased = np.asarray(purchased, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    n_queries = len(counts)
+    queries = np.repeat(np.arange(n_queries), counts)
+    starts = np.cumsum(counts) - counts
+    positions = np.arange(len(queries)) - starts[queries]
+
+    # Each document is matched only against purchases of the same search.
+    total = max(docs.max(initial=-1), purchased.max(initial=-1)) + 1
+    purchased_keys = np.unique(
+        np.repeat(np.arange(len(purchased_counts)), purchased_counts) * total +
+        purchased
+    )
+    relevant = np.bincount(purchased_keys // total, minlength=n_queries)[:n_queries]
+    found = np.isin(queries * total + docs, purchased_keys)
+
+    # Searches with less than 2 documents have no percentile rank.
+    ranked = found & (counts[queries] >= 2)
+    ranked_queries = queries[ranked]
+    ranks = positions[ranked] / (counts[ranked_queries] - 1)
+    splits = np.cumsum(np.bincount(ranked_queries, minlength=n_queries))[:-1]
+    query_ranks = [query_ranks if count >= 2 else None
+                   for query_ranks, count in zip(np.split(ranks, splits), counts)]
+
+    found_queries, found_positions = queries[found], positions[found]
+    top = found_positions < k
+    top_queries, top_positions = found_queries[top], found_positions[top]
+
+    first = np.full(n_queries, np.inf)
+    np.minimum.at(first, found_queries, found_positions)
+    mrr = np.where(np.isfinite(first), 1 / (first + 1), 0)
+
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    dcg = np.bincount(top_queries, weights=discounts[top_positions],
+                      minlength=n_queries)
+    ideal_dcg = np.concatenate([[0], np.cumsum(discounts)])[np.minimum(relevant, k)]
+    ndcg = np.divide(dcg, ideal_dcg, out=np.zeros(n_queries), where=ideal_dcg > 0)
+
+    # How many purchased documents come before each one in its search.
+    found_counts = np.bincount(found_queries, minlength=n_queries)
+    previous = (np.arange(len(found_queries)) -
+                (np.cumsum(found_counts) - found_counts)[found_queries])
+    err = np.bincount(top_queries,
+                      weights=0.5 ** (previous[top] + 1) / (top_positions + 1),
+                      minlength=n_queries)
+
+    precision = np.bincount(top_queries, minlength=n_queries) / k
+
+    judged = relevant > 0
+    sums = {
+        f'ndcg_{k}': float(ndcg[judged].sum()),
+        'mrr': float(mrr[judged].sum()),
+        f'err_{k}': float(err[judged].sum()),
+        f'precision_{k}': float(precision[judged].sum())
+    }
+    return BatchMetrics(query_ranks, float(ranks.sum()), int(ranked.sum()), sums,
+                        int(judged.sum()))
@@ -0,0 +1,236 @@
+import os
+import sys
+import glob
+import hashlib
+import argparse
+from array import array
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+
+from sampling import get_query_key
+
+
+"""
+Per-query results of validation runs, exported so models can be compared offline
+without querying Elasticsearch again.
+
+Each validation file gets its own compressed `.npz` file whose columns are:
+
+    key_hash: uint64 hash of the search keys of each search.
+    query: search term of each search.
+    doc_counts: int32 how many documents each search retrieved.
+    docs: int32 index in `doc_ids` of each retrieved document, concatenated in rank
+        order.
+    doc_ids: id of each document retrieved in the file.
+    position_counts: int32 how many purchased documents each search retrieved.
+    positions: int32 0-based position of each purchased document retrieved,
+        concatenated.
+    rank: float32 percentile rank of each search, NaN if it has none.
+
+Two exports are compared with:
+
+    python query_results.py --base=/path/model_a --candidate=/path/model_b --top=20
+"""
+
+
+class QueryResults(NamedTuple):
+    key_hash: np.ndarray
+    query: np.ndarray
+    doc_counts: np.ndarray
+    docs: np.ndarray
+    doc_ids: np.ndarray
+    position_counts: np.ndarray
+    positions: np.ndarray
+    rank: np.ndarray
+
+
+def get_key_hash(search_keys: Dict[str, Any]) -> int:
+    return int(hashlib.md5(get_query_key(search_keys).encode()).hexdigest()[:16], 16)
+
+
+class QueryResultsWriter:
+    """
+    Accumulates the results of each multisearch batch in compact arrays, saved once
+    the validation file is done.
+    """
+    def __init__(self):
+        self._doc_ids: Dict[str, int] = {}
+        self._key_hashes = array('Q')
+        self._queries: List[str] = []
+        self._doc_counts = array('i')
+        self._docs = array('i')
+        self._position_counts = array('i')
+        self._positions = array('i')
+        self._ranks = array('f')
+
+    def write(
+        self,
+        search_keys_arr: List[Dict[str, Any]],
+        responses: List[Dict[str, Any]],
+        purchase_arr: List[List[Dict[str, List[str]]]]
+    ) -> None:
+        doc_ids = self._doc_ids
+        for search_keys, response, purchases in zip(search_keys_arr, responses,
+                                                    purchase_arr):
+            hits = response.get('hits', {}).get('hits') or []
+            docs = [hit['_id'] for hit in hits]
+            purchased = {doc for purchase in purchases for doc in purchase['purchased']}
+            positions = [idx for idx, doc in enumerate(docs) if doc in purchased]
+
+            self._key_hashes.append(get_key_hash(search_keys))
+            self._queries.append(str(search_keys.get('search_term', '')))
+            self._doc_counts.append(len(docs))
+            self._docs.extend(doc_ids.setdefault(doc, len(doc_ids)) for doc in docs)
+            self._position_counts.append(len(positions))
+            self._positions.extend(positions)
+            # Same as `RankEvaluator`, searches with less than 2 documents have no rank.
+            if len(docs) >= 2 and positions:
+                self._ranks.append(sum(positions) / (len(docs) - 1) / len(positions))
+            else:
+                self._ranks.append(float('nan'))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(
+            path,
+            key_hash=np.frombuffer(self._key_hashes, dtype=np.uint64),
+            query=np.array(self._queries, dtype=str),
+            doc_counts=np.frombuffer(self._doc_counts, dtype=np.int32),
+            docs=np.frombuffer(self._docs, dtype=np.int32),
+            doc_ids=np.array(list(self._doc_ids), dtype=str),
+            position_counts=np.frombuffer(self._position_counts, dtype=np.int32),
+            positions=np.frombuffer(self._positions, dtype=np.int32),
+            rank=np.frombuffer(self._ranks, dtype=np.float32)
+        )
+
+
+def load_query_results(path: str) -> QueryResults:
+    """
+    Loads and concatenates every `.npz` file in the folder `path`, or just `path` if
+    it's a file.
+    """
+    files = sorted(glob.glob(os.path.join(path, '*.npz'))) if os.path.isdir(path) \
+        else [path]
+    columns = {field: [] for field in QueryResults._fields}
+    doc_offset = 0
+    for file_ in files:
+        with np.load(file_) as data:
+            for field in QueryResults._fields:
+                columns[field].append(data[field])
+            columns['docs'][-1] = columns['docs'][-1] + doc_offset
+            doc_offset += len(data['doc_ids'])
+    return QueryResults(**{
+        field: np.concatenate(values) if values else np.array([])
+        for field, values in columns.items()
+    })
+
+
+class QueryRanks(NamedTuple):
+    key_hash: np.ndarray
+    query: np.ndarray
+    searches: np.ndarray
+    rank_num: np.ndarray
+    rank_den: np.ndarray
+
+    @property
+    def rank(self) -> np.ndarray:
+        return np.divide(self.rank_num, self.rank_den,
+                         out=np.full(len(self.rank_den), np.nan),
+                         where=self.rank_den > 0)
+
+
+def aggregate_queries(results: QueryResults) -> QueryRanks:
+    """
+    Merges searches with the same search keys into the terms of the rank equation of
+    each distinct query.
+    """
+    rank_den = np.where(results.doc_counts >= 2, results.position_counts, 0)
+    rank_num = np.nan_to_num(results.rank.astype(np.float64)) * rank_den
+    key_hash, first, inverse = np.unique(results.key_hash, return_index=True,
+                                         return_inverse=True)
+    return QueryRanks(
+        key_hash,
+        results.query[first],
+        np.bincount(inverse, minlength=len(key_hash)),
+        np.bincount(inverse, weights=rank_num, minlength=len(key_hash)),
+        np.bincount(inverse, weights=rank_den, minlength=len(key_hash))
+    )
+
+
+class QueryDiff(NamedTuple):
+    query: np.ndarray
+    searches: np.ndarray
+    base_rank: np.ndarray
+    candidate_rank: np.ndarray
+    only_base: int
+    only_candidate: int
+
+    @property
+    def delta(self) -> np.ndarray:
+        return self.candidate_rank - self.base_rank
+
+
+def diff_query_results(base: QueryResults, candidate: QueryResults) -> QueryDiff:
+    """
+    Joins the ranks of queries found in both exports, sorted from the query that
+    regressed the most to the one that improved the most. Queries without a rank in
+    either export are left out.
+    """
+    base, candidate = aggregate_queries(base), aggregate_queries(candidate)
+    _, base_idx, candidate_idx = np.intersect1d(base.key_hash, candidate.key_hash,
+                                                assume_unique=True, return_indices=True)
+    base_rank = base.rank[base_idx]
+    candidate_rank = candidate.rank[candidate_idx]
+    ranked = ~np.isnan(base_rank) & ~np.isnan(candidate_rank)
+    base_idx, candidate_idx = base_idx[ranked], candidate_idx[ranked]
+    base_rank, candidate_rank = base_rank[ranked], candidate_rank[ranked]
+    order = np.argsort(base_rank - candidate_rank, kind='stable')
+    return QueryDiff(
+        base.query[base_idx][order],
+        base.searches[base_idx][order],
+        base_rank[order],
+        candidate_rank[order],
+        len(base.key_hash) - len(base_idx),
+        len(candidate.key_hash) - len(candidate_idx)
+    )
+
+
+def print_diff(diff: QueryDiff, top: int = 20) -> None:
+    delta = diff.delta
+    print(f'{len(delta)} queries compared: {int(np.sum(delta > 0))} regressed, '
+          f'{int(np.sum(delta < 0))} improved, {int(np.sum(delta == 0))} unchanged. '
+          f'{diff.only_base} only in base, {diff.only_candidate} only in candidate.')
+    regressed = np.flatnonzero(delta > 0)[:top]
+    improved = np.flatnonzero(delta < 0)[::-1][:top]
+    for title, idx in [('regressed', regressed), ('improved', improved)]:
+        print(f'\nmost {title}:\nbase\tcandidate\tsearches\tquery')
+        for i in idx:
+            print(f'{diff.base_rank[i]:.4f}\t{diff.candidate_rank[i]:.4f}\t'
+                  f'{diff.searches[i]}\t{diff.query[i]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--base',
+        dest='base',
+        type=str,
+        help='Folder or file of the per-query results of the reference model.'
+    )
+    parser.add_argument(
+        '--candidate',
+        dest='candidate',
+        type=str,
+        help='Folder or file of the per-query results of the model to compare.'
+    )
+    parser.add_argument(
+        '--top',
+        dest='top',
+        type=int,
+        default=20,
+        help='How many of the most regressed and improved queries to print.'
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    print_diff(diff_query_results(load_query_results(args.base),
+                                  load_query_results(args.candidate)), args.top)
@@ -0,0 +1,134 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from metrics import compute_metrics, get_metric_names
+
+
+"""
+Computes the metrics of validation searches for a whole multisearch response at
+once. Documents ids are interned into integers so comparing what Elasticsearch
+retrieved with what customers purchased is done with NumPy instead of per hit.
+"""
+
+
+class RankEvaluator:
+    """
+    Accumulates the rank metric as defined in `validate.validate_model`:
+
+        rank = \\frac{\\sum_{u,i}r^t_{ui}rank_{ui}}{\\sum_{u,i}r^t_{ui}}
+
+    where `rank_{ui}` is the percentile position of a purchased document in the list
+    retrieved by Elasticsearch, along with the other metrics defined in `metrics`.
+
+    Args
+    ----
+      k: int
+          Cutoff of the metrics computed over the top documents.
+    """
+    def __init__(self, k: int = 10):
+        self.k = k
+        self.rank_num = 0.0
+        self.rank_den = 0
+        self.metric_sums = {name: 0.0 for name in get_metric_names(k)[1:]}
+        self.queries = 0
+        self._doc_ids: Dict[str, int] = {}
+
+    @property
+    def rank(self) -> float:
+        """
+        Returns the rank of every search evaluated so far. It's 50% if no document was
+        retrieved from Elasticsearch and purchased by customers.
+        """
+        return self.rank_num / self.rank_den if self.rank_den else 0.5
+
+    @property
+    def metrics(self) -> Dict[str, float]:
+        """
+        Returns every metric of the searches evaluated so far.
+        """
+        metrics = {'rank': self.rank}
+        for name, value in self.metric_sums.items():
+            metrics[name] = value / self.queries if self.queries else 0.0
+        return metrics
+
+    def evaluate(
+        self,
+        responses: List[Dict[str, Any]],
+        purchase_arr: List[List[Dict[str, List[str]]]]
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Compares what Elasticsearch retrieved with what customers purchased for a batch
+        of searches and adds results to the aggregated metrics.
+
+        Args
+        ----
+          responses: List[Dict[str, Any]]
+              `responses` of a multisearch request, one for each search.
+          purchase_arr: List[List[Dict[str, List[str]]]]
+              Documents purchased by customers for each search.
+
+        Returns
+        -------
+          ranks: List[Optional[np.ndarray]]
+              Percentile rank of each purchased document that was retrieved, for each
+              search. It's `None` for searches that retrieved less than 2 documents as
+              their ranks can't be computed.
+        """
+        doc_ids = self._doc_ids
+        retrieved, counts = [], []
+        for response in responses:
+            hits = response.get('hits', {}).get('hits') or []
+            retrieved.extend(doc_ids.setdefault(hit['_id'], len(doc_ids))
+                             for hit in hits)
+            counts.append(len(hits))
+
+        purchased, purchased_counts = [], []
+        for purchases in purchase_arr:
+            count = 0
+            for purchase in purchases:
+                purchased.extend(doc_ids.setdefault(doc, len(doc_ids))
+                                 for doc in purchase['purchased'])
+                count += len(purchase['purchased'])
+            purchased_counts.append(count)
+
+        return self.evaluate_codes(
+            np.array(retrieved, dtype=np.int64),
+            np.array(counts, dtype=np.int64),
+            np.array(purchased, dtype=np.int64),
+            np.array(purchased_counts, dtype=np.int64)
+        )
+
+    def evaluate_codes(
+        self,
+        docs: np.ndarray,
+        counts: np.ndarray,
+        purchased: np.ndarray,
+        purchased_counts: np.ndarray
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Same as `evaluate` but for documents already interned as integers.
+
+        Args
+        ----
+          docs: np.ndarray
+              Retrieved documents of all searches, concatenated in rank order.
+          counts: np.ndarray
+              How many documents each search retrieved.
+          purchased: np.ndarray
+              Purchased documents of all searches, concatenated.
+          purchased_counts: np.ndarray
+              How many documents were purchased for each search.
+
+        Returns
+        -------
+          ranks: List[Optional[np.ndarray]]
+              Same as in `evaluate`.
+        """
+        metrics = compute_metrics(docs, counts, purchased, purchased_counts, self.k)
+        self.rank_num += metrics.rank_num
+        self.rank_den += metrics.rank_den
+        for name, value in metrics.sums.items():
+            self.metric_sums[name] += value
+        self.queries += metrics.queries
+        return metrics.ranks
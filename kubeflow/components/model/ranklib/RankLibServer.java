@@ -0,0 +1,119 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.util.List;
+
+import ciir.umass.edu.features.FeatureManager;
+import ciir.umass.edu.features.SumNormalizor;
+import ciir.umass.edu.learning.RANKER_TYPE;
+import ciir.umass.edu.learning.RankList;
+import ciir.umass.edu.learning.Ranker;
+import ciir.umass.edu.learning.RankerTrainer;
+import ciir.umass.edu.learning.tree.LambdaMART;
+import ciir.umass.edu.metric.MetricScorer;
+import ciir.umass.edu.metric.MetricScorerFactory;
+import ciir.umass.edu.utilities.MyThreadPool;
+
+
+/**
+ * Keeps the RankLib training file loaded in a single JVM and trains one model for each
+ * request read from stdin, so that sweeps of hyperparameters pay for starting the JVM
+ * and parsing the data just once. Used by `ranklib_server.py`, build it with:
+ *
+ *     javac -cp ranklib/RankLib-2.14.jar ranklib/RankLibServer.java
+ *
+ * and run it with:
+ *
+ *     java -cp ranklib/RankLib-2.14.jar:ranklib RankLibServer train.txt ERR sum
+ *
+ * Each request is a line such as:
+ *
+ *     train 6 /data/model.txt tree=100 leaf=10 shrinkage=0.1
+ *
+ * answered by either `ok {seconds} {train_score}` once the model is saved or
+ * `error {message}`. The line `quit` stops the server. Only the answers go to stdout,
+ * everything RankLib prints while training is sent to stderr.
+ */
+public class RankLibServer {
+    public static void main(String[] args) throws Exception {
+        PrintStream out = System.out;
+        System.setOut(System.err);
+
+        long start = System.nanoTime();
+        MyThreadPool.init(Runtime.getRuntime().availableProcessors());
+        List<RankList> samples = FeatureManager.readInput(args[0]);
+        if (args.length > 2 && args[2].equals("sum")) {
+            new SumNormalizor().normalize(samples);
+        }
+        int[] features = FeatureManager.getFeatureFromSampleVector(samples);
+        MetricScorer scorer = new MetricScorerFactory().createScorer(args[1]);
+        out.println("ready " + samples.size() + " " + seconds(start));
+        out.flush();
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in));
+        String line;
+        while ((line = in.readLine()) != null && !line.trim().equals("quit")) {
+            try {
+                out.println(train(line.trim().split("\\s+"), samples, features, scorer));
+            } catch (Exception e) {
+                out.println("error " + String.valueOf(e.getMessage()).replace('\n', ' '));
+            }
+            out.flush();
+        }
+        System.exit(0);
+    }
+
+    private static String train(String[] request, List<RankList> samples, int[] features,
+                                MetricScorer scorer) throws Exception {
+        if (request.length < 3 || !request[0].equals("train")) {
+            throw new IllegalArgumentException("Invalid request: " + String.join(" ", request));
+        }
+        RANKER_TYPE type;
+        if (request[1].equals("0")) {
+            type = RANKER_TYPE.MART;
+        } else if (request[1].equals("6")) {
+            type = RANKER_TYPE.LAMBDAMART;
+        } else {
+            throw new IllegalArgumentException("Unsupported ranker: " + request[1]);
+        }
+        setParameters(request);
+
+        long start = System.nanoTime();
+        Ranker ranker = new RankerTrainer().train(type, samples, features, scorer);
+        ranker.save(request[2]);
+        return "ok " + seconds(start) + " " + ranker.getScoreOnTrainingData();
+    }
+
+    /**
+     * RankLib keeps the options of LambdaMART in static fields, so they're all reset to
+     * their defaults before the ones of each request are applied.
+     */
+    private static void setParameters(String[] request) {
+        LambdaMART.nTrees = 1000;
+        LambdaMART.nTreeLeaves = 10;
+        LambdaMART.learningRate = 0.1F;
+        LambdaMART.nThreshold = 256;
+        LambdaMART.minLeafSupport = 1;
+        LambdaMART.nRoundToStopEarly = 100;
+        for (int i = 3; i < request.length; i++) {
+            String[] param = request[i].split("=", 2);
+            if (param.length != 2) {
+                throw new IllegalArgumentException("Invalid parameter: " + request[i]);
+            }
+            String value = param[1];
+            switch (param[0]) {
+                case "tree": LambdaMART.nTrees = Integer.parseInt(value); break;
+                case "leaf": LambdaMART.nTreeLeaves = Integer.parseInt(value); break;
+                case "shrinkage": LambdaMART.learningRate = Float.parseFloat(value); break;
+                case "tc": LambdaMART.nThreshold = Integer.parseInt(value); break;
+                case "mls": LambdaMART.minLeafSupport = Integer.parseInt(value); break;
+                case "estop": LambdaMART.nRoundToStopEarly = Integer.parseInt(value); break;
+                default: throw new IllegalArgumentException("Unknown parameter: " + param[0]);
+            }
+        }
+    }
+
+    private static double seconds(long start) {
+        return (System.nanoTime() - start) / 1e9;
+    }
+}
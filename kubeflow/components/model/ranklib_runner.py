@@ -0,0 +1,204 @@
+import re
+import time
+import threading
+import subprocess
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+
+"""
+Runs the RankLib jar as a managed subprocess. The JVM gets explicit heap and processor
+limits, its output is streamed and parsed into progress of the training iterations,
+and it's killed if it goes over its wall-clock budget. Failures are raised instead of
+being ignored.
+"""
+
+
+RANKLIB_JAR = 'ranklib/RankLib-2.14.jar'
+
+# Rows of the iterations table RankLib prints while training, such as:
+#     12      | 0.6537    | 0.6211    |
+ITERATION = re.compile(r'^\s*(\d+)\s*\|\s*(-?[\d.]+(?:E-?\d+)?)\s*\|'
+                       r'(?:\s*(-?[\d.]+(?:E-?\d+)?)\s*\|)?')
+# Summary printed once training is over, such as:
+#     ERR@10 on training data: 0.7002
+TRAINING_SCORE = re.compile(r'^\s*(\S+) on training data:\s*(-?[\d.]+)')
+
+
+class RankLibProgress(NamedTuple):
+    iteration: int
+    train_score: float
+    validation_score: Optional[float]
+    seconds: float
+
+
+class RankLibResult(NamedTuple):
+    # Score of the final model on training data, if RankLib printed it.
+    train_score: Optional[float]
+    iterations: int
+    seconds: float
+
+
+class RankLibError(Exception):
+    """
+    Raised when RankLib exits with an error.
+
+    Args
+    ----
+      returncode: Optional[int]
+          `None` if RankLib is still running, as when a server fails a request.
+      output: str
+          Last lines RankLib printed.
+    """
+    def __init__(self, message: str, returncode: Optional[int], output: str):
+        super().__init__(f'{message}\n{output}')
+        self.returncode = returncode
+        self.output = output
+
+
+class RankLibTimeout(RankLibError):
+    """
+    Raised when RankLib is killed for going over its wall-clock budget.
+    """
+
+
+def get_jvm_options(heap: Optional[str] = None,
+                    processors: Optional[int] = None) -> List[str]:
+    """
+    Args
+    ----
+      heap: Optional[str]
+          Maximum heap size of the JVM, such as "4g".
+      processors: Optional[int]
+          How many processors the JVM sees, which bounds the threads RankLib uses.
+
+    Returns
+    -------
+      options: List[str]
+    """
+    options = []
+    if heap:
+        options.append(f'-Xmx{heap}')
+    if processors:
+        options.append(f'-XX:ActiveProcessorCount={processors}')
+    # Otherwise the JVM may keep running for long after it's out of memory.
+    options.append('-XX:+ExitOnOutOfMemoryError')
+    return options
+
+
+def build_command(
+    ranker: str,
+    train_file_path: str,
+    model_path: str,
+    params: Dict[str, str],
+    heap: Optional[str] = None,
+    processors: Optional[int] = None,
+    metric: str = 'ERR',
+    norm: Optional[str] = 'sum'
+) -> List[str]:
+    """
+    Args
+    ----
+      ranker: str
+          Index of the ranker in RankLib, see `train.get_ranker_index`.
+      train_file_path: str
+      model_path: str
+          Where RankLib saves the trained model.
+      params: Dict[str, str]
+          Options of the ranker, such as `{'tree': '100'}`.
+      heap: Optional[str]
+      processors: Optional[int]
+          See `get_jvm_options`.
+      metric: str
+          Metric optimized while training.
+      norm: Optional[str]
+          Normalization of features.
+
+    Returns
+    -------
+      cmd: List[str]
+    """
+    cmd = ['java', *get_jvm_options(heap, processors)]
+    cmd.extend(['-jar', RANKLIB_JAR, '-ranker', ranker, '-train', train_file_path])
+    if norm:
+        cmd.extend(['-norm', norm])
+    cmd.extend(['-save', model_path])
+    for name, value in params.items():
+        cmd.extend([f'-{name}', value])
+    cmd.extend(['-metric2t', metric])
+    return cmd
+
+
+def run_ranklib(
+    cmd: List[str],
+    timeout: Optional[float] = None,
+    on_progress: Optional[Callable[[RankLibProgress], None]] = None,
+    tail: int = 50
+) -> RankLibResult:
+    """
+    Runs `cmd` until it exits, parsing its output while it runs.
+
+    Args
+    ----
+      cmd: List[str]
+          Command as built by `build_command`.
+      timeout: Optional[float]
+          Seconds RankLib may run before being killed.
+      on_progress: Optional[Callable[[RankLibProgress], None]]
+          Called for each training iteration RankLib reports.
+      tail: int
+          How many of the last lines of output are kept to report failures.
+
+    Returns
+    -------
+      result: RankLibResult
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True, bufsize=1)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    lines = deque(maxlen=tail)
+    iterations, train_score = 0, None
+    try:
+        for line in process.stdout:
+            lines.append(line.rstrip('\n'))
+            match = ITERATION.match(line)
+            if match:
+                iterations = int(match.group(1))
+                if on_progress:
+                    on_progress(RankLibProgress(
+                        iterations,
+                        float(match.group(2)),
+                        float(match.group(3)) if match.group(3) else None,
+                        time.perf_counter() - start
+                    ))
+                continue
+            match = TRAINING_SCORE.match(line)
+            if match:
+                train_score = float(match.group(2))
+        returncode = process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+    seconds = time.perf_counter() - start
+    output = '\n'.join(lines)
+    if timed_out.is_set():
+        raise RankLibTimeout(f'RankLib killed after {seconds:.0f}s', returncode, output)
+    if returncode:
+        raise RankLibError(f'RankLib failed with exit status {returncode}', returncode,
+                           output)
+    return RankLibResult(train_score, iterations, seconds)
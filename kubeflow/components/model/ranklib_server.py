@@ -0,0 +1,196 @@
+import subprocess
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from ranklib_runner import RANKLIB_JAR, RankLibError, get_jvm_options
+
+
+"""
+Client of `ranklib/RankLibServer.java`, a JVM that keeps the training file loaded and
+trains one model per request. Sweeping many small configurations this way avoids
+starting a JVM and parsing the training data again for each one, which can take longer
+than training itself.
+
+RankLib keeps the options of LambdaMART in static fields so each JVM trains one model at
+a time; `RankLibPool` runs several of them to train configurations in parallel.
+"""
+
+
+SERVER_CLASSPATH = f'{RANKLIB_JAR}:ranklib'
+
+
+class ServerResult(NamedTuple):
+    # Model definition as saved by RankLib.
+    model: str
+    train_score: float
+    seconds: float
+
+
+def build_server_command(
+    train_file_path: str,
+    heap: Optional[str] = None,
+    processors: Optional[int] = None,
+    metric: str = 'ERR',
+    norm: Optional[str] = 'sum'
+) -> List[str]:
+    """
+    Args
+    ----
+      train_file_path: str
+          Path of the RankLib training file loaded by the server.
+      heap: Optional[str]
+      processors: Optional[int]
+          See `ranklib_runner.get_jvm_options`.
+      metric: str
+          Metric optimized while training.
+      norm: Optional[str]
+          Either "sum" or `None` to keep features as they are.
+
+    Returns
+    -------
+      cmd: List[str]
+    """
+    return ['java', *get_jvm_options(heap, processors), '-cp', SERVER_CLASSPATH,
+            'RankLibServer', train_file_path, metric, norm or 'none']
+
+
+class RankLibServer:
+    """
+    Starts the server and waits until it's done loading the training data.
+
+    Args
+    ----
+      cmd: List[str]
+          Command as built by `build_server_command`.
+    """
+    def __init__(self, cmd: List[str]):
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+        try:
+            _, queries, seconds = self._read().split()
+        except Exception:
+            self.close()
+            raise
+        self.queries = int(queries)
+        self.load_seconds = float(seconds)
+
+    def _read(self) -> str:
+        line = self.process.stdout.readline()
+        if not line:
+            returncode = self.process.wait()
+            raise RankLibError(f'RankLib server exited with status {returncode}',
+                               returncode, '')
+        return line.rstrip('\n')
+
+    def train(self, ranker: str, params: Dict[str, str], model_path: str) -> ServerResult:
+        """
+        Args
+        ----
+          ranker: str
+              Index of the ranker in RankLib, only LambdaMART and MART are supported.
+          params: Dict[str, str]
+              Options of the ranker, such as `{'tree': '100'}`.
+          model_path: str
+              Where the server saves the trained model.
+
+        Returns
+        -------
+          result: ServerResult
+        """
+        options = ' '.join(f'{name}={value}' for name, value in params.items())
+        self.process.stdin.write(f'train {ranker} {model_path} {options}\n')
+        self.process.stdin.flush()
+        answer = self._read()
+        status, _, message = answer.partition(' ')
+        if status != 'ok':
+            raise RankLibError(f'RankLib server failed to train: {message}', None,
+                               answer)
+        seconds, train_score = message.split()
+        return ServerResult(open(model_path).read(), float(train_score), float(seconds))
+
+    def close(self, timeout: float = 10) -> None:
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write('quit\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RankLibPool:
+    """
+    Several servers sharing the requests of a sweep.
+
+    Args
+    ----
+      cmd: List[str]
+          Command as built by `build_server_command`.
+      workers: int
+          How many servers to run. Each one holds its own copy of the training data.
+    """
+    def __init__(self, cmd: List[str], workers: int = 1):
+        self.workers = workers
+        self.servers = Queue()
+        started = []
+        try:
+            for _ in range(workers):
+                started.append(RankLibServer(cmd))
+        except Exception:
+            for server in started:
+                server.close()
+            raise
+        for server in started:
+            self.servers.put(server)
+
+    def train(self, ranker: str, params: Dict[str, str], model_path: str) -> ServerResult:
+        """
+        Trains on the first server available, see `RankLibServer.train`.
+        """
+        server = self.servers.get()
+        try:
+            return server.train(ranker, params, model_path)
+        finally:
+            self.servers.put(server)
+
+    def sweep(
+        self,
+        ranker: str,
+        param_sets: Sequence[Dict[str, str]],
+        destination: str
+    ) -> List[ServerResult]:
+        """
+        Trains one model for each set of parameters, saved as
+        `{destination}/model_{index}.txt`.
+
+        Returns
+        -------
+          results: List[ServerResult]
+              In the same order as `param_sets`.
+        """
+        def train(index: int, params: Dict[str, str]) -> ServerResult:
+            return self.train(ranker, params, f'{destination}/model_{index}.txt')
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(train, range(len(param_sets)), param_sets))
+
+    def close(self) -> None:
+        while not self.servers.empty():
+            self.servers.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
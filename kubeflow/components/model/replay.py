@@ -0,0 +1,356 @@
+import os
+import json
+import glob
+import gzip
+import uuid
+import hashlib
+from array import array
+from shutil import rmtree
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from elasticsearch import Elasticsearch
+
+from msearch import AdaptiveBatcher
+from query_template import QueryTemplate
+from rank_evaluator import RankEvaluator
+from ranklib_model import RankLibModel
+
+
+"""
+Offline replay of validation searches. The first-stage retrieval of each search, before
+the sltr rescore, doesn't depend on the RankLib model being validated, so it's captured
+from Elasticsearch only once for each validation set, along with the features of the
+documents in the rescore window. Trials then rescore those documents locally with their
+own model.
+
+The capture is saved in `{files_path}/replay/{model_name}` as a folder containing:
+
+    meta.json: settings the capture depends on, including a hash of the featureset, and
+        how scores are combined.
+    docs.npy: int32 interned id of each retrieved document, in first-stage order.
+    counts.npy: int32 how many documents each search retrieved.
+    scores.npy: float32 first-stage score of each retrieved document.
+    features.npy: float32 features of the documents in the rescore window of each
+        search, shape (documents, features).
+    purchased.npy: int32 interned id of each purchased document.
+    purchased_counts.npy: int32 how many documents were purchased in each search.
+"""
+
+
+def get_replay_path(files_path: str, model_name: str) -> str:
+    return f'{files_path}/replay/{model_name}'
+
+
+def get_capture_template(
+    model_name: str,
+    window_size: int
+) -> Tuple[QueryTemplate, Dict[str, Any]]:
+    """
+    Builds the query of `model_name` with its sltr rescore replaced by the logging of
+    features of the documents in the rescore window.
+
+    Returns
+    -------
+      template: QueryTemplate
+      rescore: Dict[str, Any]
+          Weights and mode used by the original rescore to combine scores.
+    """
+    query = json.loads(open(f'queries/{model_name}/es_query.json').read())
+    rescore_query = query['rescore']['query']
+    rescore = {
+        'query_weight': rescore_query.get('query_weight', 1),
+        'rescore_query_weight': rescore_query.get('rescore_query_weight', 1),
+        'score_mode': rescore_query.get('score_mode', 'total')
+    }
+    query['_source'] = '_id'
+    query['size'] = '{size}'
+    # A null weight keeps the first-stage scores as they are. The LTR plugin only finds
+    # named queries in the main query, so the sltr of a rescore is logged by the
+    # position of the rescore instead.
+    query['rescore'] = {
+        'window_size': window_size,
+        'query': {
+            'rescore_query': {
+                'sltr': {
+                    '_name': 'logged_featureset',
+                    'featureset': model_name,
+                    'params': '{search_keys}'
+                }
+            },
+            'query_weight': 1,
+            'rescore_query_weight': 0
+        }
+    }
+    query['ext'] = {
+        'ltr_log': {
+            'log_specs': {
+                'name': 'main',
+                'rescore_index': 0
+            }
+        }
+    }
+    return QueryTemplate(query, ['query', 'size', 'search_keys']), rescore
+
+
+def get_replay_store(
+    files_path: str,
+    es_client: Elasticsearch,
+    model_name: str,
+    index: str,
+    size: int,
+    window_size: int = 50,
+    batcher: Optional[AdaptiveBatcher] = None
+) -> str:
+    """
+    Returns the path of the replay capture of the validation files in `files_path`,
+    capturing it first if it doesn't exist yet or if it was captured with different
+    settings.
+
+    Args
+    ----
+      files_path: str
+          Path to files containing data of customers searches and their purchases.
+      es_client: Elasticsearch
+      model_name: str
+          Name of the RankLib model, which is also the name of its featureset.
+      index: str
+          Name of Index where documents are stored in Elasticsearch.
+      size: int
+          How many documents to retrieve for each search.
+      window_size: int
+          How many documents are rescored by the RankLib model.
+      batcher: Optional[AdaptiveBatcher]
+          Sends the multisearch requests.
+
+    Returns
+    -------
+      path: str
+          Folder where the capture is located.
+    """
+    path = get_replay_path(files_path, model_name)
+    files = sorted(glob.glob(os.path.join(files_path, '*.gz')))
+    template, rescore = get_capture_template(model_name, window_size)
+    meta = {
+        'files': [os.path.basename(file_) for file_ in files],
+        'query': hashlib.sha1(
+            open(f'queries/{model_name}/es_query.json', 'rb').read()
+        ).hexdigest(),
+        # Features logged in the capture change along with their definition.
+        'featureset': get_featureset_hash(es_client, model_name),
+        'index': index,
+        'size': size,
+        'window_size': window_size,
+        **rescore
+    }
+    if read_meta(path) == meta:
+        return path
+
+    if batcher is None:
+        batcher = AdaptiveBatcher(size)
+    writer = ReplayStoreWriter(window_size)
+    search_arr, purchase_arr = [], []
+    header = json.dumps({'index': index})
+
+    for file_ in files:
+        for row in gzip.GzipFile(file_):
+            row = json.loads(row)
+            purchase_arr.append(row['docs'])
+            search_arr.append(header)
+            search_arr.append(template.render(
+                query=row['search_keys']['search_term'],
+                size=size,
+                search_keys=row['search_keys']
+            ))
+            if batcher.is_full(len(purchase_arr)):
+                writer.write(batcher.msearch(es_client, search_arr)['responses'],
+                             purchase_arr)
+                search_arr, purchase_arr = [], []
+    if search_arr:
+        writer.write(batcher.msearch(es_client, search_arr)['responses'],
+                     purchase_arr)
+
+    # Several trials may capture the same validation set concurrently so the capture
+    # is moved in place only once it's complete.
+    tmp_path = f'{path}.{uuid.uuid4().hex}'
+    writer.save(tmp_path, meta)
+    if read_meta(path) != meta:
+        rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            pass
+    rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def get_featureset_hash(es_client: Elasticsearch, featureset: str) -> str:
+    response = es_client.transport.perform_request(
+        'GET', f'/_ltr/_featureset/{featureset}'
+    )
+    return hashlib.sha1(
+        json.dumps(response['_source']['featureset'], sort_keys=True).encode()
+    ).hexdigest()
+
+
+def read_meta(path: str) -> Optional[Dict[str, Any]]:
+    meta_path = f'{path}/meta.json'
+    if not os.path.isfile(meta_path):
+        return None
+    return json.loads(open(meta_path).read())
+
+
+class ReplayStoreWriter:
+    """
+    Accumulates the captured searches in compact arrays.
+
+    Args
+    ----
+      window_size: int
+          How many documents are rescored in each search.
+    """
+    def __init__(self, window_size: int):
+        self.window_size = window_size
+        self._doc_ids: Dict[str, int] = {}
+        self._docs = array('i')
+        self._counts = array('i')
+        self._scores = array('f')
+        self._features = array('f')
+        self._n_features = 0
+        self._purchased = array('i')
+        self._purchased_counts = array('i')
+
+    def write(
+        self,
+        responses: List[Dict[str, Any]],
+        purchase_arr: List[List[Dict[str, List[str]]]]
+    ) -> None:
+        doc_ids = self._doc_ids
+        for response, purchases in zip(responses, purchase_arr):
+            hits = response.get('hits', {}).get('hits') or []
+            self._docs.extend(doc_ids.setdefault(hit['_id'], len(doc_ids))
+                              for hit in hits)
+            self._counts.append(len(hits))
+            self._scores.extend(hit.get('_score') or 0 for hit in hits)
+            for hit in hits[:self.window_size]:
+                logs = hit['fields']['_ltrlog'][0]['main']
+                self._n_features = len(logs)
+                self._features.extend(log.get('value', 0) for log in logs)
+
+            purchased = [doc_ids.setdefault(doc, len(doc_ids))
+                         for purchase in purchases for doc in purchase['purchased']]
+            self._purchased.extend(purchased)
+            self._purchased_counts.append(len(purchased))
+
+    def save(self, path: str, meta: Dict[str, Any]) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(f'{path}/docs.npy', np.frombuffer(self._docs, dtype=np.int32))
+        np.save(f'{path}/counts.npy', np.frombuffer(self._counts, dtype=np.int32))
+        np.save(f'{path}/scores.npy', np.frombuffer(self._scores, dtype=np.float32))
+        np.save(f'{path}/features.npy',
+                np.frombuffer(self._features, dtype=np.float32).reshape(
+                    -1, self._n_features or 1))
+        np.save(f'{path}/purchased.npy',
+                np.frombuffer(self._purchased, dtype=np.int32))
+        np.save(f'{path}/purchased_counts.npy',
+                np.frombuffer(self._purchased_counts, dtype=np.int32))
+        # Written last as it marks the capture as complete.
+        with open(f'{path}/meta.json', 'w') as f:
+            f.write(json.dumps(meta))
+
+
+def combine_scores(
+    query_scores: np.ndarray,
+    rescore_scores: np.ndarray,
+    rescore: Dict[str, Any]
+) -> np.ndarray:
+    """
+    Combines first-stage and model scores as Elasticsearch does for the given rescore
+    settings.
+    """
+    query_scores = rescore['query_weight'] * query_scores
+    rescore_scores = rescore['rescore_query_weight'] * rescore_scores
+    mode = rescore['score_mode']
+    if mode == 'total':
+        return query_scores + rescore_scores
+    if mode == 'multiply':
+        return query_scores * rescore_scores
+    if mode == 'avg':
+        return (query_scores + rescore_scores) / 2
+    if mode == 'max':
+        return np.maximum(query_scores, rescore_scores)
+    if mode == 'min':
+        return np.minimum(query_scores, rescore_scores)
+    raise ValueError(f'Invalid value for score_mode: "{mode}"')
+
+
+def replay_rank(path: str, model: RankLibModel, chunk_size: int = 10000) -> float:
+    """
+    Computes the rank of `model` over the searches captured in `path`.
+    """
+    return replay_metrics(path, model, chunk_size)['rank']
+
+
+def replay_metrics(
+    path: str,
+    model: RankLibModel,
+    chunk_size: int = 10000
+) -> Dict[str, float]:
+    """
+    Computes the metrics of `model` over the searches captured in `path`.
+
+    Args
+    ----
+      path: str
+          Folder where the capture is located.
+      model: RankLibModel
+          Model that rescores the documents of each search.
+      chunk_size: int
+          How many searches to load from the memory-mapped arrays at once.
+
+    Returns
+    -------
+      metrics: Dict[str, float]
+          Same metrics as computed by `validate.validate_model`.
+    """
+    meta = json.loads(open(f'{path}/meta.json').read())
+    docs = np.load(f'{path}/docs.npy', mmap_mode='r')
+    counts = np.load(f'{path}/counts.npy').astype(np.int64)
+    scores = np.load(f'{path}/scores.npy', mmap_mode='r')
+    features = np.load(f'{path}/features.npy', mmap_mode='r')
+    purchased = np.load(f'{path}/purchased.npy', mmap_mode='r')
+    purchased_counts = np.load(f'{path}/purchased_counts.npy').astype(np.int64)
+
+    window_counts = np.minimum(counts, meta['window_size'])
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    window_offsets = np.concatenate([[0], np.cumsum(window_counts)])
+    purchased_offsets = np.concatenate([[0], np.cumsum(purchased_counts)])
+    evaluator = RankEvaluator()
+
+    for start in range(0, len(counts), chunk_size):
+        end = min(start + chunk_size, len(counts))
+        chunk_counts = counts[start:end]
+        chunk_window_counts = window_counts[start:end]
+        chunk_docs = np.array(docs[offsets[start]:offsets[end]], dtype=np.int64)
+
+        # Index in `chunk_docs` of each document in the rescore windows.
+        queries = np.repeat(np.arange(end - start), chunk_window_counts)
+        window_starts = np.cumsum(chunk_window_counts) - chunk_window_counts
+        positions = np.arange(len(queries)) - window_starts[queries]
+        idx = (np.cumsum(chunk_counts) - chunk_counts)[queries] + positions
+
+        chunk_scores = np.asarray(scores[offsets[start]:offsets[end]])[idx]
+        model_scores = model.predict(
+            features[window_offsets[start]:window_offsets[end]]
+        )
+        new_scores = combine_scores(chunk_scores, model_scores, meta)
+        order = np.lexsort((-new_scores, queries))
+        chunk_docs[idx] = chunk_docs[idx[order]]
+
+        evaluator.evaluate_codes(
+            chunk_docs,
+            chunk_counts,
+            purchased[purchased_offsets[start]:purchased_offsets[end]],
+            purchased_counts[start:end]
+        )
+    return evaluator.metrics
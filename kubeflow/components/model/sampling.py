@@ -0,0 +1,179 @@
+import os
+import gzip
+import json
+import uuid
+import hashlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+
+"""
+Approximate validation over a reproducible subsample of the validation searches.
+
+Distinct queries are stratified by how often customers searched for them, with
+stratum `h` holding queries searched between 2^h and 2^(h+1) - 1 times, so head and
+tail queries are both represented in the same proportion as in the full set. Inside
+each stratum queries are picked by a seeded hash of their search keys, which selects
+the same queries for every trial. All searches of a picked query are validated.
+
+The rank is then estimated along with a stratified bootstrap confidence interval,
+resampling picked queries with replacement inside their strata.
+
+Every trial validates the same sample so `load_sample` saves it in the folder of the
+validation files, as `sample/{key}.json`, and only the first trial reads them all.
+"""
+
+
+class Sample(NamedTuple):
+    # Stratum of each picked query, keyed by `get_query_key`.
+    strata: Dict[str, int]
+    # How many queries of the full set each picked query stands for, by stratum.
+    weights: Dict[int, float]
+
+
+class RankEstimate(NamedTuple):
+    rank: float
+    low: float
+    high: float
+    searches: int
+
+
+def get_query_key(search_keys: Dict[str, Any]) -> str:
+    return json.dumps(search_keys, sort_keys=True)
+
+
+def build_sample(files: List[str], rate: float, seed: int = 0) -> Sample:
+    """
+    Args
+    ----
+      files: List[str]
+          Gzipped files with searches and purchases of a validation set.
+      rate: float
+          Fraction of the distinct queries of each stratum to pick. At least one query
+          is picked from each stratum.
+      seed: int
+          Different seeds pick different queries.
+
+    Returns
+    -------
+      sample: Sample
+    """
+    frequencies = Counter()
+    for file_ in files:
+        for row in gzip.GzipFile(file_):
+            frequencies[get_query_key(json.loads(row)['search_keys'])] += 1
+
+    keys_by_stratum = defaultdict(list)
+    for key, frequency in frequencies.items():
+        keys_by_stratum[frequency.bit_length() - 1].append(key)
+
+    strata, weights = {}, {}
+    for stratum, keys in keys_by_stratum.items():
+        keys.sort(key=lambda key: hashlib.md5(f'{seed}:{key}'.encode()).hexdigest())
+        size = min(len(keys), max(1, int(round(rate * len(keys)))))
+        strata.update(dict.fromkeys(keys[:size], stratum))
+        weights[stratum] = len(keys) / size
+    return Sample(strata, weights)
+
+
+def get_sample_path(files: List[str], rate: float, seed: int) -> str:
+    key = hashlib.sha1(json.dumps([files, rate, seed]).encode()).hexdigest()
+    return f'{os.path.dirname(files[0])}/sample/{key}.json'
+
+
+def get_files_meta(files: List[str]) -> List[List[Any]]:
+    """
+    Size and modification time of each file, so a sample is built again once any of
+    them changes.
+    """
+    return [[file_, os.stat(file_).st_size, os.stat(file_).st_mtime] for file_ in files]
+
+
+def load_sample(files: List[str], rate: float, seed: int = 0) -> Sample:
+    """
+    Same as `build_sample` but reads the sample saved by a previous call with the same
+    arguments, as long as the files didn't change since.
+    """
+    if not files:
+        return build_sample(files, rate, seed)
+    path = get_sample_path(files, rate, seed)
+    meta = get_files_meta(files)
+    if os.path.isfile(path):
+        saved = json.loads(open(path).read())
+        if saved['files'] == meta:
+            weights = {int(stratum): weight
+                       for stratum, weight in saved['weights'].items()}
+            return Sample(saved['strata'], weights)
+
+    sample = build_sample(files, rate, seed)
+    # Several trials may build the same sample concurrently so it's moved in place
+    # only once it's complete.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{uuid.uuid4().hex}'
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps({'files': meta, 'strata': sample.strata,
+                            'weights': sample.weights}))
+    os.replace(tmp_path, path)
+    return sample
+
+
+def estimate_rank(
+    query_ranks: Dict[str, Tuple[float, int]],
+    sample: Sample,
+    confidence: float = 0.95,
+    iterations: int = 1000,
+    seed: int = 0
+) -> Tuple[float, float, float]:
+    """
+    Args
+    ----
+      query_ranks: Dict[str, Tuple[float, int]]
+          Numerator and denominator of the rank equation summed over the searches of
+          each picked query. Queries without purchased documents retrieved may be
+          missing.
+      sample: Sample
+      confidence: float
+          Probability mass of the bootstrap distribution inside the interval.
+      iterations: int
+          How many bootstrap replicates to draw.
+      seed: int
+
+    Returns
+    -------
+      rank: float
+          Estimate of the rank over the full validation set.
+      low: float
+      high: float
+          Bounds of the confidence interval of the rank.
+    """
+    keys_by_stratum = defaultdict(list)
+    for key, stratum in sample.strata.items():
+        keys_by_stratum[stratum].append(key)
+
+    rng = np.random.RandomState(seed)
+    rank_num, rank_den = 0.0, 0.0
+    boot_num, boot_den = np.zeros(iterations), np.zeros(iterations)
+    for stratum, keys in sorted(keys_by_stratum.items()):
+        weight = sample.weights[stratum]
+        stats = np.array([query_ranks.get(key, (0.0, 0)) for key in keys], dtype=float)
+        rank_num += weight * stats[:, 0].sum()
+        rank_den += weight * stats[:, 1].sum()
+        # Replicates are drawn in blocks so memory doesn't grow with iterations times
+        # queries.
+        block = max(1, 10 ** 6 // len(keys))
+        for start in range(0, iterations, block):
+            end = min(start + block, iterations)
+            counts = rng.multinomial(len(keys), np.full(len(keys), 1 / len(keys)),
+                                     size=end - start)
+            boot = counts @ stats
+            boot_num[start:end] += weight * boot[:, 0]
+            boot_den[start:end] += weight * boot[:, 1]
+
+    # rank=50% if no document was retrieved from Elasticsearch and purchased.
+    rank = rank_num / rank_den if rank_den else 0.5
+    ranks = np.divide(boot_num, boot_den, out=np.full(iterations, 0.5),
+                      where=boot_den > 0)
+    low, high = np.percentile(ranks, [50 * (1 - confidence), 50 * (1 + confidence)])
+    return rank, float(low), float(high)
@@ -0,0 +1,54 @@
+from typing import Any, Dict, List
+
+
+"""
+Hyperparameters searched for each ranker, in the format of the `parameters` of a Katib
+Experiment. Used by both `launch_katib.py` and `local_search.py`.
+"""
+
+
+def get_ranker_parameters(ranker: str) -> List[Dict[str, Any]]:
+    return {
+        'lambdamart': [
+            {
+                "name": "--tree",
+                "parameterType": "int",
+                "feasibleSpace": {
+                    "min": "1",
+                    "max": "500"
+                }
+            },
+            {
+                "name": "--leaf",
+                "parameterType": "int",
+                "feasibleSpace": {
+                    "min": "2",
+                    "max": "40"
+                }
+            },
+            {
+                "name": "--shrinkage",
+                "parameterType": "double",
+                "feasibleSpace": {
+                    "min": "0.01",
+                    "max": "0.2"
+                }
+            },
+            {
+                "name": "--tc",
+                "parameterType": "int",
+                "feasibleSpace": {
+                    "min": "-1",
+                    "max": "300"
+                }
+            },
+            {
+                "name": "--mls",
+                "parameterType": "int",
+                "feasibleSpace": {
+                    "min": "1",
+                    "max": "10"
+                }
+            }
+        ]
+    }.get(ranker)
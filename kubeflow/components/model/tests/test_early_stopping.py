@@ -0,0 +1,46 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from early_stopping import EarlyStop, RankMonitor
+
+
+def test_rank_monitor():
+    np.random.seed(0)
+    monitor = RankMonitor(0.5, sigmas=2, min_searches=10)
+    ranks = [np.random.rand(np.random.randint(0, 4)) for _ in range(8)] + [None]
+
+    monitor.update(ranks[:4])
+    monitor.update(ranks[4:])
+
+    num = np.array([0 if r is None else r.sum() for r in ranks])
+    den = np.array([0 if r is None else r.size for r in ranks])
+    rank = num.sum() / den.sum()
+    se = np.std(num - rank * den, ddof=1) / np.sqrt(len(ranks)) / den.mean()
+    assert monitor.searches == 9
+    assert monitor.rank == pytest.approx(rank)
+    assert monitor.bound == pytest.approx(rank - 2 * se)
+
+
+def test_rank_monitor_stops():
+    monitor = RankMonitor(0.5, sigmas=3, min_searches=4)
+    bad_ranks = [np.array([0.9, 0.8]), np.array([0.85])]
+
+    # Not enough searches yet.
+    monitor.update(bad_ranks)
+    with pytest.raises(EarlyStop) as error:
+        monitor.update(bad_ranks)
+    assert error.value.searches == 4
+    assert error.value.rank == pytest.approx(0.85)
+    assert error.value.bound > 0.5
+
+    stop = pickle.loads(pickle.dumps(error.value))
+    assert (stop.rank, stop.bound, stop.searches) == (
+        error.value.rank, error.value.bound, 4)
+
+
+def test_rank_monitor_keeps_going():
+    monitor = RankMonitor(0.5, sigmas=3, min_searches=2)
+    monitor.update([np.array([0.9]), np.array([0.1]), np.array([0.6])])
+    assert monitor.bound < 0.5
@@ -0,0 +1,114 @@
+import shutil
+
+import mock
+import pytest
+
+from early_stopping import EarlyStop, RankMonitor
+from evaluation import EvaluationService
+
+
+def msearch(body, request_timeout):
+    hits = [{'_id': f'doc{idx}'} for idx in [3, 2, 1, 0]]
+    return {'responses': [{'hits': {'hits': hits}} for _ in body.split('\n')[1::2]]}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_evaluate(monkeypatch, tmpdir_factory, workers):
+    regular_path = str(tmpdir_factory.mktemp('regular'))
+    train_path = str(tmpdir_factory.mktemp('train'))
+    for shard in range(2):
+        shutil.copy('tests/fixtures/validation.gz',
+                    f'{regular_path}/validation{shard}.gz')
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+
+    with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                           workers=workers) as service:
+        # A set without files gets the default rank.
+        metrics_regular, metrics_train = service.evaluate(regular_path, train_path)
+        assert metrics_regular['rank'] == pytest.approx(0.6)
+        assert metrics_train == {'rank': 0.5, 'ndcg_10': 0.0, 'mrr': 0.0,
+                                 'err_10': 0.0, 'precision_10': 0.0}
+        assert service.evaluate(regular_path) == [metrics_regular]
+        pool = service._pool
+        assert (pool is None) == (workers == 1)
+
+    assert service._pool is None
+    if workers == 1:
+        # The same client is used by every evaluation.
+        assert es_mock.call_count == 1
+        assert es_mock.return_value.msearch.call_count == 8
+
+
+def test_evaluate_replay(monkeypatch):
+    replay_mock = mock.Mock(side_effect=[{'rank': 0.4}, {'rank': 0.3}])
+    monkeypatch.setattr('evaluation.replay_model', replay_mock)
+    monkeypatch.setattr('validate.Elasticsearch', mock.Mock())
+
+    with EvaluationService('es_host_test', 'unittest', workers=1) as service:
+        metrics = service.evaluate('/regular', '/train', replay=True,
+                                   model_path='model.txt')
+
+    assert metrics == [{'rank': 0.4}, {'rank': 0.3}]
+    replay_mock.assert_any_call('/regular', 'unittest', 'pysearchml', 1000, None,
+                                'model.txt')
+
+
+def test_estimate(monkeypatch, tmpdir_factory):
+    regular_path = str(tmpdir_factory.mktemp('regular'))
+    for shard in range(2):
+        shutil.copy('tests/fixtures/validation.gz',
+                    f'{regular_path}/validation{shard}.gz')
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+
+    with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                           workers=1) as service:
+        estimate, = service.estimate(regular_path, rate=1)
+
+    # Every query is searched twice so all of them are in the same stratum.
+    assert estimate.rank == pytest.approx(0.6)
+    assert estimate.low <= estimate.rank <= estimate.high
+    assert estimate.searches == 6
+
+    with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                           workers=1) as service:
+        estimate, = service.estimate(regular_path, rate=0.1)
+    assert estimate.searches == 2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_evaluate_early_stop(monkeypatch, tmpdir_factory, workers):
+    regular_path = str(tmpdir_factory.mktemp('regular'))
+    train_path = str(tmpdir_factory.mktemp('train'))
+    for shard in range(2):
+        shutil.copy('tests/fixtures/validation.gz',
+                    f'{regular_path}/validation{shard}.gz')
+        shutil.copy('tests/fixtures/validation.gz', f'{train_path}/validation{shard}.gz')
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+
+    with pytest.raises(EarlyStop):
+        with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                               workers=workers) as service:
+            service.evaluate(regular_path, train_path,
+                             monitor=RankMonitor(0.1, sigmas=1, min_searches=2))
+    assert service._pool is None
+
+    # Only files of the first set are compared with the best rank.
+    with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                           workers=workers) as service:
+        metrics = service.evaluate(regular_path, train_path,
+                                   monitor=RankMonitor(0.7, sigmas=1, min_searches=2))
+    assert [metric['rank'] for metric in metrics] == [pytest.approx(0.6)] * 2
+
+    # Each file is monitored on its own, neither has enough searches to be stopped.
+    monitor = RankMonitor(0.1, sigmas=1, min_searches=4)
+    with EvaluationService('es_host_test', 'unittest', 'index_test', 2,
+                           workers=workers) as service:
+        metrics = service.evaluate(regular_path, monitor=monitor)
+    assert metrics[0]['rank'] == pytest.approx(0.6)
+    assert monitor.searches == 0
@@ -0,0 +1,126 @@
+import gzip
+
+import numpy as np
+import pytest
+
+from lambdamart import (LambdaMART, RankingData, err_swap_changes, get_thresholds,
+                        load_ranklib_file, ndcg_swap_changes, normalize_sum)
+from ranklib_model import RankLibModel
+
+
+def get_err(labels, gmax, k):
+    R = (2 ** labels - 1) / 2 ** gmax
+    reach, err = 1, 0
+    for position, r in enumerate(R[:k]):
+        err += reach * r / (position + 1)
+        reach *= 1 - r
+    return err
+
+
+def get_ndcg(labels, k):
+    discounts = 1 / np.log2(np.arange(len(labels)) + 2)
+    discounts[k:] = 0
+    gains = 2 ** labels - 1
+    return (gains * discounts).sum() / (np.sort(gains)[::-1] * discounts).sum()
+
+
+def build_data(queries=50, seed=0):
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(1, 30, queries)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    X = rng.rand(offsets[-1], 5).astype(np.float32)
+    y = np.clip(X[:, 0] * 3 + X[:, 1] + rng.rand(len(X)), 0, 4).astype(int)
+    return RankingData(X, y.astype(np.float32), offsets)
+
+
+def test_swap_changes():
+    labels = np.random.RandomState(0).randint(0, 5, (3, 8)).astype(float)
+
+    err_changes = err_swap_changes(labels, 4, 5)
+    ndcg_changes = ndcg_swap_changes(labels, 5)
+
+    for query in range(3):
+        for a in range(8):
+            for b in range(8):
+                swapped = labels[query].copy()
+                swapped[a], swapped[b] = swapped[b], swapped[a]
+                assert err_changes[query, a, b] == pytest.approx(
+                    abs(get_err(swapped, 4, 5) - get_err(labels[query], 4, 5)))
+                assert ndcg_changes[query, a, b] == pytest.approx(
+                    abs(get_ndcg(swapped, 5) - get_ndcg(labels[query], 5)))
+
+
+def test_load_ranklib_file(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('unittest') / 'train_dataset.txt.gz')
+    with gzip.open(path, 'wt') as f:
+        f.write('4\tqid:1\t1:0.5\t2:1.5\t# doc0\n'
+                '0\tqid:1\t1:0.25\n'
+                '\n'
+                '1\tqid:7\t2:3\n')
+
+    data = load_ranklib_file(path)
+
+    np.testing.assert_array_equal(data.X, [[0.5, 1.5], [0.25, 0], [0, 3]])
+    np.testing.assert_array_equal(data.y, [4, 0, 1])
+    np.testing.assert_array_equal(data.offsets, [0, 2, 3])
+
+
+def test_normalize_sum():
+    X = np.array([[1, -2], [3, 2], [5, 0]], dtype=np.float32)
+    np.testing.assert_allclose(normalize_sum(X, np.array([0, 2, 3])),
+                               [[0.25, -0.5], [0.75, 0.5], [1, 0]])
+
+
+def test_get_thresholds():
+    values = np.array([3, 1, 2, 2], dtype=np.float32)
+    np.testing.assert_array_equal(get_thresholds(values, 3), [1, 2, 3])
+    np.testing.assert_allclose(get_thresholds(np.arange(9, dtype=np.float32), 4),
+                               [0, 2, 4, 6, 8])
+
+
+@pytest.mark.parametrize('metric', ['ERR@10', 'NDCG@10'])
+def test_fit(metric):
+    data = build_data()
+    model = LambdaMART(n_trees=20, n_leaves=6, min_leaf_support=2, metric=metric,
+                       workers=2).fit(data)
+
+    ranklib = RankLibModel.from_string(model.to_ranklib())
+    assert ranklib.n_trees == 20
+    assert ranklib.n_leaves == 20 * 6
+    # The exported model scores documents just as they were scored while training.
+    np.testing.assert_allclose(ranklib.predict(normalize_sum(data.X, data.offsets)),
+                               model.scores)
+
+    def mean_err(scores):
+        return np.mean([
+            get_err(data.y[start:end][np.argsort(-scores[start:end], kind='stable')],
+                    4, 10)
+            for start, end in zip(data.offsets[:-1], data.offsets[1:])
+        ])
+
+    assert mean_err(model.scores) > mean_err(np.zeros(len(data.y))) + 0.1
+
+
+def test_fit_many_thresholds():
+    # More distinct values than fit in 16 bits when all of them are thresholds.
+    x = (np.random.RandomState(0).permutation(70000) / 70000).astype(np.float32)
+    X = np.stack([x, np.zeros_like(x)], axis=1)
+    y = (x > 0.99).astype(np.float32)
+    data = RankingData(X, y, np.arange(0, 70001, 100))
+
+    model = LambdaMART(n_trees=1, n_leaves=2, n_thresholds=None, norm=None,
+                       workers=1).fit(data)
+
+    assert model._bins.max() == 69999
+    tree = model.trees[0]
+    assert tree.feature[0] == 0
+    assert tree.threshold[0] == pytest.approx(0.99, abs=1e-3)
+
+
+def test_from_ranklib_args():
+    model = LambdaMART.from_ranklib_args({'tree': '5', 'leaf': '3', 'shrinkage': '0.2',
+                                          'tc': '-1', 'mls': '4'})
+    assert (model.n_trees, model.n_leaves, model.learning_rate, model.n_thresholds,
+            model.min_leaf_support) == (5, 3, 0.2, None, 4)
+    with pytest.raises(ValueError):
+        LambdaMART.from_ranklib_args({'estop': '10'})
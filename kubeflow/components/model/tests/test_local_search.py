@@ -0,0 +1,194 @@
+import os
+import shutil
+from collections import namedtuple
+
+import mock
+import numpy as np
+import pytest
+
+from lambdamart import RankingData
+from local_search import (RandomSampler, TPESampler, Trial, from_unit, get_brackets,
+                          main, search, subset_queries, to_unit)
+from search_space import get_ranker_parameters
+
+
+SPACE = [
+    {'name': '--tree', 'parameterType': 'int',
+     'feasibleSpace': {'min': '1', 'max': '3'}},
+    {'name': '--shrinkage', 'parameterType': 'double',
+     'feasibleSpace': {'min': '0.1', 'max': '0.5'}}
+]
+
+
+def test_from_unit():
+    assert from_unit(SPACE, np.array([0, 0])) == {'tree': '1', 'shrinkage': '0.1'}
+    assert from_unit(SPACE, np.array([1, 1])) == {'tree': '3', 'shrinkage': '0.5'}
+    assert from_unit(SPACE, np.array([0.5, 0.5])) == {'tree': '2', 'shrinkage': '0.3'}
+    np.testing.assert_allclose(to_unit(SPACE, {'tree': '2', 'shrinkage': '0.3'}),
+                               [0.5, 0.5])
+
+    space = get_ranker_parameters('lambdamart')
+    params = from_unit(space, np.array([0.3] * len(space)))
+    assert from_unit(space, to_unit(space, params)) == params
+
+    with pytest.raises(ValueError):
+        from_unit([{'name': '--x', 'parameterType': 'categorical',
+                    'feasibleSpace': {'min': '0', 'max': '1'}}], np.array([0]))
+
+
+def test_get_brackets():
+    brackets = get_brackets(1 / 9, 3)
+    assert [[n for n, _ in bracket] for bracket in brackets] == [[9, 3, 1], [5, 1], [3]]
+    assert [budget for _, budget in brackets[0]] == pytest.approx([1 / 9, 1 / 3, 1])
+    assert [budget for _, budget in brackets[1]] == pytest.approx([1 / 3, 1])
+    assert get_brackets(1) == [[(1, 1.0)]]
+
+
+def test_search():
+    runs = []
+
+    def run(param_sets, budget):
+        runs.append((len(param_sets), budget))
+        return [Trial(params, budget, abs(float(params['shrinkage']) - 0.2), {}, {},
+                      None) for params in param_sets]
+
+    trials = search(run, RandomSampler(SPACE, seed=1), 12, 1 / 9, 3)
+
+    # Second bracket gets the 3 configurations left.
+    assert [n for n, _ in runs] == [9, 3, 1, 3, 1]
+    assert [budget for _, budget in runs] == pytest.approx([1 / 9, 1 / 3, 1, 1 / 3, 1])
+    assert len(trials) == 17
+    # Best configuration of each rung is promoted.
+    first_rung = trials[:9]
+    best = min(first_rung, key=lambda trial: trial.loss)
+    assert best.params in [trial.params for trial in trials[9:12]]
+    assert trials[12].params in [trial.params for trial in trials[9:12]]
+
+    # Budgets above 1 give no bracket to run.
+    runs.clear()
+    assert search(run, RandomSampler(SPACE), 5, 1.5, 3) == []
+    assert runs == []
+
+
+def test_tpe_sampler():
+    space = get_ranker_parameters('lambdamart')
+    rng = np.random.RandomState(0)
+
+    def loss(params):
+        return abs(to_unit(space, params)[0] - 0.2)
+
+    history = []
+    for _ in range(30):
+        params = from_unit(space, rng.rand(len(space)))
+        history.append(Trial(params, 1.0, loss(params), {}, {}, None))
+    # Trials of smaller budgets are ignored once the full one has enough of them.
+    history.append(Trial(from_unit(space, np.ones(len(space))), 0.5, -1, {}, {}, None))
+
+    tpe = TPESampler(space, seed=0)
+    tpe_loss = np.mean([loss(tpe.sample(history)) for _ in range(50)])
+    random = RandomSampler(space, seed=0)
+    random_loss = np.mean([loss(random.sample(history)) for _ in range(50)])
+    assert tpe_loss < random_loss / 2
+
+    # Samples at random until there are enough trials.
+    assert TPESampler(space, seed=3).sample(history[:5]) == \
+        RandomSampler(space, seed=3).sample([])
+
+
+def test_subset_queries():
+    data = RankingData(np.arange(12, dtype=np.float32).reshape(6, 2),
+                       np.arange(6, dtype=np.float32), np.array([0, 2, 3, 6]))
+    subset = subset_queries(data, np.array([2, 0]))
+    np.testing.assert_array_equal(subset.X, [[0, 1], [2, 3], [6, 7], [8, 9], [10, 11]])
+    np.testing.assert_array_equal(subset.y, [0, 1, 3, 4, 5])
+    np.testing.assert_array_equal(subset.offsets, [0, 2, 5])
+
+
+def test_main(monkeypatch, tmpdir_factory, capsys):
+    tmp_folder = str(tmpdir_factory.mktemp('unittest'))
+
+    # Every search retrieves doc3 to doc0, doc0 being the only one with feature 1 set.
+    def msearch(body, request_timeout):
+        hits = [
+            {
+                '_id': f'doc{idx}',
+                '_score': float(idx + 1),
+                'fields': {
+                    '_ltrlog': [{'main': [{'name': 'f1', 'value': float(idx == 0)},
+                                          {'name': 'f2', 'value': float(idx)}]}]
+                }
+            }
+            for idx in [3, 2, 1, 0]
+        ]
+        searches = body.split('\n')[1::2]
+        return {'responses': [{'hits': {'hits': hits}} for _ in searches]}
+
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = msearch
+    es_client.transport.perform_request.return_value = {
+        '_source': {'featureset': {'features': [{'name': 'f1'}, {'name': 'f2'}]}}
+    }
+    monkeypatch.setattr('local_search.Elasticsearch', mock.Mock(return_value=es_client))
+    monkeypatch.setattr('local_search.get_ranker_parameters', lambda ranker: SPACE)
+
+    for name in ['validation_regular', 'validation_train']:
+        os.makedirs(f'{tmp_folder}/{name}')
+        shutil.copy('tests/fixtures/validation.gz', f'{tmp_folder}/{name}')
+    with open(f'{tmp_folder}/train_dataset.txt', 'w') as f:
+        for qid in range(9):
+            for doc in range(4):
+                f.write(f'{int(doc == 0)}\tqid:{qid}\t1:{int(doc == 0)}\t2:{doc}\n')
+
+    args = namedtuple('args', [])
+    args.train_file_path = f'{tmp_folder}/train_dataset.txt'
+    args.validation_files_path = f'{tmp_folder}/validation_regular'
+    args.validation_train_files_path = f'{tmp_folder}/validation_train'
+    args.es_host = 'es_host_test'
+    args.es_batch = 2
+    args.es_target_latency = None
+    args.destination = f'{tmp_folder}/model'
+    args.model_name = 'unittest'
+    args.ranker = 'lambdamart'
+    args.index = 'index_test'
+    args.objective = 'rank'
+    args.sampler = 'tpe'
+    args.trials = 4
+    args.min_budget = 1 / 3
+    args.eta = 3
+    args.workers = 1
+    args.seed = 0
+
+    trials = main(args)
+
+    # 3 configurations at 1/3 of the queries, the best one and another configuration
+    # with all of them.
+    assert [trial.budget for trial in trials] == pytest.approx([1 / 3] * 3 + [1, 1])
+    results = open(f'{args.destination}/results.txt').read().splitlines()
+    assert len(results) == 2
+    assert all(',rank_train=' in line and ',rank_val=' in line for line in results)
+    best = min(trial.metrics_val['rank'] for trial in trials if trial.budget == 1)
+    assert float(open(f'{args.destination}/best_rank.txt').read()) == best
+    assert open(f'{args.destination}/best_model.txt').read().startswith('## LambdaMART')
+
+    # No configuration reaches the full budget.
+    args.trials = 0
+    assert main(args) == []
+    assert 'none of them trained with all queries' in capsys.readouterr().out
+    assert not os.path.isfile(f'{args.destination}/best_rank.txt')
+
+    for min_budget in [0, -0.5, 1.5]:
+        args.min_budget = min_budget
+        with pytest.raises(ValueError):
+            main(args)
+    args.min_budget = 1
+    args.eta = 1
+    with pytest.raises(ValueError):
+        main(args)
+
+    args.objective = 'ndcg_10'
+    args.sampler = 'grid'
+    with pytest.raises(ValueError):
+        main(args)
+    args.ranker = 'mart'
+    with pytest.raises(ValueError):
+        main(args)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from metrics import compute_metrics, get_metric_names, is_minimized
+
+
+def test_compute_metrics():
+    docs = [5, 1, 2, 3, 7, 8, 9]
+    counts = [4, 1, 2, 0]
+    # Purchases repeated in the same search count only once.
+    purchased = [1, 3, 1, 7, 4]
+    purchased_counts = [3, 1, 0, 1]
+
+    metrics = compute_metrics(docs, counts, purchased, purchased_counts, k=2)
+
+    np.testing.assert_allclose(metrics.ranks[0], [1 / 3, 1])
+    assert metrics.ranks[1] is None
+    assert metrics.ranks[2].size == 0
+    assert metrics.ranks[3] is None
+    assert metrics.rank_num == pytest.approx(4 / 3)
+    assert metrics.rank_den == 2
+    # The search without purchases isn't taken into account.
+    assert metrics.queries == 3
+    ndcg = (1 / np.log2(3)) / (1 + 1 / np.log2(3))
+    assert metrics.sums == {
+        'ndcg_2': pytest.approx(ndcg + 1),
+        'mrr': pytest.approx(1 / 2 + 1),
+        'err_2': pytest.approx(0.5 / 2 + 0.5),
+        'precision_2': pytest.approx(1 / 2 + 1 / 2)
+    }
+
+
+def test_compute_metrics_err():
+    # The second purchase only satisfies customers the first one didn't.
+    metrics = compute_metrics([1, 2, 3], [3], [1, 3], [2], k=10)
+    assert metrics.sums['err_10'] == pytest.approx(0.5 + 0.5 * 0.5 / 3)
+    assert metrics.sums['ndcg_10'] == pytest.approx(
+        (1 + 1 / np.log2(4)) / (1 + 1 / np.log2(3))
+    )
+
+
+def test_get_metric_names():
+    assert get_metric_names(5) == ['rank', 'ndcg_5', 'mrr', 'err_5', 'precision_5']
+    assert is_minimized('rank')
+    assert not is_minimized('ndcg_5')
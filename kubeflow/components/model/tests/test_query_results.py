@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from query_results import (QueryResultsWriter, diff_query_results, get_key_hash,
+                           load_query_results)
+
+
+def build_response(docs):
+    return {'hits': {'hits': [{'_id': doc} for doc in docs]}}
+
+
+def write_results(path, responses):
+    writer = QueryResultsWriter()
+    search_keys_arr = [{'search_term': f'query{idx % 3}'} for idx in range(4)]
+    purchase_arr = [
+        [{'purchased': ['doc0', 'doc1']}],
+        [{'purchased': ['doc1']}],
+        [{'purchased': ['doc2']}],
+        [{'purchased': ['doc2']}]
+    ]
+    writer.write(search_keys_arr[:2], responses[:2], purchase_arr[:2])
+    writer.write(search_keys_arr[2:], responses[2:], purchase_arr[2:])
+    writer.save(path)
+
+
+def test_query_results(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('unittest'))
+    write_results(f'{path}/shard0.npz', [
+        build_response(['doc3', 'doc2', 'doc1', 'doc0']),
+        build_response(['doc1']),
+        {'status': 500},
+        build_response(['doc2', 'doc1'])
+    ])
+    write_results(f'{path}/shard1.npz', [build_response(['doc0', 'doc1'])] * 4)
+
+    results = load_query_results(path)
+
+    assert results.key_hash[0] == get_key_hash({'search_term': 'query0'})
+    assert results.key_hash[3] == results.key_hash[0]
+    assert list(results.query[:4]) == ['query0', 'query1', 'query2', 'query0']
+    np.testing.assert_array_equal(results.doc_counts, [4, 1, 0, 2, 2, 2, 2, 2])
+    np.testing.assert_array_equal(results.position_counts, [2, 1, 0, 1, 2, 1, 0, 0])
+    np.testing.assert_array_equal(results.positions, [2, 3, 0, 0, 0, 1, 1])
+    np.testing.assert_allclose(results.rank, [5 / 6, np.nan, np.nan, 0,
+                                              0.5, 1, np.nan, np.nan])
+    # Documents of each file point to their own ids.
+    assert list(results.doc_ids[results.docs[-2:]]) == ['doc0', 'doc1']
+    assert list(results.doc_ids[results.docs[:4]]) == ['doc3', 'doc2', 'doc1', 'doc0']
+
+
+def test_diff_query_results(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('unittest'))
+    write_results(f'{path}/base.npz', [
+        build_response(['doc3', 'doc2', 'doc1', 'doc0']),
+        build_response(['doc1', 'doc0']),
+        build_response(['doc2', 'doc0']),
+        build_response(['doc2', 'doc1', 'doc0'])
+    ])
+    write_results(f'{path}/candidate.npz', [
+        build_response(['doc0', 'doc1', 'doc3']),
+        build_response(['doc0', 'doc1']),
+        build_response(['doc2', 'doc0']),
+        build_response(['doc3', 'doc2'])
+    ])
+
+    diff = diff_query_results(load_query_results(f'{path}/base.npz'),
+                              load_query_results(f'{path}/candidate.npz'))
+
+    # query0 is searched twice and its rank is merged over both searches.
+    assert list(diff.query) == ['query1', 'query2', 'query0']
+    np.testing.assert_array_equal(diff.searches, [1, 1, 2])
+    np.testing.assert_allclose(diff.base_rank, [0, 0, 5 / 6 * 2 / 3])
+    np.testing.assert_allclose(diff.candidate_rank, [1, 0, (0.5 / 2 * 2 + 1) / 3])
+    assert diff.delta[0] == pytest.approx(1)
+    assert diff.only_base == 0
+    assert diff.only_candidate == 0
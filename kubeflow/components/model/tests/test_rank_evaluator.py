@@ -0,0 +1,65 @@
+import numpy as np
+
+from rank_evaluator import RankEvaluator
+
+
+def build_response(docs):
+    return {'hits': {'hits': [{'_id': doc} for doc in docs]}}
+
+
+def test_evaluate():
+    evaluator = RankEvaluator()
+    responses = [
+        build_response(['doc3', 'doc2', 'doc1', 'doc0']),
+        # Searches with less than 2 documents are skipped but still keep their place
+        # in the batch.
+        build_response(['doc1']),
+        {'status': 500, 'error': 'error'},
+        build_response(['doc0', 'doc2', 'doc1']),
+        build_response(['doc0', 'doc5'])
+    ]
+    purchase_arr = [
+        [{'purchased': ['doc0', 'doc1']}, {'purchased': ['doc2']}],
+        [{'purchased': ['doc1']}],
+        [{'purchased': ['doc1']}],
+        [{'purchased': ['doc1', 'doc4']}],
+        [{'purchased': ['doc3']}]
+    ]
+
+    ranks = evaluator.evaluate(responses, purchase_arr)
+
+    np.testing.assert_allclose(ranks[0], [1 / 3, 2 / 3, 1])
+    assert ranks[1] is None
+    assert ranks[2] is None
+    np.testing.assert_allclose(ranks[3], [1])
+    assert ranks[4].size == 0
+    assert evaluator.rank_num == 3
+    assert evaluator.rank_den == 4
+    assert evaluator.rank == 0.75
+
+
+def test_evaluate_random():
+    np.random.seed(0)
+    evaluator = RankEvaluator()
+    expected_num, expected_den = 0, 0
+    for _ in range(5):
+        responses, purchase_arr = [], []
+        for _ in range(50):
+            docs = [f'doc{idx}' for idx in
+                    np.random.permutation(30)[:np.random.randint(0, 10)]]
+            purchased = [f'doc{idx}' for idx in np.random.randint(0, 30, size=3)]
+            responses.append(build_response(docs))
+            purchase_arr.append([{'purchased': purchased}])
+            if len(docs) < 2:
+                continue
+            positions = [idx for idx, doc in enumerate(docs) if doc in purchased]
+            expected_num += sum(positions) / (len(docs) - 1)
+            expected_den += len(positions)
+        evaluator.evaluate(responses, purchase_arr)
+
+    np.testing.assert_allclose(evaluator.rank_num, expected_num)
+    assert evaluator.rank_den == expected_den
+
+
+def test_rank_without_purchases():
+    assert RankEvaluator().rank == 0.5
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from ranklib_model import RankLibModel
+
+
+MODEL = """## LambdaMART
+## No. of trees = 2
+## No. of leaves = 3
+<ensemble>
+    <tree id="1" weight="0.1">
+        <split>
+            <feature> 1 </feature>
+            <threshold> 0.5 </threshold>
+            <split pos="left">
+                <feature> 2 </feature>
+                <threshold> 10.0 </threshold>
+                <split pos="left">
+                    <output> -1.0 </output>
+                </split>
+                <split pos="right">
+                    <output> 2.0 </output>
+                </split>
+            </split>
+            <split pos="right">
+                <output> 3.0 </output>
+            </split>
+        </split>
+    </tree>
+    <tree id="2" weight="0.5">
+        <split>
+            <feature> 2 </feature>
+            <threshold> 1.5 </threshold>
+            <split pos="left">
+                <output> 1.0 </output>
+            </split>
+            <split pos="right">
+                <output> -1.0 </output>
+            </split>
+        </split>
+    </tree>
+</ensemble>
+"""
+
+
+# Random Forests are saved with one ensemble per bag.
+RF_MODEL = """## Random Forests
+## No. of bags = 2
+<ensemble>
+    <tree id="1" weight="1.0">
+        <split>
+            <feature> 1 </feature>
+            <threshold> 0.5 </threshold>
+            <split pos="left">
+                <output> -1.0 </output>
+            </split>
+            <split pos="right">
+                <output> 3.0 </output>
+            </split>
+        </split>
+    </tree>
+</ensemble>
+<ensemble>
+    <tree id="1" weight="1.0">
+        <split>
+            <feature> 2 </feature>
+            <threshold> 1.5 </threshold>
+            <split pos="left">
+                <output> 2.0 </output>
+            </split>
+            <split pos="right">
+                <output> 1.0 </output>
+            </split>
+        </split>
+    </tree>
+</ensemble>
+"""
+
+
+def test_predict():
+    model = RankLibModel.from_string(MODEL)
+    X = np.array([
+        [0.5, 10.0],
+        [0.6, 1.0],
+        [0.1, 11.0],
+        [0.0, 1.5]
+    ])
+
+    scores = model.predict(X)
+
+    np.testing.assert_allclose(scores, [-0.1 - 0.5, 0.3 + 0.5, 0.2 - 0.5, -0.1 + 0.5])
+
+
+def test_predict_random_forest():
+    model = RankLibModel.from_string(RF_MODEL)
+    X = np.array([
+        [0.5, 10.0],
+        [0.6, 1.0]
+    ])
+
+    scores = model.predict(X)
+
+    assert model.n_trees == 2
+    np.testing.assert_allclose(scores, [(-1.0 + 1.0) / 2, (3.0 + 2.0) / 2])
+
+
+def test_predict_empty():
+    model = RankLibModel.from_string(MODEL)
+    assert model.predict(np.zeros((0, 2))).size == 0
+
+
+def test_unsupported_model():
+    with pytest.raises(ValueError):
+        RankLibModel.from_string('## Coordinate Ascent\n1:0.5 2:0.3')
+    with pytest.raises(ValueError):
+        RankLibModel.from_string('## Random Forests\n')
+
+
+def test_flattened_trees():
+    model = RankLibModel.from_string(MODEL)
+
+    assert model.n_trees == 2
+    assert model.n_leaves == 5
+    assert model.n_features == 2
+    assert model.depth == 2
+    X = np.random.RandomState(0).rand(10, 2) * 12
+    np.testing.assert_allclose(model.predict(X, chunk_size=3), model.predict(X))
@@ -0,0 +1,57 @@
+import sys
+
+import pytest
+
+from ranklib_runner import (RankLibError, RankLibProgress, RankLibTimeout, build_command,
+                            run_ranklib)
+
+
+def test_build_command():
+    cmd = build_command('6', '/train.txt', '/model.txt', {'tree': '10', 'leaf': '5'},
+                        heap='2g', processors=2)
+    assert cmd == [
+        'java', '-Xmx2g', '-XX:ActiveProcessorCount=2', '-XX:+ExitOnOutOfMemoryError',
+        '-jar', 'ranklib/RankLib-2.14.jar', '-ranker', '6', '-train', '/train.txt',
+        '-norm', 'sum', '-save', '/model.txt', '-tree', '10', '-leaf', '5',
+        '-metric2t', 'ERR'
+    ]
+
+    cmd = build_command('0', '/train.txt', '/model.txt', {}, norm=None, metric='NDCG@10')
+    assert cmd == [
+        'java', '-XX:+ExitOnOutOfMemoryError', '-jar', 'ranklib/RankLib-2.14.jar',
+        '-ranker', '0', '-train', '/train.txt', '-save', '/model.txt',
+        '-metric2t', 'NDCG@10'
+    ]
+
+
+def test_run_ranklib():
+    script = (
+        "print('Training starts...')\n"
+        "print('#iter   | ERR@10-T  | ERR@10-V  |')\n"
+        "print('1       | 0.65      | 0.6       |')\n"
+        "print('2       | 0.68      |           |')\n"
+        "print('ERR@10 on training data: 0.7')\n"
+    )
+    progress = []
+    result = run_ranklib([sys.executable, '-c', script], on_progress=progress.append)
+
+    assert [p[:3] for p in progress] == [(1, 0.65, 0.6), (2, 0.68, None)]
+    assert all(isinstance(p, RankLibProgress) for p in progress)
+    assert result.train_score == 0.7
+    assert result.iterations == 2
+    assert result.seconds > 0
+
+
+def test_run_ranklib_failure():
+    script = "import sys; print('Exception in thread main'); sys.exit(3)"
+    with pytest.raises(RankLibError) as error:
+        run_ranklib([sys.executable, '-c', script])
+    assert error.value.returncode == 3
+    assert 'Exception in thread main' in error.value.output
+
+
+def test_run_ranklib_timeout():
+    script = "import time; print('Training starts...', flush=True); time.sleep(30)"
+    with pytest.raises(RankLibTimeout) as error:
+        run_ranklib([sys.executable, '-c', script], timeout=0.5)
+    assert 'Training starts...' in error.value.output
@@ -0,0 +1,70 @@
+import sys
+
+import pytest
+
+from ranklib_runner import RankLibError
+from ranklib_server import RankLibPool, RankLibServer, ServerResult, build_server_command
+
+
+# Speaks the same protocol as ranklib/RankLibServer.java, saving the options it receives
+# as the model.
+FAKE_SERVER = """
+import sys
+print('ready 3 0.25', flush=True)
+for line in sys.stdin:
+    request = line.split()
+    if request == ['quit']:
+        break
+    if 'leaf=0' in request:
+        print('error Invalid leaf', flush=True)
+        continue
+    with open(request[2], 'w') as f:
+        f.write(' '.join(request[1:2] + request[3:]))
+    print('ok 0.5 0.7', flush=True)
+"""
+
+
+def test_build_server_command():
+    cmd = build_server_command('/train.txt', heap='2g')
+    assert cmd == [
+        'java', '-Xmx2g', '-XX:+ExitOnOutOfMemoryError', '-cp',
+        'ranklib/RankLib-2.14.jar:ranklib', 'RankLibServer', '/train.txt', 'ERR', 'sum'
+    ]
+    cmd = build_server_command('/train.txt', metric='NDCG@10', norm=None)
+    assert cmd[-3:] == ['/train.txt', 'NDCG@10', 'none']
+
+
+def test_ranklib_server(tmpdir):
+    with RankLibServer([sys.executable, '-c', FAKE_SERVER]) as server:
+        assert server.queries == 3
+        assert server.load_seconds == 0.25
+
+        result = server.train('6', {'tree': '10', 'leaf': '5'}, f'{tmpdir}/model.txt')
+        assert result == ServerResult('6 tree=10 leaf=5', 0.7, 0.5)
+
+        with pytest.raises(RankLibError) as error:
+            server.train('6', {'leaf': '0'}, f'{tmpdir}/model.txt')
+        assert error.value.output == 'error Invalid leaf'
+
+        # Server keeps answering after a failed request
+        result = server.train('0', {}, f'{tmpdir}/model.txt')
+        assert result.model == '0'
+    assert server.process.returncode == 0
+
+
+def test_ranklib_server_exits():
+    with pytest.raises(RankLibError) as error:
+        RankLibServer([sys.executable, '-c', 'import sys; sys.exit(2)'])
+    assert error.value.returncode == 2
+
+
+def test_ranklib_pool(tmpdir):
+    param_sets = [{'tree': str(trees)} for trees in range(5)]
+    with RankLibPool([sys.executable, '-c', FAKE_SERVER], workers=2) as pool:
+        processes = [server.process for server in list(pool.servers.queue)]
+        results = pool.sweep('6', param_sets, str(tmpdir))
+
+    assert [result.model for result in results] == [f'6 tree={t}' for t in range(5)]
+    assert open(f'{tmpdir}/model_3.txt').read() == '6 tree=3'
+    assert len(processes) == 2
+    assert all(process.returncode == 0 for process in processes)
@@ -0,0 +1,140 @@
+import json
+import shutil
+
+import mock
+import pytest
+
+from ranklib_model import RankLibModel
+from replay import get_capture_template, get_replay_store, replay_metrics, replay_rank
+from validate import validate_model
+
+
+MODEL = """## LambdaMART
+<ensemble>
+    <tree id="1" weight="1.0">
+        <split>
+            <feature> 1 </feature>
+            <threshold> 0.5 </threshold>
+            <split pos="left">
+                <output> 0.0 </output>
+            </split>
+            <split pos="right">
+                <output> 10.0 </output>
+            </split>
+        </split>
+    </tree>
+</ensemble>
+"""
+
+
+@pytest.fixture
+def es_capture():
+    # Every search retrieves the same documents, doc0 being the only one whose first
+    # feature is above the threshold of the model.
+    def msearch(body, request_timeout):
+        hits = [
+            {
+                '_id': f'doc{idx}',
+                '_score': float(idx + 1),
+                'fields': {
+                    '_ltrlog': [{'main': [{'name': 'f1', 'value': float(idx == 0)},
+                                          {'name': 'f2'}]}]
+                }
+            }
+            for idx in [3, 2, 1, 0]
+        ]
+        searches = body.split('\n')[1::2]
+        return {'responses': [{'hits': {'hits': hits}} for _ in searches]}
+
+    es_client = mock.Mock()
+    es_client.msearch.side_effect = msearch
+    es_client.transport.perform_request.return_value = {
+        '_source': {'featureset': {'features': [{'name': 'f1'}, {'name': 'f2'}]}}
+    }
+    return es_client
+
+
+def test_get_capture_template():
+    template, rescore = get_capture_template('unittest', 2)
+    query = json.loads(template.render(size=2, search_keys={'search_term': 'query0'}))
+
+    assert query['rescore']['window_size'] == 2
+    assert query['rescore']['query']['rescore_query']['sltr']['featureset'] == 'unittest'
+    # sltr isn't part of the main query so it must be logged from its rescore.
+    assert 'sltr' not in json.dumps(query['query'])
+    log_spec = query['ext']['ltr_log']['log_specs']
+    assert log_spec == {'name': 'main', 'rescore_index': 0}
+    assert 'named_query' not in log_spec
+    assert set(rescore) == {'query_weight', 'rescore_query_weight', 'score_mode'}
+
+
+def test_get_replay_store_renders_search_term(es_capture, tmpdir_factory):
+    files_path = str(tmpdir_factory.mktemp('unittest'))
+    shutil.copy('tests/fixtures/validation.gz', files_path)
+
+    # Unlike the one of unittest, the query of lambdamart0 matches the search term.
+    get_replay_store(files_path, es_capture, 'lambdamart0', 'index_test', 2)
+
+    body = es_capture.msearch.call_args_list[0][1]['body'].split('\n')
+    query = json.loads(body[1])
+    assert 'query0' in json.dumps(query['query'])
+    assert '{query}' not in body[1]
+
+
+def test_replay_rank(es_capture, tmpdir_factory):
+    files_path = str(tmpdir_factory.mktemp('unittest'))
+    shutil.copy('tests/fixtures/validation.gz', files_path)
+    model = RankLibModel.from_string(MODEL)
+
+    path = get_replay_store(files_path, es_capture, 'unittest', 'index_test', 2)
+
+    assert es_capture.msearch.call_count == 2
+    body = es_capture.msearch.call_args_list[0][1]['body'].split('\n')
+    assert json.loads(body[0]) == {'index': 'index_test'}
+    query = json.loads(body[1])
+    assert query['size'] == 2
+    sltr = query['rescore']['query']['rescore_query']['sltr']
+    assert sltr['params'] == {'search_term': 'query0', 'brand': 'b0'}
+    assert query['rescore']['query']['rescore_query_weight'] == 0
+
+    # doc0 goes from last to first so purchases of doc1 and doc2 fall one position.
+    assert replay_rank(path, model, chunk_size=2) == pytest.approx(2 / 3)
+
+    # Only doc3 and doc2 are rescored so the first-stage order is kept.
+    path = get_replay_store(files_path, es_capture, 'unittest', 'index_test', 2,
+                            window_size=2)
+    assert replay_rank(path, model) == pytest.approx(0.6)
+    metrics = replay_metrics(path, model)
+    assert metrics['rank'] == pytest.approx(0.6)
+    assert set(metrics) == {'rank', 'ndcg_10', 'mrr', 'err_10', 'precision_10'}
+
+    # Capture is reused if settings are the same.
+    es_capture.msearch.reset_mock()
+    get_replay_store(files_path, es_capture, 'unittest', 'index_test', 2,
+                     window_size=2)
+    es_capture.msearch.assert_not_called()
+    es_capture.transport.perform_request.assert_called_with(
+        'GET', '/_ltr/_featureset/unittest'
+    )
+
+    # Changing the featureset captures the searches again.
+    es_capture.transport.perform_request.return_value = {
+        '_source': {'featureset': {'features': [{'name': 'f1'}, {'name': 'f3'}]}}
+    }
+    get_replay_store(files_path, es_capture, 'unittest', 'index_test', 2,
+                     window_size=2)
+    assert es_capture.msearch.call_count == 2
+
+
+def test_validate_model_replay(monkeypatch, es_capture, tmpdir_factory):
+    files_path = str(tmpdir_factory.mktemp('unittest'))
+    shutil.copy('tests/fixtures/validation.gz', files_path)
+    model_path = f'{files_path}/model.txt'
+    with open(model_path, 'w') as f:
+        f.write(MODEL)
+    monkeypatch.setattr('validate.Elasticsearch', mock.Mock(return_value=es_capture))
+
+    rank = validate_model(files_path, 'es_host_test', 'unittest', 'index_test', 2,
+                          replay=True, model_path=model_path)
+
+    assert rank == pytest.approx(2 / 3)
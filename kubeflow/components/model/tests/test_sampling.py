@@ -0,0 +1,77 @@
+import os
+import gzip
+import json
+
+import pytest
+
+from sampling import (Sample, build_sample, estimate_rank, get_query_key,
+                      get_sample_path, load_sample)
+
+
+@pytest.fixture
+def validation_file(tmpdir_factory):
+    file_ = str(tmpdir_factory.mktemp('unittest') / 'validation.gz')
+    # query0 is searched 4 times, query5 twice and the others just once.
+    terms = ['query0'] * 4 + ['query1', 'query2', 'query3', 'query4'] + ['query5'] * 2
+    with gzip.GzipFile(file_, 'w') as f:
+        for term in terms:
+            row = {'search_keys': {'search_term': term}, 'docs': []}
+            f.write(f'{json.dumps(row)}\n'.encode())
+    return file_
+
+
+def test_build_sample(validation_file):
+    sample = build_sample([validation_file], 0.5, seed=1)
+
+    tail = [key for key, stratum in sample.strata.items() if stratum == 0]
+    assert len(tail) == 2
+    assert sample.strata[get_query_key({'search_term': 'query5'})] == 1
+    assert sample.strata[get_query_key({'search_term': 'query0'})] == 2
+    assert sample.weights == {0: 2, 1: 1, 2: 1}
+    assert build_sample([validation_file], 0.5, seed=1) == sample
+
+    samples = {tuple(sorted(build_sample([validation_file], 0.5, seed).strata))
+               for seed in range(10)}
+    assert len(samples) > 1
+
+    assert len(build_sample([validation_file], 1, seed=1).strata) == 6
+
+
+def test_load_sample(monkeypatch, validation_file):
+    sample = load_sample([validation_file], 0.5, seed=1)
+    assert sample == build_sample([validation_file], 0.5, seed=1)
+    assert os.path.isfile(get_sample_path([validation_file], 0.5, 1))
+
+    def fail(*args):
+        raise AssertionError('sample should be read from disk')
+
+    monkeypatch.setattr('sampling.build_sample', fail)
+    assert load_sample([validation_file], 0.5, seed=1) == sample
+    with pytest.raises(AssertionError):
+        load_sample([validation_file], 0.5, seed=2)
+    monkeypatch.undo()
+
+    # Changing the files builds the sample again.
+    assert len(load_sample([validation_file], 1, seed=1).strata) == 6
+    with gzip.GzipFile(validation_file, 'a') as f:
+        f.write(f'{json.dumps({"search_keys": {"search_term": "query6"}})}\n'.encode())
+    sample = load_sample([validation_file], 1, seed=1)
+    assert get_query_key({'search_term': 'query6'}) in sample.strata
+    assert load_sample([validation_file], 1, seed=1) == sample
+
+
+def test_estimate_rank():
+    sample = Sample({'q0': 0, 'q1': 0, 'q2': 1}, {0: 2, 1: 1})
+    query_ranks = {'q0': (0.5, 1), 'q1': (1.0, 2), 'q2': (0.9, 1)}
+
+    rank, low, high = estimate_rank(query_ranks, sample)
+
+    assert rank == pytest.approx((2 * 1.5 + 0.9) / (2 * 3 + 1))
+    assert low <= rank <= high
+    assert 0.5 <= low and high <= 0.9
+    assert estimate_rank(query_ranks, sample) == (rank, low, high)
+
+
+def test_estimate_rank_without_purchases():
+    sample = Sample({'q0': 0}, {0: 1})
+    assert estimate_rank({}, sample) == (0.5, 0.5, 0.5)
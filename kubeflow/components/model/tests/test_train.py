@@ -1,14 +1,19 @@
 import mock
+import pytest
 import os
 # from shutil import rmtree
 from collections import namedtuple
 
-from train import main
+from early_stopping import EarlyStop
+from sampling import RankEstimate
+from ranklib_model import RankLibModel
+from ranklib_runner import RankLibResult
+from train import main, parse_ranklib_args, print_progress
 
 
-def test_train_model(monkeypatch, tmpdir_factory):
+def test_train_model(monkeypatch, tmpdir_factory, capsys):
     post_mock = mock.Mock()
-    os_system_mock = mock.Mock()
+    run_ranklib_mock = mock.Mock(return_value=RankLibResult(0.7, 10, 1.0))
 
     tmp_folder = tmpdir_factory.mktemp('unittest')
 
@@ -17,25 +22,22 @@ def test_train_model(monkeypatch, tmpdir_factory):
         with open(f'{tmp_folder}/model.txt', 'w') as f:
             f.write(f'model definition: {context}')
 
-    os_system_mock.return_value = write_file(str(tmp_folder), 1)
+    write_file(str(tmp_folder), 1)
 
     datetime_mock = mock.Mock()
     datetime_mock.today.return_value.strftime.return_value = 'todays date'
 
-    partial_mock = mock.Mock()
-    partial_mock.return_value = 'partial function'
-
-    pool_mock = mock.Mock()
-    pool_mock.return_value.map.side_effect = [
-        [0.3, 0.2],
-        [0.2, 0.1],
-        [0.4, 0.3]
+    service_mock = mock.MagicMock()
+    service = service_mock.return_value.__enter__.return_value
+    service.evaluate.side_effect = [
+        [{'rank': 0.3, 'mrr': 0.5}, {'rank': 0.2, 'mrr': 0.6}],
+        [{'rank': 0.2, 'mrr': 0.4}, {'rank': 0.1, 'mrr': 0.7}],
+        [{'rank': 0.4, 'mrr': 0.6}, {'rank': 0.3, 'mrr': 0.5}]
     ]
 
     monkeypatch.setattr('train.post_model_to_elasticsearch', post_mock)
-    monkeypatch.setattr('train.os.system', os_system_mock)
-    monkeypatch.setattr('train.get_partiated_validator', partial_mock)
-    monkeypatch.setattr('train.Pool', pool_mock)
+    monkeypatch.setattr('train.run_ranklib', run_ranklib_mock)
+    monkeypatch.setattr('train.EvaluationService', service_mock)
     monkeypatch.setattr('train.datetime', datetime_mock)
 
     args = namedtuple(
@@ -46,10 +48,22 @@ def test_train_model(monkeypatch, tmpdir_factory):
             'validation_train_files_path',
             'es_host',
             'model_name',
-            'es_batch'
+            'es_batch',
+            'es_target_latency',
+            'validation_replay',
+            'validation_workers',
             'destination',
             'ranker',
-            'index'
+            'index',
+            'objective',
+            'validation_sample',
+            'validation_confidence',
+            'validation_early_stop',
+            'validation_early_stop_searches',
+            'trainer',
+            'ranklib_heap',
+            'ranklib_processors',
+            'train_timeout'
         ]
     )
     args.train_file_path = '/test/train_dataset.txt'
@@ -58,22 +72,41 @@ def test_train_model(monkeypatch, tmpdir_factory):
     args.es_host = 'es_host_test'
     args.model_name = 'unittest'
     args.es_batch = 2
+    args.es_target_latency = None
+    args.validation_replay = False
+    args.validation_workers = 2
     args.destination = str(tmp_folder)
     args.ranker = 'lambdamart'
     args.index = 'index_test'
+    args.objective = 'rank'
+    args.trainer = 'ranklib'
+    args.ranklib_heap = '1g'
+    args.ranklib_processors = None
+    args.train_timeout = 60
+    args.validation_sample = 0
+    args.validation_confidence = 0.95
+    args.validation_early_stop = 0
+    args.validation_early_stop_searches = 1000
 
     X = ['--var1 val1 --var2 val2']
 
     main(args, X)
-    expected_call = (
-        'java -jar ranklib/RankLib-2.14.jar -ranker 6 -train '
-        f'/test/train_dataset.txt -norm sum -save {str(tmp_folder)}/model.txt '
-        '-var1 val1 -var2 val2 -metric2t ERR'
-    )
-    os_system_mock.assert_any_call(expected_call)
+    expected_call = [
+        'java', '-Xmx1g', '-XX:+ExitOnOutOfMemoryError', '-jar',
+        'ranklib/RankLib-2.14.jar', '-ranker', '6', '-train', '/test/train_dataset.txt',
+        '-norm', 'sum', '-save', f'{str(tmp_folder)}/model.txt', '-var1', 'val1',
+        '-var2', 'val2', '-metric2t', 'ERR'
+    ]
+    run_ranklib_mock.assert_any_call(expected_call, 60, print_progress)
     post_mock.assert_any_call('es_host_test', 'unittest',
                               f'{args.destination}/model.txt')
-    partial_mock.assert_any_call('es_host_test', 'index_test', 'unittest', 2)
+    service_mock.assert_any_call('es_host_test', 'unittest', 'index_test', 2, None, 2)
+    service.evaluate.assert_any_call('/validation/regular', '/validation/train',
+                                     replay=False,
+                                     model_path=f'{args.destination}/model.txt',
+                                     monitor=None)
+    service_mock.return_value.__exit__.assert_called()
+    assert 'Validation-rank=0.3\nValidation-mrr=0.5\n' in capsys.readouterr().out
     data = open(f'{args.destination}/results.txt').read()
     assert data == 'todays date,--var1 val1 --var2 val2,rank_train=0.2,rank_val=0.3\n'
     data = open(f'{args.destination}/best_rank.txt').read()
@@ -82,7 +115,7 @@ def test_train_model(monkeypatch, tmpdir_factory):
     assert data == 'model definition: 1'
 
     # Test if new best model gets replaced
-    os_system_mock.return_value = write_file(str(tmp_folder), 2)
+    write_file(str(tmp_folder), 2)
     main(args, X)
     data = open(f'{args.destination}/results.txt').read()
     assert data == (
@@ -95,7 +128,7 @@ def test_train_model(monkeypatch, tmpdir_factory):
     assert data == 'model definition: 2'
 
     # Test if new worse model is ignored
-    os_system_mock.return_value = write_file(str(tmp_folder), 3)
+    write_file(str(tmp_folder), 3)
     main(args, X)
     data = open(f'{args.destination}/results.txt').read()
     assert data == (
@@ -107,3 +140,233 @@ def test_train_model(monkeypatch, tmpdir_factory):
     assert data == '0.2'
     data = open(f'{args.destination}/best_model.txt').read()
     assert data == 'model definition: 2'
+
+
+def test_train_model_maximized_objective(monkeypatch, tmpdir_factory):
+    tmp_folder = str(tmpdir_factory.mktemp('unittest'))
+    model_versions = iter(range(1, 4))
+
+    def write_file(*args):
+        with open(f'{tmp_folder}/model.txt', 'w') as f:
+            f.write(f'model definition: {next(model_versions)}')
+        return RankLibResult(0.7, 10, 1.0)
+
+    service_mock = mock.MagicMock()
+    service = service_mock.return_value.__enter__.return_value
+    service.evaluate.side_effect = [
+        [{'rank': 0.3, 'mrr': 0.5}, {'rank': 0.2, 'mrr': 0.6}],
+        [{'rank': 0.4, 'mrr': 0.4}, {'rank': 0.1, 'mrr': 0.7}],
+        [{'rank': 0.4, 'mrr': 0.6}, {'rank': 0.3, 'mrr': 0.5}]
+    ]
+    datetime_mock = mock.Mock()
+    datetime_mock.today.return_value.strftime.return_value = 'todays date'
+
+    monkeypatch.setattr('train.post_model_to_elasticsearch', mock.Mock())
+    monkeypatch.setattr('train.run_ranklib', write_file)
+    monkeypatch.setattr('train.EvaluationService', service_mock)
+    monkeypatch.setattr('train.datetime', datetime_mock)
+
+    args = namedtuple('args', [])
+    args.train_file_path = '/test/train_dataset.txt'
+    args.validation_files_path = '/validation/regular'
+    args.validation_train_files_path = '/validation/train'
+    args.es_host = 'es_host_test'
+    args.model_name = 'unittest'
+    args.es_batch = 2
+    args.es_target_latency = None
+    args.validation_replay = False
+    args.validation_workers = 2
+    args.destination = tmp_folder
+    args.ranker = 'lambdamart'
+    args.index = 'index_test'
+    args.objective = 'mrr'
+    args.trainer = 'ranklib'
+    args.ranklib_heap = None
+    args.ranklib_processors = None
+    args.train_timeout = None
+    args.validation_sample = 0
+    args.validation_confidence = 0.95
+    args.validation_early_stop = 0
+    args.validation_early_stop_searches = 1000
+
+    for _ in range(3):
+        main(args, ['--var1 val1'])
+
+    data = open(f'{tmp_folder}/results.txt').read()
+    assert data == (
+        'todays date,--var1 val1,mrr_train=0.6,mrr_val=0.5\n'
+        'todays date,--var1 val1,mrr_train=0.7,mrr_val=0.4\n'
+        'todays date,--var1 val1,mrr_train=0.5,mrr_val=0.6\n'
+    )
+    assert open(f'{tmp_folder}/best_rank.txt').read() == '0.6'
+    assert open(f'{tmp_folder}/best_model.txt').read() == 'model definition: 3'
+
+
+@pytest.mark.parametrize('low, validated', [(0.35, False), (0.25, True)])
+def test_train_model_sampled_validation(monkeypatch, tmpdir_factory, low, validated):
+    tmp_folder = str(tmpdir_factory.mktemp('unittest'))
+    with open(f'{tmp_folder}/model.txt', 'w') as f:
+        f.write('model definition')
+    with open(f'{tmp_folder}/best_rank.txt', 'w') as f:
+        f.write('0.3')
+
+    service_mock = mock.MagicMock()
+    service = service_mock.return_value.__enter__.return_value
+    service.estimate.return_value = [RankEstimate(0.4, low, 0.45, 10),
+                                     RankEstimate(0.2, 0.1, 0.3, 10)]
+    service.evaluate.return_value = [{'rank': 0.35}, {'rank': 0.25}]
+    datetime_mock = mock.Mock()
+    datetime_mock.today.return_value.strftime.return_value = 'todays date'
+
+    monkeypatch.setattr('train.post_model_to_elasticsearch', mock.Mock())
+    monkeypatch.setattr('train.run_ranklib',
+                        mock.Mock(return_value=RankLibResult(0.7, 10, 1.0)))
+    monkeypatch.setattr('train.EvaluationService', service_mock)
+    monkeypatch.setattr('train.datetime', datetime_mock)
+
+    args = namedtuple('args', [])
+    args.train_file_path = '/test/train_dataset.txt'
+    args.validation_files_path = '/validation/regular'
+    args.validation_train_files_path = '/validation/train'
+    args.es_host = 'es_host_test'
+    args.model_name = 'unittest'
+    args.es_batch = 2
+    args.es_target_latency = None
+    args.validation_replay = False
+    args.validation_workers = 2
+    args.destination = tmp_folder
+    args.ranker = 'lambdamart'
+    args.index = 'index_test'
+    args.objective = 'rank'
+    args.trainer = 'ranklib'
+    args.ranklib_heap = None
+    args.ranklib_processors = None
+    args.train_timeout = None
+    args.validation_sample = 0.1
+    args.validation_confidence = 0.9
+    args.validation_early_stop = 0
+    args.validation_early_stop_searches = 1000
+
+    main(args, ['--var1 val1'])
+
+    service.estimate.assert_called_once_with('/validation/regular', '/validation/train',
+                                             rate=0.1, confidence=0.9)
+    assert service.evaluate.called == validated
+    expected = 'rank_train=0.25,rank_val=0.35' if validated else \
+        'rank_train=0.2,rank_val=0.4'
+    data = open(f'{tmp_folder}/results.txt').read()
+    assert data == f'todays date,--var1 val1,{expected}\n'
+    assert open(f'{tmp_folder}/best_rank.txt').read() == '0.3'
+
+
+def test_train_model_early_stop(monkeypatch, tmpdir_factory, capsys):
+    tmp_folder = str(tmpdir_factory.mktemp('unittest'))
+    with open(f'{tmp_folder}/model.txt', 'w') as f:
+        f.write('model definition')
+    with open(f'{tmp_folder}/best_rank.txt', 'w') as f:
+        f.write('0.3')
+
+    service_mock = mock.MagicMock()
+    service = service_mock.return_value.__enter__.return_value
+    service.evaluate.side_effect = EarlyStop(0.45, 0.35, 1000)
+    service_mock.return_value.__exit__.return_value = False
+    datetime_mock = mock.Mock()
+    datetime_mock.today.return_value.strftime.return_value = 'todays date'
+
+    monkeypatch.setattr('train.post_model_to_elasticsearch', mock.Mock())
+    monkeypatch.setattr('train.run_ranklib',
+                        mock.Mock(return_value=RankLibResult(0.7, 10, 1.0)))
+    monkeypatch.setattr('train.EvaluationService', service_mock)
+    monkeypatch.setattr('train.datetime', datetime_mock)
+
+    args = namedtuple('args', [])
+    args.train_file_path = '/test/train_dataset.txt'
+    args.validation_files_path = '/validation/regular'
+    args.validation_train_files_path = '/validation/train'
+    args.es_host = 'es_host_test'
+    args.model_name = 'unittest'
+    args.es_batch = 2
+    args.es_target_latency = None
+    args.validation_replay = False
+    args.validation_workers = 2
+    args.destination = tmp_folder
+    args.ranker = 'lambdamart'
+    args.index = 'index_test'
+    args.objective = 'rank'
+    args.trainer = 'ranklib'
+    args.ranklib_heap = None
+    args.ranklib_processors = None
+    args.train_timeout = None
+    args.validation_sample = 0
+    args.validation_confidence = 0.95
+    args.validation_early_stop = 2
+    args.validation_early_stop_searches = 500
+
+    main(args, ['--var1 val1'])
+
+    monitor = service.evaluate.call_args[1]['monitor']
+    assert (monitor.best_rank, monitor.sigmas, monitor.min_searches) == (0.3, 2, 500)
+    assert 'Validation-rank=0.45\n' in capsys.readouterr().out
+    data = open(f'{tmp_folder}/results.txt').read()
+    assert data == 'todays date,--var1 val1,rank_train=nan,rank_val=0.45\n'
+    assert open(f'{tmp_folder}/best_rank.txt').read() == '0.3'
+
+
+def test_train_model_native(monkeypatch, tmpdir_factory):
+    tmp_folder = str(tmpdir_factory.mktemp('unittest'))
+    with open(f'{tmp_folder}/train_dataset.txt', 'w') as f:
+        for qid in range(5):
+            for doc in range(4):
+                f.write(f'{doc % 3}\tqid:{qid}\t1:{doc}\t2:{qid}\n')
+
+    service_mock = mock.MagicMock()
+    service = service_mock.return_value.__enter__.return_value
+    service.evaluate.return_value = [{'rank': 0.3}, {'rank': 0.2}]
+    post_mock = mock.Mock()
+    run_ranklib_mock = mock.Mock()
+    monkeypatch.setattr('train.post_model_to_elasticsearch', post_mock)
+    monkeypatch.setattr('train.run_ranklib', run_ranklib_mock)
+    monkeypatch.setattr('train.EvaluationService', service_mock)
+
+    args = namedtuple('args', [])
+    args.train_file_path = f'{tmp_folder}/train_dataset.txt'
+    args.validation_files_path = '/validation/regular'
+    args.validation_train_files_path = '/validation/train'
+    args.es_host = 'es_host_test'
+    args.model_name = 'unittest'
+    args.es_batch = 2
+    args.es_target_latency = None
+    args.validation_replay = False
+    args.validation_workers = 2
+    args.destination = tmp_folder
+    args.ranker = 'lambdamart'
+    args.index = 'index_test'
+    args.objective = 'rank'
+    args.validation_sample = 0
+    args.validation_confidence = 0.95
+    args.validation_early_stop = 0
+    args.validation_early_stop_searches = 1000
+    args.trainer = 'native'
+    args.ranklib_heap = None
+    args.ranklib_processors = None
+    args.train_timeout = None
+
+    main(args, ['--tree=3', '--leaf=2', '--shrinkage=0.5'])
+
+    run_ranklib_mock.assert_not_called()
+    post_mock.assert_called_once_with('es_host_test', 'unittest',
+                                      f'{tmp_folder}/model.txt')
+    assert os.path.isfile(f'{tmp_folder}/train_dataset.txt.matrix/meta.json')
+    model = RankLibModel.from_file(f'{tmp_folder}/model.txt')
+    assert model.n_trees == 3
+    assert model.n_leaves == 6
+    assert open(f'{tmp_folder}/best_rank.txt').read() == '0.3'
+
+    args.ranker = 'mart'
+    with pytest.raises(ValueError):
+        main(args, [])
+
+
+def test_parse_ranklib_args():
+    assert parse_ranklib_args(['--tree=100', '--leaf 10 --tc -1']) == {
+        'tree': '100', 'leaf': '10', 'tc': '-1'}
@@ -0,0 +1,55 @@
+import os
+
+import mock
+import numpy as np
+import pytest
+
+from train_matrix import build_train_matrix, get_matrix_path, load_train_matrix
+
+
+@pytest.fixture
+def train_file_path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('unittest') / 'train_dataset.txt')
+    with open(path, 'w') as f:
+        f.write('4\tqid:1\t1:1\t2:2\n'
+                '0\tqid:1\t1:3\t2:2\n'
+                '1\tqid:2\t1:5\t2:0\n')
+    return path
+
+
+def test_load_train_matrix(train_file_path):
+    data = load_train_matrix(train_file_path)
+
+    assert isinstance(data.X, np.memmap)
+    assert not data.X.flags.writeable
+    np.testing.assert_array_equal(data.X, [[1, 2], [3, 2], [5, 0]])
+    np.testing.assert_array_equal(data.y, [4, 0, 1])
+    np.testing.assert_array_equal(data.offsets, [0, 2, 3])
+
+    data = load_train_matrix(train_file_path, 'sum')
+    np.testing.assert_allclose(data.X, [[0.25, 0.5], [0.75, 0.5], [1, 0]])
+
+    with pytest.raises(ValueError):
+        load_train_matrix(train_file_path, 'zscore')
+
+
+def test_build_train_matrix(monkeypatch, train_file_path):
+    path = build_train_matrix(train_file_path)
+    assert path == get_matrix_path(train_file_path)
+    # Temporary folders are removed.
+    assert sorted(os.listdir(os.path.dirname(path))) == ['train_dataset.txt',
+                                                         'train_dataset.txt.matrix']
+
+    load_mock = mock.Mock()
+    monkeypatch.setattr('train_matrix.load_ranklib_file', load_mock)
+    build_train_matrix(train_file_path)
+    # Same content with a new modification time is still current.
+    os.utime(train_file_path, (1, 1))
+    build_train_matrix(train_file_path)
+    load_mock.assert_not_called()
+
+    monkeypatch.undo()
+    with open(train_file_path, 'a') as f:
+        f.write('2\tqid:3\t1:1\t2:1\n')
+    data = load_train_matrix(train_file_path)
+    np.testing.assert_array_equal(data.offsets, [0, 2, 3, 4])
@@ -1,7 +1,13 @@
 import mock
+import json
+import shutil
 from collections import namedtuple
 
-from validate import validate_model
+import numpy as np
+import pytest
+
+from query_results import load_query_results
+from validate import validate_model, validate_file, init_worker, get_es_query
 
 
 def test_validate_model(monkeypatch, es_response):
@@ -34,3 +40,81 @@ def test_validate_model(monkeypatch, es_response):
         args.es_batch
     )
     assert rank == 0.6
+
+
+def msearch(body, request_timeout):
+    hits = [{'_id': f'doc{idx}'} for idx in [3, 2, 1, 0]]
+    return {'responses': [{'hits': {'hits': hits}} for _ in body.split('\n')[1::2]]}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_validate_model_shards(monkeypatch, tmpdir_factory, capsys, workers):
+    files_path = str(tmpdir_factory.mktemp('unittest'))
+    for shard in range(3):
+        shutil.copy('tests/fixtures/validation.gz', f'{files_path}/validation{shard}.gz')
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+
+    rank = validate_model(files_path, 'es_host_test', 'unittest', 'index_test', 2,
+                          workers=workers)
+
+    assert rank == pytest.approx(0.6)
+    # Every shard is validated, not just the first one.
+    assert 'validated 9 searches from 3 files' in capsys.readouterr().out
+
+
+def test_validate_model_export(monkeypatch, tmpdir_factory):
+    files_path = str(tmpdir_factory.mktemp('unittest'))
+    export_path = f'{files_path}/export'
+    for shard in range(2):
+        shutil.copy('tests/fixtures/validation.gz', f'{files_path}/validation{shard}.gz')
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+
+    rank = validate_model(files_path, 'es_host_test', 'unittest', 'index_test', 2,
+                          export_path=export_path)
+
+    assert rank == pytest.approx(0.6)
+    # Results come from the same responses used for the rank.
+    assert es_mock.return_value.msearch.call_count == 4
+    results = load_query_results(export_path)
+    assert list(results.query) == ['query0', 'query1', 'query2'] * 2
+    np.testing.assert_allclose(results.rank, [2 / 3, 2 / 3, 1 / 3] * 2)
+
+
+def test_validate_file(monkeypatch):
+    es_mock = mock.Mock()
+    es_mock.return_value.msearch.side_effect = msearch
+    monkeypatch.setattr('validate.Elasticsearch', es_mock)
+    init_worker('es_host_test')
+
+    result = validate_file('tests/fixtures/validation.gz', 'unittest', 'index_test', 2)
+
+    assert result.file == 'tests/fixtures/validation.gz'
+    assert result.rank_num == pytest.approx(3)
+    assert result.rank_den == 5
+    assert result.searches == 3
+    assert es_mock.return_value.msearch.call_count == 2
+
+
+def test_get_es_query():
+    search_keys = {'search_term': 'keyword', 'channel_group': 'organic'}
+    expected = json.loads(
+        open('queries/lambdamart0/es_query.json').read().replace('{query}', 'keyword')
+    )
+    expected['_source'] = '_id'
+    expected['size'] = 2
+    expected['rescore']['window_size'] = 50
+    expected['rescore']['query']['rescore_query']['sltr']['params'] = search_keys
+    expected['rescore']['query']['rescore_query']['sltr']['model'] = 'lambdamart0'
+
+    assert get_es_query(search_keys, 'lambdamart0', 2) == json.dumps(expected)
+
+    search_keys = {'search_term': 'tv 42"', 'channel_group': 'organic'}
+    query = json.loads(get_es_query(search_keys, 'lambdamart0', 2))
+    multi_match = query['query']['function_score']['query']['bool']['must']['bool'][
+        'should'][0]['multi_match']
+    assert multi_match['query'] == 'tv 42"'
+    assert query['rescore']['query']['rescore_query']['sltr']['params'] == search_keys
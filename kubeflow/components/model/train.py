@@ -3,14 +3,17 @@ import os
 import argparse
 import pathlib
 from datetime import datetime
-from typing import NamedTuple, Sequence
-from functools import partial
-from multiprocessing import Pool
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
 from shutil import copyfile
 
 import requests
 
-from validate import validate_model
+from early_stopping import EarlyStop, RankMonitor
+from evaluation import EvaluationService
+from lambdamart import LambdaMART
+from metrics import get_metric_names, is_minimized
+from ranklib_runner import RankLibProgress, build_command, run_ranklib
+from train_matrix import load_train_matrix
 
 
 def main(args: NamedTuple, X: Sequence[str]) -> None:
@@ -35,33 +38,160 @@ def main(args: NamedTuple, X: Sequence[str]) -> None:
             RankLib featureset Model Name as saved in Elasticsearch.
         destination: str
             File name where to save results.
+        validation_replay: bool
+            If `True` then trials rescore captured validation searches locally.
+        validation_workers: Optional[int]
+            Maximum number of processes validating files concurrently.
+        objective: str
+            Metric that selects the best model, see `metrics.py`.
+        validation_sample: float
+            If greater than 0 then the rank is first estimated over this fraction of
+            validation queries and the full sets are validated only if the model may
+            beat the best one so far.
+        validation_confidence: float
+            Confidence level of the interval of the estimated rank.
+        validation_early_stop: float
+            If greater than 0 then validation stops as soon as the rank minus this many
+            standard errors is above the best rank so far.
+        validation_early_stop_searches: int
+            Minimum number of searches of a file validated before stopping it.
+        trainer: str
+            Either "ranklib", which runs the RankLib jar, or "native" for the NumPy
+            implementation of LambdaMART.
+        ranklib_heap: Optional[str]
+            Maximum heap size of the JVM running RankLib, such as "4g".
+        ranklib_processors: Optional[int]
+            How many processors the JVM running RankLib sees.
+        train_timeout: Optional[float]
+            Seconds RankLib may train before being killed.
 
       X: Sequence[str]
           Values for input of RankLib parameters.
     """
+    trainer = TRAINERS.get(args.trainer)
+    if not trainer:
+        raise ValueError(f'Invalid value for trainer: "{args.trainer}"')
+    # {args.destination}/model.txt contains the specification of the
+    # final trained model
+    trainer(args, X)
+    post_model_to_elasticsearch(args.es_host, args.model_name,
+                                f'{args.destination}/model.txt')
+    monitor = None
+    best_rank = read_best_rank(args.destination)
+    if args.validation_early_stop and best_rank is not None:
+        if args.objective != 'rank':
+            raise ValueError('Early stopping only supports the rank objective.')
+        monitor = RankMonitor(best_rank, args.validation_early_stop,
+                              args.validation_early_stop_searches)
+    try:
+        with EvaluationService(args.es_host, args.model_name, args.index,
+                               args.es_batch, args.es_target_latency,
+                               args.validation_workers) as service:
+            estimates = None
+            if args.validation_sample:
+                estimates = estimate_metrics(service, args)
+            if estimates:
+                metrics_val, metrics_train = estimates
+            else:
+                metrics_val, metrics_train = service.evaluate(
+                    args.validation_files_path,
+                    args.validation_train_files_path,
+                    replay=args.validation_replay,
+                    model_path=f'{args.destination}/model.txt',
+                    monitor=monitor
+                )
+    except EarlyStop as stop:
+        print(f'Validation stopped early: {stop}')
+        # Files still being validated, including training ones, are discarded.
+        metrics_val, metrics_train = {'rank': stop.rank}, {'rank': float('nan')}
+
+    # Kabit tracks down the StdOut searching for strings such as 'Validation-rank=value'
+    for name, value in metrics_val.items():
+        print(f'Validation-{name}={value}')
+    write_results(X, metrics_train[args.objective], metrics_val[args.objective],
+                  args.destination, args.model_name, args.objective)
+
+
+def train_ranklib(args: NamedTuple, X: Sequence[str]) -> None:
+    """
+    Trains the model with the RankLib jar, raising `ranklib_runner.RankLibError` if
+    it fails or runs out of time.
+    """
     ranker = get_ranker_index(args.ranker)
     if not ranker:
         raise ValueError(f'Invalid value for ranker: "{args.ranker}"')
 
-    cmd = ('java -jar ranklib/RankLib-2.14.jar -ranker '
-           f'{ranker} -train {args.train_file_path} -norm sum -save '
-           f'{args.destination}/model.txt '
-           f'{(" ".join(X)).replace("--", "-").replace("=", " ")} -metric2t ERR')
+    cmd = build_command(ranker, args.train_file_path, f'{args.destination}/model.txt',
+                        parse_ranklib_args(X), args.ranklib_heap,
+                        args.ranklib_processors)
+    result = run_ranklib(cmd, args.train_timeout, print_progress)
+    print(f'RankLib trained {result.iterations} iterations in {result.seconds:.1f}s, '
+          f'train score={result.train_score}')
+
+
+def print_progress(progress: RankLibProgress) -> None:
+    print(f'RankLib-iteration={progress.iteration} '
+          f'RankLib-train={progress.train_score} '
+          f'RankLib-validation={progress.validation_score} '
+          f'RankLib-seconds={progress.seconds:.1f}')
 
-    # {args.destination}/model.txt contains the specification of the
-    # final trained model
-    os.system(cmd)
-    post_model_to_elasticsearch(args.es_host, args.model_name,
-                                f'{args.destination}/model.txt')
-    partiated_validator = get_partiated_validator(args.es_host, args.index,
-                                                  args.model_name, args.es_batch)
-    pool = Pool()
-    rank_val, rank_train = pool.map(partiated_validator, [args.validation_files_path,
-                                    args.validation_train_files_path])
 
-    # Kabit tracks down the StdOut searching for the string 'Validation-rank=value'
-    print(f'Validation-rank={rank_val}')
-    write_results(X, rank_train, rank_val, args.destination, args.model_name)
+def train_native(args: NamedTuple, X: Sequence[str]) -> None:
+    """
+    Trains the model with `lambdamart.LambdaMART`, which takes the same options as
+    RankLib. Features are read from the binary matrix shared by all trials, already
+    normalized.
+    """
+    if args.ranker != 'lambdamart':
+        raise ValueError(f'Native trainer only supports lambdamart, not "{args.ranker}"')
+    params = {'metric2t': 'ERR@10', **parse_ranklib_args(X)}
+    norm = params.pop('norm', 'sum')
+    model = LambdaMART.from_ranklib_args(params, norm=None)
+    model.fit(load_train_matrix(args.train_file_path, norm))
+    model.save(f'{args.destination}/model.txt')
+
+
+def parse_ranklib_args(X: Sequence[str]) -> Dict[str, str]:
+    """
+    Parses arguments such as `['--tree=100', '--leaf 10']` into `{'tree': '100',
+    'leaf': '10'}`.
+    """
+    tokens = ' '.join(X).replace('=', ' ').split()
+    return {name.lstrip('-'): value for name, value in zip(tokens[::2], tokens[1::2])}
+
+
+TRAINERS = {
+    'ranklib': train_ranklib,
+    'native': train_native
+}
+
+
+def estimate_metrics(
+    service: EvaluationService,
+    args: NamedTuple
+) -> Optional[Tuple[Dict[str, float], Dict[str, float]]]:
+    """
+    Estimates the rank of the model over a sample of the validation sets. If the lower
+    bound of its confidence interval is still worse than the best rank found so far
+    then the model is discarded with the estimates as its results, otherwise it must
+    be validated over the full sets so `None` is returned.
+    """
+    if args.objective != 'rank':
+        raise ValueError('Sampled validation only estimates the rank objective.')
+    best_rank = read_best_rank(args.destination)
+    if best_rank is None:
+        return None
+
+    estimate_val, estimate_train = service.estimate(
+        args.validation_files_path,
+        args.validation_train_files_path,
+        rate=args.validation_sample,
+        confidence=args.validation_confidence
+    )
+    if estimate_val.low <= best_rank:
+        print(f'Rank interval overlaps best rank {best_rank}, validating full sets.')
+        return None
+    return {'rank': estimate_val.rank}, {'rank': estimate_train.rank}
 
 
 def get_ranker_index(ranker: str) -> str:
@@ -78,7 +208,7 @@ def get_ranker_index(ranker: str) -> str:
 
 
 def write_results(X: Sequence[str], rank_train: float, rank_val: float,
-                  destination: str, model_name: str):
+                  destination: str, model_name: str, objective: str = 'rank'):
     """
     Write results in persistent disk. Uses the folder of `destination` as main reference
 
@@ -88,13 +218,16 @@ def write_results(X: Sequence[str], rank_train: float, rank_val: float,
           Input arguments as suggested by Katib. It sets the hyperparameters of the
           models.
       rank_train: float
-          Rank value of training data.
+          Value of the objective metric for training data.
       rank_val: float
-          Rank value for validation data.
+          Value of the objective metric for validation data.
       destination: str
           File path where to save results.
       model_name: str
           Name that identifies model being tested.
+      objective: str
+          Name of the metric, which is minimized if it's the rank and maximized
+          otherwise.
     """
     # Katib installs sidecars pods that keeps reading StdOut of the main pod searching
     # for the previously specified pattern. This print tells Katib that this is the
@@ -104,14 +237,14 @@ def write_results(X: Sequence[str], rank_train: float, rank_val: float,
     with open(str(dir_ / 'results.txt'), 'a') as f:
         today_str = datetime.today().strftime('%Y%m%d %H:%M:%S')
         f.write(
-            f'{today_str},{" ".join(X)},rank_train={rank_train},'
-            f'rank_val={rank_val}{os.linesep}'
+            f'{today_str},{" ".join(X)},{objective}_train={rank_train},'
+            f'{objective}_val={rank_val}{os.linesep}'
         )
     best_model_file = dir_ / 'best_model.txt'
     best_rank_file = dir_ / 'best_rank.txt'
-    if os.path.isfile(str(best_rank_file)):
-        best_rank = float(open(str(best_rank_file)).readline())
-        if rank_val < best_rank:
+    best_rank = read_best_rank(destination)
+    if best_rank is not None:
+        if rank_val < best_rank if is_minimized(objective) else rank_val > best_rank:
             with open(str(best_rank_file), 'w') as f:
                 f.write(str(rank_val))
             copyfile(f'{destination}/model.txt', str(best_model_file))
@@ -121,14 +254,11 @@ def write_results(X: Sequence[str], rank_train: float, rank_val: float,
         copyfile(f'{destination}/model.txt', str(best_model_file))
 
 
-def get_partiated_validator(
-    es_host: str,
-    index: str,
-    model_name: str,
-    es_batch: int = 1000
-):
-    return partial(validate_model, es_host=es_host, index=index, model_name=model_name,
-                   es_batch=es_batch)
+def read_best_rank(destination: str) -> Optional[float]:
+    best_rank_file = pathlib.Path(destination) / 'best_rank.txt'
+    if not os.path.isfile(str(best_rank_file)):
+        return None
+    return float(open(str(best_rank_file)).readline())
 
 
 def post_model_to_elasticsearch(es_host, model_name, model_path) -> None:
@@ -189,6 +319,99 @@ if __name__ == '__main__':
         help=('Determines how many items to send at once to Elasticsearch when using '
               'multisearch API.')
     )
+    parser.add_argument(
+        '--es_target_latency',
+        dest='es_target_latency',
+        type=float,
+        default=None,
+        help=('If set then `es_batch` is only the initial batch size, which is adapted '
+              'so each multisearch request takes around this many seconds.')
+    )
+    parser.add_argument(
+        '--validation_replay',
+        dest='validation_replay',
+        type=lambda arg: arg.lower() == 'true',
+        default=False,
+        help=('If "true" then validation searches are captured from Elasticsearch only '
+              'once and each trial rescores them locally with its model.')
+    )
+    parser.add_argument(
+        '--validation_workers',
+        dest='validation_workers',
+        type=int,
+        default=None,
+        help=('Maximum number of processes validating files concurrently. Defaults to '
+              'the number of CPUs.')
+    )
+    parser.add_argument(
+        '--objective',
+        dest='objective',
+        type=str,
+        default='rank',
+        choices=get_metric_names(),
+        help='Validation metric that selects the best model.'
+    )
+    parser.add_argument(
+        '--validation_sample',
+        dest='validation_sample',
+        type=float,
+        default=0,
+        help=('If greater than 0 then the rank is first estimated over this fraction '
+              'of validation queries and full validation only runs when the model may '
+              'beat the best one so far.')
+    )
+    parser.add_argument(
+        '--validation_confidence',
+        dest='validation_confidence',
+        type=float,
+        default=0.95,
+        help='Confidence level of the interval of the estimated rank.'
+    )
+    parser.add_argument(
+        '--validation_early_stop',
+        dest='validation_early_stop',
+        type=float,
+        default=0,
+        help=('If greater than 0 then validation stops once the running rank minus '
+              'this many standard errors is above the best rank so far.')
+    )
+    parser.add_argument(
+        '--validation_early_stop_searches',
+        dest='validation_early_stop_searches',
+        type=int,
+        default=1000,
+        help='Minimum number of searches validated in a file before stopping it.'
+    )
+    parser.add_argument(
+        '--trainer',
+        dest='trainer',
+        type=str,
+        default='ranklib',
+        choices=list(TRAINERS),
+        help=('Either "ranklib" to train with the RankLib jar or "native" to train '
+              'LambdaMART with NumPy.')
+    )
+    parser.add_argument(
+        '--ranklib_heap',
+        dest='ranklib_heap',
+        type=str,
+        default=None,
+        help='Maximum heap size of the JVM running RankLib, such as "4g".'
+    )
+    parser.add_argument(
+        '--ranklib_processors',
+        dest='ranklib_processors',
+        type=int,
+        default=None,
+        help='How many processors the JVM running RankLib sees, which bounds its threads.'
+    )
+    parser.add_argument(
+        '--train_timeout',
+        dest='train_timeout',
+        type=float,
+        default=None,
+        help='Seconds RankLib may train before being killed.'
+    )
     parser.add_argument(
         '--destination',
         dest='destination',
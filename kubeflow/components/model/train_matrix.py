@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import uuid
+import hashlib
+import argparse
+from shutil import rmtree
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from lambdamart import RankingData, load_ranklib_file, normalize_sum
+
+
+"""
+Binary cache of the RankLib training file shared by all Katib trials. The text file is
+parsed just once into a folder next to it, `{train_file_path}.matrix`, containing:
+
+    X.npy: float32 features of each document, shape (documents, features).
+    X_sum.npy: same features normalized by `lambdamart.normalize_sum`.
+    y.npy: float32 graded relevance of each document.
+    offsets.npy: int64 documents of query `i` are in rows `offsets[i]` until
+        `offsets[i + 1]`.
+    meta.json: sha256, size and modification time of the text file the matrix was
+        built from.
+
+Trials memory-map the arrays read-only so concurrent trials on the same node share the
+page cache instead of each one parsing the text file.
+
+The cache can be built ahead of the experiment with:
+
+    python train_matrix.py --train_file_path=/data/train/train_dataset.txt
+"""
+
+
+NORMALIZED = {
+    None: 'X.npy',
+    'sum': 'X_sum.npy'
+}
+
+
+def get_matrix_path(train_file_path: str) -> str:
+    return f'{train_file_path}.matrix'
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def read_meta(path: str) -> Optional[Dict[str, Any]]:
+    meta_path = f'{path}/meta.json'
+    if not os.path.isfile(meta_path):
+        return None
+    return json.loads(open(meta_path).read())
+
+
+def is_current(train_file_path: str, meta: Optional[Dict[str, Any]]) -> bool:
+    """
+    Whether the matrix described by `meta` was built from the current content of the
+    training file. The file is only hashed again if its size or modification time
+    changed.
+    """
+    if meta is None:
+        return False
+    stat = os.stat(train_file_path)
+    if meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] == stat.st_mtime:
+        return True
+    return meta['sha256'] == hash_file(train_file_path)
+
+
+def build_train_matrix(train_file_path: str) -> str:
+    """
+    Converts the training file into the binary matrix unless it's already current.
+
+    Returns
+    -------
+      path: str
+          Folder where the matrix is located.
+    """
+    path = get_matrix_path(train_file_path)
+    if is_current(train_file_path, read_meta(path)):
+        return path
+
+    stat = os.stat(train_file_path)
+    meta = {
+        'sha256': hash_file(train_file_path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    }
+    data = load_ranklib_file(train_file_path)
+
+    # Several trials may convert the same file concurrently so the matrix is moved in
+    # place only once it's complete.
+    tmp_path = f'{path}.{uuid.uuid4().hex}'
+    os.makedirs(tmp_path)
+    np.save(f'{tmp_path}/X.npy', data.X)
+    np.save(f'{tmp_path}/X_sum.npy', normalize_sum(data.X, data.offsets))
+    np.save(f'{tmp_path}/y.npy', data.y)
+    np.save(f'{tmp_path}/offsets.npy', data.offsets)
+    # Written last as it marks the matrix as complete.
+    with open(f'{tmp_path}/meta.json', 'w') as f:
+        f.write(json.dumps(meta))
+
+    if not is_current(train_file_path, read_meta(path)):
+        rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            pass
+    rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def load_train_matrix(train_file_path: str, norm: Optional[str] = None) -> RankingData:
+    """
+    Memory-maps the binary matrix of the training file, building it first if needed.
+
+    Args
+    ----
+      train_file_path: str
+          Path of the RankLib training file.
+      norm: Optional[str]
+          Either `None` for the features as they are in the file or "sum" for them
+          normalized as RankLib's `-norm sum` does.
+
+    Returns
+    -------
+      data: RankingData
+          Read-only arrays backed by the matrix files.
+    """
+    if norm not in NORMALIZED:
+        raise ValueError(f'Invalid value for norm: "{norm}"')
+    path = build_train_matrix(train_file_path)
+    return RankingData(
+        np.load(f'{path}/{NORMALIZED[norm]}', mmap_mode='r'),
+        np.load(f'{path}/y.npy', mmap_mode='r'),
+        np.load(f'{path}/offsets.npy')
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--train_file_path',
+        dest='train_file_path',
+        type=str,
+        help='Path where RankLib training file is located.'
+    )
+    args, _ = parser.parse_known_args(sys.argv[1:])
+    print(build_train_matrix(args.train_file_path))
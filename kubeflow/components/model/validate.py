@@ -4,10 +4,23 @@ import gzip
 import glob
 import json
 import sys
-from typing import List, NamedTuple, Any, Dict
+import time
+from functools import lru_cache
+from multiprocessing import Pool
+from typing import List, NamedTuple, Any, Dict, Optional, Tuple
 from elasticsearch import Elasticsearch
 import numpy as np
 
+from msearch import AdaptiveBatcher
+from query_template import QueryTemplate
+from early_stopping import RankMonitor
+from metrics import get_metric_names
+from query_results import QueryResultsWriter
+from rank_evaluator import RankEvaluator
+from ranklib_model import RankLibModel
+from replay import get_replay_store, replay_metrics
+from sampling import Sample, get_query_key
+
 
 """
 Script responsible for reading validation data and evaluating the performance of a
@@ -15,6 +28,27 @@ trained RankLib model stored on Elasticsearch.
 """
 
 
+# Hardcoded to optimize first 50 skus
+RESCORE_WINDOW_SIZE = 50
+
+# Client of each process validating files, see `init_worker`.
+_es_client = None
+
+
+class ShardResult(NamedTuple):
+    file: str
+    rank_num: float
+    rank_den: int
+    # Sums over searches with purchases of the other metrics.
+    metric_sums: Dict[str, float]
+    queries: int
+    searches: int
+    seconds: float
+    # Numerator and denominator of the rank equation of each query, only when
+    # validating a sample.
+    query_ranks: Optional[Dict[str, Tuple[float, int]]] = None
+
+
 def parse_args(args: List) -> NamedTuple:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -51,6 +85,43 @@ def parse_args(args: List) -> NamedTuple:
         help='Determines how many items to send at once to Elasticsearch when using '
              'multisearch API.'
     )
+    parser.add_argument(
+        '--es_target_latency',
+        dest='es_target_latency',
+        type=float,
+        default=None,
+        help='If set then `es_batch` is only the initial batch size, which is adapted '
+             'so each multisearch request takes around this many seconds.'
+    )
+    parser.add_argument(
+        '--replay',
+        dest='replay',
+        type=lambda arg: arg.lower() == 'true',
+        default=False,
+        help='If "true" then the model rescores documents locally instead of in '
+             'Elasticsearch.'
+    )
+    parser.add_argument(
+        '--model_path',
+        dest='model_path',
+        type=str,
+        default=None,
+        help='Path of the RankLib model file, used when replaying validation.'
+    )
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='How many validation files are processed in parallel.'
+    )
+    parser.add_argument(
+        '--export_path',
+        dest='export_path',
+        type=str,
+        default=None,
+        help='If set then per-query results of each file are saved in this folder.'
+    )
     args, _ = parser.parse_known_args(args)
     return args
 
@@ -60,7 +131,12 @@ def validate_model(
     es_host: str,
     model_name: str,
     index: str = 'pysearchml',
-    es_batch: int = 1000
+    es_batch: int = 1000,
+    es_target_latency: Optional[float] = None,
+    replay: bool = False,
+    model_path: Optional[str] = None,
+    workers: int = 1,
+    export_path: Optional[str] = None
 ) -> float:
     """
     Reads through an input file of searches and customers purchases. For each search,
@@ -83,10 +159,10 @@ def validate_model(
     are located in the retrieve list of documents from Elasticseasrch operating already
     with the trained RankLib model.
 
-    Notice that we use this function in parallel with multiprocessing. That means that
-    its input must be pickleable so Elasticsearch client is instantiated inside the
-    function instead of being an input argument. It breaks Injection Dependecy principle
-    but still works fine.
+    Each `.gz` file in `files_path` is validated by `validate_file` and their partial
+    sums of the rank equation are merged. With `workers` greater than 1 files are
+    distributed over a pool of processes, each one with its own Elasticsearch client
+    whose connections are reused across files.
 
     Args
     ----
@@ -95,46 +171,207 @@ def validate_model(
       model_name: str,
       index: str = 'pysearchml',
       es_batch: int = 1000
+      es_target_latency: Optional[float]
+          If set then the amount of searches sent in each multisearch request is
+          adapted so responses take around this many seconds.
+      replay: bool
+          If `True` then the model in `model_path` rescores documents locally instead
+          of in Elasticsearch. Results of the first-stage query and the features of
+          the rescore window are captured just once for each validation set, see
+          `replay.get_replay_store`.
+      model_path: Optional[str]
+          Path of the RankLib model file, required if `replay` is `True`.
+      workers: int
+          How many files are validated in parallel.
+      export_path: Optional[str]
+          If set then the results of each search are saved in this folder, see
+          `query_results.py`.
+    """
+    if replay:
+        init_worker(es_host)
+        return replay_model(files_path, model_name, index, es_batch, es_target_latency,
+                            model_path)['rank']
+
+    files = get_files(files_path)
+    shards = [(file_, model_name, index, es_batch, es_target_latency, None, None,
+               export_path) for file_ in files]
+    start = time.perf_counter()
+    if workers > 1 and len(files) > 1:
+        with Pool(min(workers, len(files)), initializer=init_worker,
+                  initargs=(es_host,)) as pool:
+            results = pool.starmap(validate_file, shards)
+    else:
+        init_worker(es_host)
+        results = [validate_file(*shard) for shard in shards]
+    return merge_results(results, time.perf_counter() - start)['rank']
+
+
+def get_files(files_path: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(files_path, '*.gz')))
+
+
+def merge_results(results: List[ShardResult], seconds: float) -> Dict[str, float]:
+    """
+    Merges the partial sums of the metrics computed for each file and prints their
+    timings.
+    """
+    rank_num = sum(result.rank_num for result in results)
+    rank_den = sum(result.rank_den for result in results)
+    queries = sum(result.queries for result in results)
+    metrics = dict.fromkeys(get_metric_names()[1:], 0.0)
+    for result in results:
+        for name, value in result.metric_sums.items():
+            metrics[name] = metrics.get(name, 0.0) + value
+    for result in results:
+        print(f'{result.file}: {result.searches} searches in {result.seconds:.2f}s '
+              f'({result.searches / max(result.seconds, 1e-9):.1f} searches/s)')
+    searches = sum(result.searches for result in results)
+    print(f'validated {searches} searches from {len(results)} files in {seconds:.2f}s')
+    # rank=50% if no document was retrieved from Elasticsearch and purchased by
+    # customers.
+    metrics = {
+        'rank': rank_num / rank_den if rank_den else 0.5,
+        **{name: value / queries if queries else 0.0 for name, value in metrics.items()}
+    }
+    print(', '.join(f'{name}={value:.4f}' for name, value in metrics.items()))
+    return metrics
+
+
+def replay_model(
+    files_path: str,
+    model_name: str,
+    index: str,
+    es_batch: int,
+    es_target_latency: Optional[float],
+    model_path: str
+) -> Dict[str, float]:
+    """
+    Computes the metrics of the model in `model_path` by replaying the searches in
+    `files_path` locally, using the client created by `init_worker` to capture them if
+    needed.
     """
-    counter = 1
-    search_arr, purchase_arr = [], []
-    # Defined as lists which works as pointers
-    rank_num, rank_den = [0], [0]
-    es_client = Elasticsearch(hosts=[es_host])
+    batcher = AdaptiveBatcher(es_batch, target_latency=es_target_latency)
+    path = get_replay_store(files_path, _es_client, model_name, index, es_batch,
+                            RESCORE_WINDOW_SIZE, batcher)
+    return replay_metrics(path, RankLibModel.from_file(model_path))
 
-    files = glob.glob(os.path.join(files_path, '*.gz'))
 
-    for file_ in files:
-        for row in gzip.GzipFile(file_):
-            row = json.loads(row)
-            search_keys, docs = row['search_keys'], row['docs']
-            purchase_arr.append(docs)
+def init_worker(es_host: str) -> None:
+    """
+    Creates the Elasticsearch client used by `validate_file` in the current process.
+    """
+    global _es_client
+    _es_client = Elasticsearch(hosts=[es_host])
 
-            search_arr.append(json.dumps({'index': index}))
-            search_arr.append(
-                json.dumps(get_es_query(search_keys, model_name, es_batch))
-            )
 
-            if counter % es_batch == 0:
-                compute_rank(search_arr, purchase_arr, rank_num, rank_den, es_client)
-                search_arr, purchase_arr = [], []
+def validate_file(
+    file_: str,
+    model_name: str,
+    index: str = 'pysearchml',
+    es_batch: int = 1000,
+    es_target_latency: Optional[float] = None,
+    sample: Optional[Sample] = None,
+    monitor: Optional[RankMonitor] = None,
+    export_path: Optional[str] = None
+) -> ShardResult:
+    """
+    Computes the partial sums of the rank equation for the searches in one validation
+    file, using the client created by `init_worker`.
 
-            counter += 1
+    Args
+    ----
+      file_: str
+          Path of gzipped file with searches and purchases.
+      model_name: str
+      index: str
+      es_batch: int
+      es_target_latency: Optional[float]
+      sample: Optional[Sample]
+          If set then only searches of the queries picked in the sample are validated
+          and the rank of each query is returned as well.
+      monitor: Optional[RankMonitor]
+          If set then it's updated after each multisearch batch and raises
+          `early_stopping.EarlyStop` once the file can't beat its best rank.
+      export_path: Optional[str]
+          If set then the results of each search are saved in this folder as
+          `{file name}.npz`.
 
-        if search_arr:
-            compute_rank(search_arr, purchase_arr, rank_num, rank_den, es_client)
-        # return rank=50% if no document was retrieved from Elasticsearch and purchased
-        # by customers.
-        return rank_num[0] / rank_den[0] if rank_den[0] else 0.5
+    Returns
+    -------
+      result: ShardResult
+          Numerator and denominator of the rank equation, how many searches the file
+          has and how long it took to validate them.
+    """
+    start = time.perf_counter()
+    search_arr, purchase_arr, keys, search_keys_arr = [], [], [], []
+    searches = 0
+    query_ranks = None if sample is None else {}
+    writer = None if export_path is None else QueryResultsWriter()
+    evaluator = RankEvaluator()
+    batcher = AdaptiveBatcher(es_batch, target_latency=es_target_latency)
+    header = json.dumps({'index': index})
+
+    for row in gzip.GzipFile(file_):
+        row = json.loads(row)
+        search_keys, docs = row['search_keys'], row['docs']
+        if sample is not None:
+            key = get_query_key(search_keys)
+            if key not in sample.strata:
+                continue
+            keys.append(key)
+        if writer is not None:
+            search_keys_arr.append(search_keys)
+        purchase_arr.append(docs)
+        searches += 1
+
+        search_arr.append(header)
+        search_arr.append(get_es_query(search_keys, model_name, es_batch))
+
+        if batcher.is_full(len(purchase_arr)):
+            ranks = compute_rank(search_arr, purchase_arr, evaluator, _es_client,
+                                 batcher, writer, search_keys_arr)
+            add_query_ranks(query_ranks, keys, ranks)
+            if monitor is not None:
+                monitor.update(ranks)
+            search_arr, purchase_arr, keys, search_keys_arr = [], [], [], []
+
+    if search_arr:
+        ranks = compute_rank(search_arr, purchase_arr, evaluator, _es_client, batcher,
+                             writer, search_keys_arr)
+        add_query_ranks(query_ranks, keys, ranks)
+        if monitor is not None:
+            monitor.update(ranks)
+    if writer is not None:
+        name = os.path.basename(file_).rsplit('.gz', 1)[0]
+        writer.save(os.path.join(export_path, f'{name}.npz'))
+    return ShardResult(file_, evaluator.rank_num, evaluator.rank_den,
+                       evaluator.metric_sums, evaluator.queries, searches,
+                       time.perf_counter() - start, query_ranks)
+
+
+def add_query_ranks(
+    query_ranks: Optional[Dict[str, Tuple[float, int]]],
+    keys: List[str],
+    ranks: List[Optional[np.ndarray]]
+) -> None:
+    if query_ranks is None:
+        return
+    for key, search_ranks in zip(keys, ranks):
+        if search_ranks is not None and search_ranks.size:
+            rank_num, rank_den = query_ranks.get(key, (0.0, 0))
+            query_ranks[key] = (rank_num + float(search_ranks.sum()),
+                                rank_den + search_ranks.size)
 
 
 def compute_rank(
     search_arr: List[str],
     purchase_arr: List[List[Dict[str, List[str]]]],
-    rank_num: List[float],
-    rank_den: List[float],
-    es_client: Elasticsearch
-) -> None:
+    evaluator: RankEvaluator,
+    es_client: Elasticsearch,
+    batcher: Optional[AdaptiveBatcher] = None,
+    writer: Optional[QueryResultsWriter] = None,
+    search_keys_arr: Optional[List[Dict[str, Any]]] = None
+) -> List[Optional[np.ndarray]]:
     """
     Sends queries against Elasticsearch and compares results with what customers
     purchased. Computes the average rank position of where the purchased document falls
@@ -147,39 +384,37 @@ def compute_rank(
           against Elasticsearch and compare results with purchased data
       purchase_arr: List[List[Dict[str, List[str]]]]
           List of documents that were purchased by customers
-      rank_num: List[float]
-          Numerator value of the rank equation. Defined as list to emulate a pointer
-      rank_den: List[float]
+      evaluator: RankEvaluator
+          Accumulates the rank of all searches.
       es_client: Elasticsearch
           Python Elasticsearch client
+      batcher: Optional[AdaptiveBatcher]
+          Sends the request, splitting and retrying it if Elasticsearch rejects it.
+      writer: Optional[QueryResultsWriter]
+          If set then the results of each search are exported from the same response.
+      search_keys_arr: Optional[List[Dict[str, Any]]]
+          Search keys of each search, required by `writer`.
+
+    Returns
+    -------
+      ranks: List[Optional[np.ndarray]]
+          Percentile rank of purchased documents for each search, as returned by
+          `RankEvaluator.evaluate`.
     """
-    idx = 0
     if not search_arr:
-        return
-
-    request = os.linesep.join(search_arr)
-    response = es_client.msearch(body=request, request_timeout=60)
-
-    for hit in response['responses']:
-        docs = [doc['_id'] for doc in hit['hits'].get('hits', [])]
-
-        if not docs or len(docs) < 2:
-            continue
+        return []
 
-        purchased_docs = [
-            docs for purch in purchase_arr[idx] for docs in purch['purchased']
-        ]
-        ranks = np.where(np.in1d(docs, purchased_docs))[0]
-        idx += 1
+    if batcher is None:
+        batcher = AdaptiveBatcher()
+    response = batcher.msearch(es_client, search_arr)
 
-        if ranks.size == 0:
-            continue
+    ranks = evaluator.evaluate(response['responses'], purchase_arr)
+    if writer is not None:
+        writer.write(search_keys_arr, response['responses'], purchase_arr)
 
-        rank_num[0] += ranks.sum() / (len(docs) - 1)
-        rank_den[0] += ranks.size
-
-    print('rank num: ', rank_num[0])
-    print('rank den: ', rank_den[0])
+    print('rank num: ', evaluator.rank_num)
+    print('rank den: ', evaluator.rank_den)
+    return ranks
 
 
 def get_es_query(
@@ -192,34 +427,43 @@ def get_es_query(
 
     Args
     ----
-      args: NamedTuple
-        args.search_keys: Dict[str, Any]
-            Search query sent by the customer as well as other variables that sets its
-            context, such as region, favorite brand and so on.
-        args.model_name: str
-            Name of RankLib model saved on Elasticsearch
-        args.index: str
-            Index on Elasticsearch where to retrieve documents
-        args.es_batch: int
-            How many documents to retrieve
+      search_keys: Dict[str, Any]
+          Search query sent by the customer as well as other variables that sets its
+          context, such as region, favorite brand and so on.
+      model_name: str
+          Name of RankLib model saved on Elasticsearch
+      es_batch: int
+          How many documents to retrieve
 
     Returns
     -------
       query: str
           String representation of final query
     """
+    return get_es_query_template(model_name).render(
+        query=search_keys['search_term'],
+        size=es_batch,
+        search_keys=search_keys,
+        model_name=model_name
+    )
+
+
+@lru_cache(maxsize=None)
+def get_es_query_template(model_name: str) -> QueryTemplate:
+    """
+    Reads and compiles the query of `model_name` just once for all validation searches.
+    """
     # it's expected that a ES query will be available at:
     # ./queries/{model_name}/es_query.json
-    query = open(f'queries/{model_name}/es_query.json').read()
-    query = json.loads(query.replace('{query}', search_keys['search_term']))
+    query = json.loads(open(f'queries/{model_name}/es_query.json').read())
     # We just want to retrieve the id of the document to evaluate the ranks between
     # customers purchases and the retrieve list result
     query['_source'] = '_id'
-    query['size'] = es_batch
-    query['rescore']['window_size'] = 50  # Hardcoded to optimize first 50 skus
-    query['rescore']['query']['rescore_query']['sltr']['params'] = search_keys
-    query['rescore']['query']['rescore_query']['sltr']['model'] = model_name
-    return query
+    query['size'] = '{size}'
+    query['rescore']['window_size'] = RESCORE_WINDOW_SIZE
+    query['rescore']['query']['rescore_query']['sltr']['params'] = '{search_keys}'
+    query['rescore']['query']['rescore_query']['sltr']['model'] = '{model_name}'
+    return QueryTemplate(query, ['query', 'size', 'search_keys', 'model_name'])
 
 
 if __name__ == '__main__':
@@ -229,5 +473,10 @@ if __name__ == '__main__':
         args.es_host,
         args.model_name,
         args.index,
-        args.es_batch
+        args.es_batch,
+        args.es_target_latency,
+        args.replay,
+        args.model_path,
+        args.workers,
+        args.export_path
     )
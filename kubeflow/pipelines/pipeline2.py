@@ -25,7 +25,12 @@ def build_pipeline(
     test_end_date='20160803',
     model_name='lambdamart0',
     ranker='lambdamart',
-    index='pysearchml'
+    trainer='ranklib',
+    index='pysearchml',
+    objective='rank',
+    validation_sample=0,
+    validation_early_stop=0,
+    train_timeout=0
 ):
     pvc = dsl.PipelineVolume(pvc='pysearchml-nfs')
 
@@ -101,6 +106,11 @@ def build_pipeline(
             f'--es_host={es_host}',
             f'--model_name={model_name}',
             f'--ranker={ranker}',
+            f'--trainer={trainer}',
+            f'--objective={objective}',
+            f'--validation_sample={validation_sample}',
+            f'--validation_early_stop={validation_early_stop}',
+            f'--train_timeout={train_timeout}',
             '--name=pysearchml',
             f'--train_file_path=/data/pysearchml/{model_name}/train/train_dataset.txt',
             f'--validation_files_path=/data/pysearchml/{model_name}/validation_regular',
@@ -1,13 +1,14 @@
-import json
-
 from flask import Flask, request, jsonify
 from jinja2 import Environment, FileSystemLoader
 from elasticsearch import Elasticsearch
 
+from queries import get_query_templates
+
 
 es = Elasticsearch('elasticsearch.elastic-system.svc.cluster.local:9200')
 app = Flask(__name__)
 env = Environment(loader=FileSystemLoader('/front/templates'))
+ltr_template, template = get_query_templates('/front/es_query.json')
 
 
 @app.route("/", methods=['GET', 'POST'])
@@ -20,23 +21,14 @@ def index():
 def search():
     try:
         args = request.form.to_dict()
-        es_query = open('/front/es_query.json').read()
         print(args)
         input_query = args['search_term']
         size = args.pop('size')
         model_name = args.pop('model_name')
 
-        es_query = es_query.replace('{query}', input_query)
-        es_query = json.loads(es_query)
-        es_query['size'] = size
-        es_query['_source'] = []
-
-        es_query['rescore']['window_size'] = 500
-        es_query['rescore']['query']['rescore_query']['sltr']['params'] = args
-        es_query['rescore']['query']['rescore_query']['sltr']['model'] = model_name
-
-        if 'ltr_flag' not in args:
-            es_query.pop('rescore')
+        query_template = ltr_template if 'ltr_flag' in args else template
+        es_query = query_template.render(query=input_query, size=size,
+                                         search_keys=args, model_name=model_name)
 
         r = es.search(index='pysearchml', body=es_query).get('hits', {}).get('hits')
         r = [(e['_id'], e['_score']) for e in r]
@@ -0,0 +1,34 @@
+import json
+from typing import Tuple
+
+from query_template import QueryTemplate
+
+
+def get_query_templates(path: str) -> Tuple[QueryTemplate, QueryTemplate]:
+    """
+    Compiles the search query once, with and without the LTR rescore, when the app
+    starts instead of reading it for every search.
+
+    Args
+    ----
+      path: str
+          Path of the Elasticsearch query of the model.
+
+    Returns
+    -------
+      ltr_template: QueryTemplate
+          Query rescored by the LTR model.
+      template: QueryTemplate
+          Query without the rescore.
+    """
+    es_query = json.loads(open(path).read())
+    es_query['size'] = '{size}'
+    es_query['_source'] = []
+
+    es_query['rescore']['window_size'] = 500
+    es_query['rescore']['query']['rescore_query']['sltr']['params'] = '{search_keys}'
+    es_query['rescore']['query']['rescore_query']['sltr']['model'] = '{model_name}'
+    ltr_template = QueryTemplate(es_query, ['query', 'size', 'search_keys', 'model_name'])
+
+    es_query.pop('rescore')
+    return ltr_template, QueryTemplate(es_query, ['query', 'size'])
@@ -0,0 +1,10 @@
+import sys
+import pathlib
+
+
+# The app runs from its own folder with `query_template.py` copied next to it when
+# building its Docker image.
+sys.path.append(str(pathlib.Path(__file__).parents[1]))
+sys.path.append(str(
+    pathlib.Path(__file__).parents[3] / 'kubeflow' / 'components' / 'common'
+))
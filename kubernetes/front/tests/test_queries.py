@@ -0,0 +1,32 @@
+import json
+import pathlib
+
+from queries import get_query_templates
+
+
+ES_QUERY_PATH = str(
+    pathlib.Path(__file__).parents[3] / 'kubeflow' / 'components' / 'model' / 'queries' /
+    'lambdamart0' / 'es_query.json'
+)
+
+
+def test_get_query_templates():
+    ltr_template, template = get_query_templates(ES_QUERY_PATH)
+
+    assert ltr_template.names == {'query', 'size', 'search_keys', 'model_name'}
+    assert template.names == {'query', 'size'}
+
+    search_keys = {'search_term': 'keyword', 'channel_group': 'organic'}
+    ltr_query = json.loads(ltr_template.render(query='keyword', size=10,
+                                               search_keys=search_keys,
+                                               model_name='model'))
+    assert ltr_query['size'] == 10
+    assert ltr_query['_source'] == []
+    sltr = ltr_query['rescore']['query']['rescore_query']['sltr']
+    assert sltr['params'] == search_keys
+    assert sltr['model'] == 'model'
+    assert 'keyword' in json.dumps(ltr_query['query'])
+
+    query = json.loads(template.render(query='keyword', size=10))
+    assert 'rescore' not in query
+    assert query['query'] == ltr_query['query']